@@ -0,0 +1,314 @@
+"""
+coarse-to-fine region scoring: score a coarse grid first, then refine only where the
+score field is not flat.
+
+    python adaptive_scoring.py model/best_model.pth --levels 0.1,0.05,0.01 --threshold 0.25 \
+        --output adaptive_grid.npz --flat-output score_grid.npz --compare
+
+coarse cells are scored from aggregates of the same feature layers the base cells use:
+the mean of each tabular layer (the mode for land cover) and a mosaic of the tile images
+resized to the model input. a cell is split into its children at the next level when
+  - its score disagrees with one of its 8 neighbours by more than --threshold, or
+  - its inputs are heterogeneous: the mean within-cell std of the standardized tabular
+    layers is above --spread-threshold (a stand-in for the score variance, known before
+    any child is scored)
+the result keeps one ScoreGrid per level holding that level's leaf cells, and flattens
+to a base resolution ScoreGrid that /score and /aggregate can serve.
+"""
+import argparse
+import json
+import math
+import os
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+import torch
+from PIL import Image
+
+from fusion import load_scoring_model
+from preprocess import Preprocessor
+from score_grid import CELL_SIZE, ROI_BOUNDS, ScoreGrid
+
+LEVELS = [0.1, 0.05, 0.01]
+FEATURE_CSV_PATH = "../model/data/tile_features.csv"
+IMAGE_DIR = "../model/earth_engine/converted_png"
+FEATURE_SCALER_PATH = "scalers/feature_scaler.pkl"
+SCORE_SCALER_PATH = "scalers/score_scaler.pkl"
+TABULAR_FEATURES = [
+   'elevation', 'land_cover_class', 'mean_distance_to_water', 'mean_ndvi', 'nighttime_light', 'slope'
+]
+CATEGORICAL_FEATURES = {'land_cover_class'}
+CSV_CHUNK_ROWS = 100_000
+
+
+# --------------------------
+# feature layers at the base resolution
+# --------------------------
+def tile_cells(grid, geo):
+    # grid cells of tile polygons (.geo geojson strings), by the centre of each tile's south-west cell
+    sw = np.array([np.asarray(json.loads(g)["coordinates"][0])[:, :2].min(axis=0) for g in geo])
+    return grid.index(sw[:, 0] + grid.cell_size / 2, sw[:, 1] + grid.cell_size / 2)
+
+
+class FeatureLayers:
+    # raw tabular layers as an (H, W, D) raster (nan = no tile) and the tile images by cell
+    def __init__(self, grid, features, image_paths, feature_names=TABULAR_FEATURES):
+        self.grid = grid
+        self.features = features
+        self.image_paths = image_paths
+        self.feature_names = list(feature_names)
+        self.categorical = [i for i, name in enumerate(self.feature_names) if name in CATEGORICAL_FEATURES]
+        self.has_data = ~np.isnan(features).any(axis=2)
+
+    @classmethod
+    def from_tiles(cls, csv_path=FEATURE_CSV_PATH, image_dir=IMAGE_DIR, bounds=ROI_BOUNDS, cell_size=CELL_SIZE,
+                   feature_names=TABULAR_FEATURES, chunksize=CSV_CHUNK_ROWS):
+        # tile_features.csv from the earth engine export: one row per tile, geometry in .geo.
+        # read a chunk at a time and only rows inside bounds are kept, so a window of a large
+        # region costs memory for the window alone
+        grid = ScoreGrid(bounds, cell_size)
+        features = np.full((grid.height, grid.width, len(feature_names)), np.nan, dtype=np.float32)
+        image_paths = {}
+        for df in pd.read_csv(csv_path, chunksize=chunksize):
+            rows, cols, valid = tile_cells(grid, df[".geo"])
+            df, rows, cols = df[valid], rows[valid], cols[valid]
+            features[rows, cols] = df[feature_names].to_numpy(np.float32)
+            for row, col, tile_id in zip(rows, cols, df["tile_id"]):
+                path = os.path.join(image_dir, f"sentinel2_{tile_id}.png")
+                if os.path.exists(path):
+                    image_paths[(int(row), int(col))] = path
+                else:
+                    features[row, col] = np.nan  # a cell is only scoreable with both its layers and its image
+        return cls(grid, features, image_paths, feature_names)
+
+    # --- blocks: a coarse cell at `factor` covers factor x factor base cells ---
+    def blocks(self, array, factor):
+        # pads with nan to a whole number of blocks, returns (H/f, f, W/f, f, ...)
+        height, width = math.ceil(self.grid.height / factor), math.ceil(self.grid.width / factor)
+        padded = np.full((height * factor, width * factor) + array.shape[2:], np.nan, dtype=np.float32)
+        padded[:self.grid.height, :self.grid.width] = array
+        return padded.reshape((height, factor, width, factor) + array.shape[2:])
+
+    def coverage(self, factor):
+        return ~np.isnan(self.blocks(np.where(self.has_data, 1.0, np.nan), factor)).all(axis=(1, 3))
+
+    def spread(self, factor, feature_weight):
+        # mean over layers of the within-cell std, each layer in standard deviations of the training data
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # all-nan blocks are just cells without data
+            std = np.nanstd(self.blocks(self.features, factor), axis=(1, 3))
+        return np.nan_to_num(std * np.abs(feature_weight)).mean(axis=2)
+
+    def tabular(self, factor, row, col):
+        cell = self.features[row * factor:(row + 1) * factor, col * factor:(col + 1) * factor].reshape(-1, len(self.feature_names))
+        cell = cell[~np.isnan(cell).any(axis=1)]
+        vector = cell.mean(axis=0)
+        for i in self.categorical:
+            values, counts = np.unique(cell[:, i], return_counts=True)
+            vector[i] = values[counts.argmax()]
+        return vector
+
+    def image(self, factor, row, col):
+        # mosaic of the cell's tiles; tiles missing from the mosaic get the mean colour of the others
+        tiles = {}
+        for r in range(row * factor, min((row + 1) * factor, self.grid.height)):
+            for c in range(col * factor, min((col + 1) * factor, self.grid.width)):
+                path = self.image_paths.get((r, c))
+                if path:
+                    tiles[(r - row * factor, c - col * factor)] = Image.open(path).convert("RGB")
+        if factor == 1:
+            return next(iter(tiles.values()))
+
+        size = next(iter(tiles.values())).size[0]
+        fill = np.mean([np.asarray(t).reshape(-1, 3).mean(axis=0) for t in tiles.values()], axis=0)
+        mosaic = Image.new("RGB", (factor * size, factor * size), tuple(int(v) for v in fill))
+        for (r, c), tile in tiles.items():
+            mosaic.paste(tile.resize((size, size)), (c * size, r * size))
+        return mosaic
+
+
+# --------------------------
+# scoring
+# --------------------------
+def score_cells(model, preprocessor, layers, factor, rows, cols, batch_size=64):
+    scores = np.empty(len(rows), dtype=np.float32)
+    for start in range(0, len(rows), batch_size):
+        batch = list(zip(rows[start:start + batch_size], cols[start:start + batch_size]))
+        images = [preprocessor.resize(layers.image(factor, row, col)) for row, col in batch]
+        tabular = torch.from_numpy(np.stack([layers.tabular(factor, row, col) for row, col in batch]))
+        with torch.no_grad():
+            scores[start:start + len(batch)] = model(preprocessor.batch(images), tabular).reshape(-1).numpy()
+    return scores
+
+
+def neighbour_disagreement(scores):
+    # max |score - neighbour| over the 8 neighbours, nan neighbours ignored
+    padded = np.pad(scores, 1, constant_values=np.nan)
+    height, width = scores.shape
+    worst = np.zeros_like(scores)
+    for dr in (-1, 0, 1):
+        for dc in (-1, 0, 1):
+            if dr or dc:
+                shifted = padded[1 + dr:1 + dr + height, 1 + dc:1 + dc + width]
+                worst = np.fmax(worst, np.abs(scores - shifted))
+    return np.nan_to_num(worst)
+
+
+class AdaptiveGrid:
+    # one ScoreGrid per level; each holds scores only for that level's leaf cells.
+    # has_data is the base resolution mask of cells with a tile
+    def __init__(self, levels, has_data=None):
+        self.levels = levels
+        self.has_data = has_data
+
+    def to_score_grid(self):
+        # every base cell with data takes the score of the leaf covering it; cells without
+        # a tile stay nan, so /aggregate and exported maps never report scores for them
+        base = self.levels[-1]
+        flat = ScoreGrid([base.west, base.south, base.east, base.north], base.cell_size)
+        for level in self.levels:
+            factor = int(round(level.cell_size / base.cell_size))
+            painted = np.repeat(np.repeat(level.scores, factor, axis=0), factor, axis=1)[:flat.height, :flat.width]
+            flat.scores = np.where(np.isnan(painted), flat.scores, painted)
+        if self.has_data is not None:
+            flat.scores = np.where(self.has_data, flat.scores, np.nan).astype(np.float32)
+        return flat
+
+    def save(self, path):
+        extra = {} if self.has_data is None else {"has_data": self.has_data}
+        np.savez_compressed(path, bounds=np.array([self.levels[0].west, self.levels[0].south,
+                                                   self.levels[0].east, self.levels[0].north]),
+                            cell_sizes=np.array([level.cell_size for level in self.levels]),
+                            **{f"level{i}": level.scores for i, level in enumerate(self.levels)}, **extra)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        bounds = data["bounds"].tolist()
+        return cls([ScoreGrid(bounds, cell_size, scores=data[f"level{i}"])
+                    for i, cell_size in enumerate(data["cell_sizes"].tolist())],
+                   data["has_data"] if "has_data" in data else None)
+
+
+def adaptive_score(model, layers, levels=LEVELS, threshold=0.25, spread_threshold=0.5, batch_size=64):
+    # returns (AdaptiveGrid, report)
+    base = layers.grid.cell_size
+    factors = [int(round(level / base)) for level in levels]
+    if any(abs(f * base - level) > 1e-9 for f, level in zip(factors, levels)) or \
+            any(a % b for a, b in zip(factors, factors[1:])):
+        raise ValueError(f"levels {levels} must be nested multiples of the {base} base cell")
+    if factors[-1] != 1:
+        raise ValueError("the last level must be the base resolution")
+
+    preprocessor = Preprocessor(image_size=model.image_size)
+    feature_weight = model.feature_weight.numpy() if hasattr(model, "feature_weight") else np.ones(len(layers.feature_names))
+    bounds = [layers.grid.west, layers.grid.south, layers.grid.east, layers.grid.north]
+    report = {"levels": [], "threshold": threshold, "spread_threshold": spread_threshold}
+    grids, refine, inherited = [], None, None
+    t0 = time.perf_counter()
+
+    for k, factor in enumerate(factors):
+        todo = layers.coverage(factor)
+        scores = np.full(todo.shape, np.nan, dtype=np.float32)
+        if refine is not None:
+            ratio = factors[k - 1] // factor
+            expand = lambda a: np.repeat(np.repeat(a, ratio, axis=0), ratio, axis=1)[:todo.shape[0], :todo.shape[1]]
+            todo &= expand(refine)
+            scores = expand(inherited)  # unrefined neighbours keep their coarse score for the disagreement test
+
+        rows, cols = np.nonzero(todo)
+        t_level = time.perf_counter()
+        scores[rows, cols] = score_cells(model, preprocessor, layers, factor, rows, cols, batch_size)
+        level_seconds = time.perf_counter() - t_level
+
+        if k == len(factors) - 1:
+            refine = np.zeros_like(todo)
+        else:
+            refine = todo & ((neighbour_disagreement(scores) > threshold) |
+                             (layers.spread(factor, feature_weight) > spread_threshold))
+        leaves = todo & ~refine
+        grid = ScoreGrid(bounds, levels[k], scores=np.where(leaves, scores, np.nan).astype(np.float32))
+        grids.append(grid)
+        inherited = scores
+        evaluated = int(todo.sum())
+        report["levels"].append({"cell_size": levels[k], "evaluated": evaluated, "refined": int(refine.sum()),
+                                 "leaves": int(leaves.sum()), "seconds": round(level_seconds, 3),
+                                 "ms_per_evaluation": round(1000 * level_seconds / evaluated, 3) if evaluated else None})
+
+    # coarse evaluations build a mosaic of factor^2 tiles, so they cost several fine ones; the
+    # evaluation count alone overstates the saving. wall time is compared against a dense scan
+    # estimated from the base level's own per-tile cost (--compare measures it instead)
+    evaluations = sum(level["evaluated"] for level in report["levels"])
+    full_scan = int(layers.has_data.sum())
+    seconds = time.perf_counter() - t0
+    base_level = report["levels"][-1]
+    estimate = base_level["ms_per_evaluation"] * full_scan / 1000 if base_level["ms_per_evaluation"] else None
+    report.update(evaluations=evaluations, full_scan_evaluations=full_scan,
+                  evaluations_saved=full_scan - evaluations,
+                  saved_fraction=round(1 - evaluations / full_scan, 4) if full_scan else 0.0,
+                  seconds=round(seconds, 3),
+                  full_scan_seconds_estimate=None if estimate is None else round(estimate, 3),
+                  wall_time_saved_fraction=round(1 - seconds / estimate, 4) if estimate else None)
+    return AdaptiveGrid(grids, layers.has_data.copy()), report
+
+
+def full_scan(model, layers, batch_size=64):
+    rows, cols = np.nonzero(layers.has_data)
+    grid = ScoreGrid([layers.grid.west, layers.grid.south, layers.grid.east, layers.grid.north], layers.grid.cell_size)
+    grid.scores[rows, cols] = score_cells(model, Preprocessor(image_size=model.image_size), layers, 1, rows, cols,
+                                          batch_size)
+    return grid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="coarse-to-fine adaptive region scoring")
+    parser.add_argument("checkpoint", nargs="?", default="model/best_model.pth")
+    parser.add_argument("--levels", default=",".join(str(level) for level in LEVELS), help="coarse to fine, degrees")
+    parser.add_argument("--threshold", type=float, default=0.25, help="neighbour disagreement, score units")
+    parser.add_argument("--spread-threshold", type=float, default=0.5, help="within-cell input std, in training stds")
+    parser.add_argument("--features", default=FEATURE_CSV_PATH)
+    parser.add_argument("--image-dir", default=IMAGE_DIR)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--output", default="adaptive_grid.npz", help="multi-resolution grid")
+    parser.add_argument("--flat-output", help="base resolution ScoreGrid .npz for SCORE_GRID_PATH")
+    parser.add_argument("--compare", action="store_true", help="also run the full scan and report the error")
+    parser.add_argument("--report", default="adaptive_report.json")
+    args = parser.parse_args()
+
+    model, _ = load_scoring_model(args.checkpoint, len(TABULAR_FEATURES), FEATURE_SCALER_PATH, SCORE_SCALER_PATH)
+    layers = FeatureLayers.from_tiles(args.features, args.image_dir)
+    grid, report = adaptive_score(model, layers, [float(level) for level in args.levels.split(",")],
+                                  args.threshold, args.spread_threshold, args.batch_size)
+    grid.save(args.output)
+    if args.flat_output:
+        grid.to_score_grid().save(args.flat_output)
+
+    if args.compare:
+        t0 = time.perf_counter()
+        full = full_scan(model, layers, args.batch_size)
+        err = np.abs(grid.to_score_grid().scores - full.scores)[layers.has_data]
+        full_seconds = time.perf_counter() - t0
+        report["full_scan"] = {"seconds": round(full_seconds, 3), "mae": float(err.mean()),
+                               "max_abs_error": float(err.max()), "p95_abs_error": float(np.percentile(err, 95))}
+        report["wall_time_saved_fraction"] = round(1 - report["seconds"] / full_seconds, 4)
+
+    for level in report["levels"]:
+        print(f"{level['cell_size']:>6g} deg: {level['evaluated']:>6} evaluated, {level['refined']:>6} refined, "
+              f"{level['leaves']:>6} leaves ({level['seconds']:.1f}s)")
+    print(f"{report['evaluations']} model evaluations vs {report['full_scan_evaluations']} for a full scan "
+          f"({report['saved_fraction']:.1%} fewer)")
+    dense = report["full_scan"]["seconds"] if args.compare else report["full_scan_seconds_estimate"]
+    if dense:
+        print(f"wall time {report['seconds']:.1f}s vs {dense:.1f}s for a full scan "
+              f"({'measured' if args.compare else 'estimated'}, {report['wall_time_saved_fraction']:.1%} saved)")
+    if args.compare:
+        print(f"vs full scan: mae {report['full_scan']['mae']:.4f}, p95 {report['full_scan']['p95_abs_error']:.4f}, "
+              f"max {report['full_scan']['max_abs_error']:.4f}")
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,46 @@
+import hmac
 import os
-import joblib
+import time
 import torch
-import torch.nn as nn
-from torchvision import models, transforms
-from flask import Flask, request, jsonify
-from PIL import Image
+from flask import Flask, request, jsonify, g
+from PIL import UnidentifiedImageError
 import numpy as np
 import json
+from concurrent.futures import ThreadPoolExecutor
 from flask_cors import CORS
 
+import metrics
+from preprocess import load_upload
+from feature_store import FeatureStore
+from registry import ModelRegistry
+from score_grid import ScoreGrid
+from water_points import WaterPointIndex
 
-# --------------------------
-# model definition
-# --------------------------
-class CNNTFMModel(nn.Module):
-    def __init__(self, tabular_dim):
-        super().__init__()
-
-        resnet = models.resnet18(pretrained=True)
-        self.cnn = nn.Sequential(*list(resnet.children())[:-1])
-        self.cnn_out_dim = resnet.fc.in_features
-
-        self.fc = nn.Sequential(
-            nn.Linear(self.cnn_out_dim + tabular_dim, 256),
-            nn.ReLU(),
-            nn.Dropout(0.5),
-            nn.Linear(256, 1)
-        )
-
-    def forward(self, image, tabular):
-        cnn_feat = self.cnn(image)
-        cnn_feat = cnn_feat.view(image.size(0), -1)
-        x = torch.cat((cnn_feat, tabular), dim=1)
-        return self.fc(x).squeeze()
 
 # --------------------------
 # Configurations
 # --------------------------
-MODEL_PATH = "model/best_model.pth"  
+MODEL_PATH = os.environ.get("MODEL_PATH", "model/best_model.pth")
+MODEL_VERSION = os.environ.get("MODEL_VERSION", os.path.splitext(os.path.basename(MODEL_PATH))[0])
+MODEL_VERSIONS = os.environ.get("MODEL_VERSIONS", "")  # extra resident versions, "name=path,name=path"
+SHADOW_VERSION = os.environ.get("SHADOW_VERSION")
+PRELOAD_MODEL_VERSIONS = os.environ.get("PRELOAD_MODEL_VERSIONS", "0") == "1"  # set by gunicorn.conf.py
+MODEL_STATE_PATH = os.environ.get("MODEL_STATE_PATH")  # versions/default/shadow shared by workers, see registry.py
+WEIGHT_SHARING = os.environ.get("WEIGHT_SHARING", "none")  # none | mmap | fork, see registry.py
+VERSION_HEADER = "X-Model-Version"
 FEATURE_SCALER_PATH = "scalers/feature_scaler.pkl"
 SCORE_SCALER_PATH = "scalers/score_scaler.pkl"
+SCORE_GRID_PATH = os.environ.get("SCORE_GRID_PATH", "../frontend/kenya_water_equity.geojson")  # .geojson or .npz
+WATER_POINTS_PATH = os.environ.get("WATER_POINTS_PATH", "../model/data/wpdx_cleaned.csv")
+FEATURE_STORE_PATH = os.environ.get("FEATURE_STORE_PATH", "feature_store")  # built by feature_store.py
+MAX_QUERY_POINTS = 10000
+MAX_NEAREST_K = 100  # neighbours per point for /water-points/nearest
+MAX_STORED_TILES = int(os.environ.get("MAX_STORED_TILES", "1024"))  # per /predict lookup request
+STORE_BATCH_SIZE = int(os.environ.get("STORE_BATCH_SIZE", "64"))
+TIMING_HEADER = os.environ.get("TIMING_HEADER", "0") == "1"  # or per request with "X-Timing: 1"
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")  # bearer token for runtime admin changes; unset disables them
 
 TABULAR_FEATURES = [
    'elevation', 'land_cover_class', 'mean_distance_to_water', 'mean_ndvi', 'nighttime_light', 'slope'
@@ -49,28 +50,128 @@ TABULAR_FEATURES = [
 # --------------------------
 # load Model and scalers
 # --------------------------
-feature_scaler = joblib.load(FEATURE_SCALER_PATH)
-score_scaler = joblib.load(SCORE_SCALER_PATH)
-
+# input resolution and backbone: env, else the checkpoint's metadata, else the resnet18/224 default.
+# point MODEL_PATH at a distilled student (model/training/distill.py) to serve it instead.
+# the scalers live inside the model as affine buffers; a checkpoint folded with fold_scalers.py
+# loads without importing sklearn/joblib, a plain one has the pickled scalers folded in at startup.
+# the default version loads before serving; MODEL_VERSIONS load in the background, or before
+# serving with PRELOAD_MODEL_VERSIONS=1: under gunicorn preload_app the app is imported in the
+# master, and a load thread started there doesn't survive the fork into the workers.
+# the env config is then published as the desired state (with MODEL_STATE_PATH, to the file the
+# workers poll), so a restart resets changes made through /models. that file needs preload_app,
+# as in gunicorn.conf.py: without it every worker import would publish, and a restarted worker
+# would reset the others
 tabular_dim = len(TABULAR_FEATURES)
-model = CNNTFMModel(tabular_dim=tabular_dim)
-model.load_state_dict(torch.load(MODEL_PATH, map_location="cpu"))
-model.eval()
+models = ModelRegistry(tabular_dim, FEATURE_SCALER_PATH, SCORE_SCALER_PATH, weight_sharing=WEIGHT_SHARING,
+                       state_path=MODEL_STATE_PATH)
+models.load(MODEL_VERSION, MODEL_PATH, make_default=True,
+            image_size=os.environ.get("IMAGE_SIZE"), backbone=os.environ.get("MODEL_BACKBONE"))
+extra_versions = {}
+for spec in filter(None, MODEL_VERSIONS.split(",")):
+    name, path = spec.split("=", 1)
+    extra_versions[name.strip()] = path.strip()
+if PRELOAD_MODEL_VERSIONS:
+    for name, path in extra_versions.items():
+        models.try_load(name, path)
+# versions not loaded yet load in the background; the shadow takes effect once its version has loaded
+models.update(lambda state: state.update(versions={MODEL_VERSION: MODEL_PATH, **extra_versions},
+                                         default=MODEL_VERSION, shadow=SHADOW_VERSION or None))
+shadow_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow")
+
+# score grid for /score and /aggregate (optional, the model still serves without it)
+score_grid = ScoreGrid.load(SCORE_GRID_PATH) if os.path.exists(SCORE_GRID_PATH) else None
+
+# water point index for nearest-source queries (optional as well)
+water_points = WaterPointIndex(WATER_POINTS_PATH) if os.path.exists(WATER_POINTS_PATH) else None
+
+# memory-mapped model inputs per tile, so /predict can score by tile id or location (optional)
+feature_store = FeatureStore(FEATURE_STORE_PATH) if os.path.exists(FEATURE_STORE_PATH) else None
+
+# --------------------------
+# image preprocessing (each model version carries a preprocessor for its input size)
+# --------------------------
+IMAGE_FIELDS = ("image", "pixels", "tensor")
 
 # --------------------------
-# image preprocessing
+# metrics
 # --------------------------
-img_transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-])
+REQUESTS = metrics.REGISTRY.counter("canai_requests_total", "HTTP requests", labels=("endpoint", "status"))
+REQUEST_LATENCY = metrics.REGISTRY.histogram("canai_request_seconds", "End to end request latency", labels=("endpoint",))
+REQUEST_BYTES = metrics.REGISTRY.histogram("canai_request_bytes", "Request body size", labels=("endpoint",),
+                                           buckets=metrics.SIZE_BUCKETS)
+STAGE_LATENCY = metrics.REGISTRY.histogram("canai_predict_stage_seconds", "Latency per /predict/ stage", labels=("stage",))
+IMAGE_PIXELS = metrics.REGISTRY.histogram("canai_image_dimension_pixels", "Uploaded image width and height",
+                                          labels=("axis",), buckets=metrics.PIXEL_BUCKETS)
+BATCH_SIZE = metrics.REGISTRY.histogram("canai_batch_size", "Tiles per model forward pass", buckets=metrics.BATCH_BUCKETS)
+PREDICTIONS = metrics.REGISTRY.counter("canai_predictions_total", "Predictions served", labels=("version", "role"))
+SHADOW_DIFF = metrics.REGISTRY.histogram("canai_shadow_abs_diff", "Absolute score difference, shadow vs primary",
+                                         labels=("version",), buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0))
+metrics.REGISTRY.gauge("canai_model_tensor_bytes", "Parameter and buffer bytes per resident model version",
+                       labels=("version",), fn=lambda: {(v.name,): v.tensor_bytes for v in models.versions.values()})
+metrics.REGISTRY.gauge("canai_cache_hits", "Cache hits since start", labels=("cache",),
+                       fn=lambda: {("score_grid_mask",): score_grid.mask_hits if score_grid else 0})
+metrics.REGISTRY.gauge("canai_cache_misses", "Cache misses since start", labels=("cache",),
+                       fn=lambda: {("score_grid_mask",): score_grid.mask_misses if score_grid else 0})
+
+profiler = metrics.ProfilerSampler(PROFILE_SAMPLE_RATE, PROFILE_DIR)
+metrics.REGISTRY.gauge("canai_profile_sample_rate", "Fraction of requests traced by the torch profiler",
+                       fn=lambda: profiler.sample_rate)
+metrics.REGISTRY.gauge("canai_profile_traces", "Profiler traces written since start",
+                       fn=lambda: profiler.traces_written)
 
 # --------------------------
 # app
 # --------------------------
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["Server-Timing"])
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.timer = None
+    models.poll()  # model changes made through other workers
+
+@app.after_request
+def record_request(response):
+    endpoint = request.endpoint or "unknown"
+    if endpoint != "prometheus_metrics":
+        REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+        REQUEST_LATENCY.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+        if request.content_length:
+            REQUEST_BYTES.observe(request.content_length, endpoint=endpoint)
+    if g.timer is not None and (TIMING_HEADER or request.headers.get("X-Timing") == "1"):
+        response.headers["Server-Timing"] = g.timer.server_timing()
+    return response
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    # this worker's metrics only, see metrics.py
+    return metrics.REGISTRY.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+def admin_error():
+    # None when the request carries ADMIN_TOKEN as a bearer token, else the error response
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Admin endpoints are disabled, set ADMIN_TOKEN to enable them"}), 403
+    supplied = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(supplied.encode(), f"Bearer {ADMIN_TOKEN}".encode()):
+        return jsonify({"error": "Admin token required"}), 401
+    return None
+
+@app.route("/debug/profiling", methods=["GET", "POST"])
+def profiling():
+    # switch sampled torch profiler traces on or off at runtime. only the rate can be changed
+    # over http; traces always go to PROFILE_DIR
+    if request.method == "POST":
+        error = admin_error()
+        if error:
+            return error
+        body = request.get_json(silent=True) or {}
+        try:
+            profiler.configure(sample_rate=body.get("sample_rate"))
+        except (TypeError, ValueError):
+            return jsonify({"error": "sample_rate must be a number between 0 and 1"}), 400
+    return jsonify({"sample_rate": profiler.sample_rate, "trace_dir": profiler.trace_dir,
+                    "traces_written": profiler.traces_written})
 
 @app.route("/ping", methods=["GET"])
 def ping():
@@ -78,33 +179,315 @@ def ping():
 
 @app.route("/predict/", methods=["POST"])
 def predict():
-    if "image" not in request.files or "features" not in request.form:
+    timer = g.timer = metrics.StageTimer()
+
+    with timer.stage("parse"):
+        has_inputs = any(f in request.files for f in IMAGE_FIELDS) and "features" in request.form
+    if not has_inputs:
         return jsonify({"error": "Provide both image and features"}), 400
 
-    # load and transform image
-    image_file = request.files["image"]
-    image = Image.open(image_file).convert("RGB")
-    img_tensor = img_transform(image).unsqueeze(0)  # (1, 3, 224, 224)
+    # route to a resident model version; the reference is held for the whole request,
+    # so a swap or unload mid-request never changes the model under it
+    try:
+        version = models.get(request.headers.get(VERSION_HEADER))
+    except KeyError:
+        return jsonify({"error": f"Unknown model version: {request.headers.get(VERSION_HEADER)}"}), 404
+    preprocessor = version.preprocessor
+
+    # load image (or raw pixels / packed tensor) at model size
+    with timer.stage("decode"):
+        try:
+            pixels, (width, height) = load_upload(preprocessor, request.files)
+        except (UnidentifiedImageError, ValueError) as e:
+            return jsonify({"error": f"Invalid image: {e}"}), 400
+    IMAGE_PIXELS.observe(width, axis="width")
+    IMAGE_PIXELS.observe(height, axis="height")
+    with timer.stage("transform"):
+        img_tensor = preprocessor.batch([pixels])  # (1, 3, image_size, image_size)
 
     # parse the tabular features
-    features_json = request.form["features"]
-    features = json.loads(features_json)
+    with timer.stage("json"):
+        features_json = request.form["features"]
+        features = json.loads(features_json)
     try:
         feature_vector = np.array([features[feat] for feat in TABULAR_FEATURES], dtype=np.float32).reshape(1, -1)
     except KeyError as e:
         return jsonify({"error": f"Missing feature: {e}"}), 400
 
-    # scale features
-    scaled_tabular = feature_scaler.transform(feature_vector)
-    tab_tensor = torch.from_numpy(scaled_tabular).float()
+    # predict (feature scaling and score inverse scaling are fused into the model)
+    tab_tensor = torch.from_numpy(feature_vector)
+    BATCH_SIZE.observe(img_tensor.shape[0])
+    with torch.no_grad(), profiler.maybe_profile("predict"):
+        with timer.stage("forward"):
+            pred_score = version.model(img_tensor, tab_tensor).item()
+    PREDICTIONS.inc(version=version.name, role="primary")
+
+    shadow = models.get_shadow()
+    if shadow is not None and shadow is not version:
+        shadow_pool.submit(score_shadow, shadow, [pixels], tab_tensor, [pred_score])
+
+    timer.observe(STAGE_LATENCY)
+    return jsonify({"predicted_score": float(pred_score), "model_version": version.name})
+
+@app.route("/predict", methods=["GET", "POST"])
+def predict_stored():
+    # score tiles whose inputs are already in the feature store, no upload:
+    #   GET  /predict?tile_id=a,b   or   /predict?lat=..&lon=..
+    #   POST {"tile_ids": [...]}    or   {"points": [[lat, lon], ...]}
+    if feature_store is None:
+        return jsonify({"error": "Feature store not loaded"}), 503
+    timer = g.timer = metrics.StageTimer()
 
-    # predict
+    with timer.stage("lookup"):
+        body = (request.get_json(silent=True) or {}) if request.method == "POST" else {}
+        try:
+            if "tile_ids" in body or "tile_id" in request.args:
+                keys = body["tile_ids"] if "tile_ids" in body else request.args["tile_id"].split(",")
+                if not isinstance(keys, list) or not keys:
+                    raise ValueError("tile_ids must be a non-empty list")
+                positions = feature_store.by_tile_ids(keys)
+            elif "points" in body:
+                lat, lon = parse_query_points(body)
+                positions = feature_store.by_points(lat, lon)
+                keys = [[float(a), float(b)] for a, b in zip(lat, lon)]
+            elif "lat" in request.args and "lon" in request.args:
+                lat, lon = check_coordinates(float(request.args["lat"]), float(request.args["lon"]))
+                positions = feature_store.by_points([lat], [lon])
+                keys = [[lat, lon]]
+            else:
+                return jsonify({"error": "Provide tile_id(s) or lat/lon point(s)"}), 400
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+    if len(positions) > MAX_STORED_TILES:
+        return jsonify({"error": f"at most {MAX_STORED_TILES} tiles per request"}), 400
+
+    try:
+        version = models.get(request.headers.get(VERSION_HEADER))
+    except KeyError:
+        return jsonify({"error": f"Unknown model version: {request.headers.get(VERSION_HEADER)}"}), 404
+    preprocessor = version.preprocessor
+
+    found = np.flatnonzero(positions >= 0)
+    scores = np.empty(len(found), dtype=np.float32)
+    shadow = models.get_shadow()
+    for start in range(0, len(found), STORE_BATCH_SIZE):
+        chunk = positions[found[start:start + STORE_BATCH_SIZE]]
+        with timer.stage("transform"):
+            try:
+                items, tabular = feature_store.inputs(chunk, preprocessor)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 409
+            img_tensor = preprocessor.batch(items)
+            tab_tensor = torch.from_numpy(tabular)
+        BATCH_SIZE.observe(len(chunk))
+        with torch.no_grad(), profiler.maybe_profile("predict"):
+            with timer.stage("forward"):
+                batch_scores = version.model(img_tensor, tab_tensor).reshape(-1).numpy()
+        scores[start:start + len(chunk)] = batch_scores
+        if shadow is not None and shadow is not version:
+            shadow_pool.submit(score_shadow, shadow, items, tab_tensor, batch_scores.copy())
+    PREDICTIONS.inc(len(found), version=version.name, role="primary")
+
+    predictions = [{
+        "tile_id": str(feature_store.tile_ids[i]),
+        "lat": float(feature_store.lat[i]),
+        "lon": float(feature_store.lon[i]),
+        "predicted_score": float(score)
+    } for i, score in zip(positions[found], scores)]
+    missing = [keys[i] for i in np.flatnonzero(positions < 0)]
+
+    timer.observe(STAGE_LATENCY)
+    return jsonify({"model_version": version.name, "predictions": predictions, "missing": missing})
+
+def score_shadow(shadow, items, tab_tensor, primary_scores):
+    # off the request path: the client only ever sees the primary scores
+    pre = shadow.preprocessor
+    if any(item.dtype != np.uint8 and item.shape[1] != pre.image_size for item in items):
+        return  # a packed tensor at another resolution can't be resized
+    items = [pre.from_array(item) if item.dtype == np.uint8 else item for item in items]
     with torch.no_grad():
-        pred = model(img_tensor, tab_tensor)
-        pred = pred.item()
-        pred_score = score_scaler.inverse_transform([[pred]])[0][0]
+        shadow_scores = shadow.model(pre.batch(items), tab_tensor).reshape(-1).numpy()
+    PREDICTIONS.inc(len(items), version=shadow.name, role="shadow")
+    for shadow_score, primary_score in zip(shadow_scores, primary_scores):
+        SHADOW_DIFF.observe(abs(float(shadow_score) - float(primary_score)), version=shadow.name)
+
+@app.route("/models", methods=["GET", "POST"])
+def list_models():
+    if request.method == "POST":
+        # {"name": ..., "path": ..., "default": false} -> loads in the background, in every worker
+        body = request.get_json(silent=True) or {}
+        name, path = body.get("name"), body.get("path")
+        if not name or not path:
+            return jsonify({"error": "Provide name and path"}), 400
+        if not os.path.exists(path):
+            return jsonify({"error": f"No checkpoint at {path}"}), 400
+        if not models.add(name, path, make_default=bool(body.get("default", False))):
+            return jsonify({"error": f"{name} is already loading"}), 409
+        return jsonify(models.describe()), 202
+    return jsonify(models.describe())
+
+@app.route("/models/default", methods=["POST"])
+def set_default_model():
+    name = (request.get_json(silent=True) or {}).get("name")
+    try:
+        models.set_default(name)
+    except KeyError:
+        return jsonify({"error": f"Unknown model version: {name}"}), 404
+    return jsonify(models.describe())
+
+@app.route("/models/shadow", methods=["POST"])
+def set_shadow_model():
+    name = (request.get_json(silent=True) or {}).get("name")  # null turns shadow scoring off
+    try:
+        models.set_shadow(name)
+    except KeyError:
+        return jsonify({"error": f"Unknown model version: {name}"}), 404
+    return jsonify(models.describe())
+
+@app.route("/models/<name>", methods=["DELETE"])
+def unload_model(name):
+    try:
+        models.unload(name)
+    except KeyError:
+        return jsonify({"error": f"Unknown model version: {name}"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    return jsonify(models.describe())
+
+@app.route("/score", methods=["GET"])
+def score():
+    if score_grid is None:
+        return jsonify({"error": "Score grid not loaded"}), 503
+
+    try:
+        lat, lon = check_coordinates(float(request.args["lat"]), float(request.args["lon"]))
+    except (KeyError, ValueError):
+        return jsonify({"error": "Provide finite lat and lon within range"}), 400
+
+    rows, cols, valid = score_grid.index(lon, lat)
+    if not valid:
+        return jsonify({"error": "Location outside score grid"}), 404
+
+    value = score_grid.scores[rows, cols]
+    return jsonify({
+        "lat": lat,
+        "lon": lon,
+        "row": int(rows),
+        "col": int(cols),
+        "score": None if np.isnan(value) else float(value)
+    })
+
+@app.route("/aggregate", methods=["POST"])
+def aggregate():
+    if score_grid is None:
+        return jsonify({"error": "Score grid not loaded"}), 503
+
+    # accepts a geojson geometry, feature or feature collection of admin polygons
+    body = request.get_json(silent=True)
+    if not body or not isinstance(body, dict):
+        return jsonify({"error": "Provide a GeoJSON polygon body"}), 400
+    features = body.get("features") if body.get("type") == "FeatureCollection" else [body]
+    if not isinstance(features, list) or not all(isinstance(f, dict) for f in features):
+        return jsonify({"error": "FeatureCollection features must be a list of GeoJSON objects"}), 400
+
+    zones = []
+    for feature in features:
+        try:
+            stats = score_grid.zonal_stats(feature)
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({"error": f"Invalid geometry: {e}"}), 400
+        stats["properties"] = feature.get("properties", {}) if feature.get("type") == "Feature" else {}
+        zones.append(stats)
+
+    return jsonify({"zones": zones})
+
+def check_coordinates(lat, lon):
+    # nan/inf or out of range coordinates would reach the kd-tree and grid lookups
+    lat_values, lon_values = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+    if not (np.isfinite(lat_values).all() and np.isfinite(lon_values).all()):
+        raise ValueError("lat and lon must be finite numbers")
+    if (np.abs(lat_values) > 90).any() or (np.abs(lon_values) > 180).any():
+        raise ValueError("lat must be within [-90, 90] and lon within [-180, 180]")
+    return lat, lon
+
+def parse_query_points(body):
+    # points come in as [[lat, lon], ...]
+    points = np.asarray(body.get("points", []), dtype=np.float64)
+    if points.ndim != 2 or points.shape[1] != 2 or len(points) == 0:
+        raise ValueError("points must be a non-empty list of [lat, lon] pairs")
+    if len(points) > MAX_QUERY_POINTS:
+        raise ValueError(f"at most {MAX_QUERY_POINTS} points per request")
+    return check_coordinates(points[:, 0], points[:, 1])
+
+def parse_distance(value, name):
+    value = float(value)
+    if not np.isfinite(value) or value < 0:
+        raise ValueError(f"{name} must be a finite, non-negative number of meters")
+    return value
+
+def parse_flag(value, name):
+    # json booleans, 1/0 or "true"/"1"/"false"/"0"; bool() would read "false" as true
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, str)) and str(value).strip().lower() in ("true", "1", "false", "0"):
+        return str(value).strip().lower() in ("true", "1")
+    raise ValueError(f"{name} must be true or false")
+
+@app.route("/water-points/nearest", methods=["POST"])
+def nearest_water_points():
+    if water_points is None:
+        return jsonify({"error": "Water points not loaded"}), 503
+
+    body = request.get_json(silent=True) or {}
+    try:
+        lat, lon = parse_query_points(body)
+        k = int(body.get("k", 1))
+        max_distance_m = body.get("max_distance_m")
+        max_distance_m = None if max_distance_m is None else parse_distance(max_distance_m, "max_distance_m")
+        functional_only = parse_flag(body.get("functional_only", True), "functional_only")
+        detail = parse_flag(body.get("detail", False), "detail")
+    except (TypeError, ValueError, OverflowError) as e:
+        return jsonify({"error": str(e)}), 400
+    if not 1 <= k <= MAX_NEAREST_K:
+        return jsonify({"error": f"k must be between 1 and {MAX_NEAREST_K}"}), 400
+
+    distances, ids = water_points.nearest(lat, lon, k=k, functional_only=functional_only,
+                                          max_distance_m=max_distance_m)
+    result = {
+        "ids": ids.tolist(),
+        "distances_m": np.where(ids >= 0, distances, -1.0).round(1).tolist()
+    }
+    if detail:
+        result["sources"] = [
+            [water_points.describe(i, d) for i, d in zip(row_ids, row_dist) if i >= 0]
+            for row_ids, row_dist in zip(ids, distances)
+        ]
+    return jsonify(result)
+
+@app.route("/water-points/within", methods=["POST"])
+def water_points_within():
+    if water_points is None:
+        return jsonify({"error": "Water points not loaded"}), 503
+
+    body = request.get_json(silent=True) or {}
+    try:
+        lat, lon = parse_query_points(body)
+        radius_m = parse_distance(body.get("radius_m", 5000), "radius_m")
+        functional_only = parse_flag(body.get("functional_only", True), "functional_only")
+        count_only = parse_flag(body.get("count_only", False), "count_only")
+        detail = parse_flag(body.get("detail", False), "detail")
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    if count_only:
+        counts = water_points.count_within(lat, lon, radius_m, functional_only=functional_only)
+        return jsonify({"counts": np.asarray(counts).tolist()})
 
-    return jsonify({"predicted_score": float(pred_score)})
+    hits = water_points.within(lat, lon, radius_m, functional_only=functional_only)
+    result = {"ids": [h.tolist() for h in hits]}
+    if detail:
+        result["sources"] = [[water_points.describe(i) for i in h] for h in hits]
+    return jsonify(result)
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8000, debug=True)
@@ -0,0 +1,414 @@
+"""
+sharded region inference: a coordinator splits the region's tile grid into spatial
+shards and serves them from a work queue; workers (one per node) pull a shard, score
+it and push the scores back. results merge into one ScoreGrid.
+
+    python distributed_scoring.py run model/best_model.pth --workers 4 --output region_grid.npz
+    python distributed_scoring.py run --random --workers 3 --kill-worker-after 5   # lose a node mid-run
+
+    # real nodes: one coordinator, any number of workers pointed at it (shared data paths)
+    python distributed_scoring.py coordinator --bind 0.0.0.0:50070 --authkey secret
+    python distributed_scoring.py worker model/best_model.pth --address coordinator-host:50070 --authkey secret
+
+the queue is a multiprocessing manager over tcp. workers heartbeat from a side thread
+while they score; a worker that misses --timeout seconds of heartbeats is declared dead
+and its shards go back on the queue. a late result for a shard that was already scored
+elsewhere is dropped, so a slow worker can't double count.
+
+the coordinator reads the tile csv once, a chunk at a time, and appends each scoreable
+tile to the window file of its shard (the shard's block plus --margin cells) under
+--shard-dir, which workers must see at the same path. a worker reads only its shard's
+file, so node memory and io follow the shard size rather than the region, and the
+coordinator itself keeps a (H, W) bool mask of the cells with data, not the layers.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import socket
+import threading
+import time
+from collections import deque
+from multiprocessing.managers import BaseManager
+
+import numpy as np
+import pandas as pd
+import torch
+
+from adaptive_scoring import (CSV_CHUNK_ROWS, FEATURE_CSV_PATH, IMAGE_DIR, TABULAR_FEATURES, FeatureLayers,
+                              score_cells, tile_cells)
+from fusion import CNNTFMModel, load_scoring_model
+from preprocess import Preprocessor
+from score_grid import CELL_SIZE, ROI_BOUNDS, ScoreGrid
+
+FEATURE_SCALER_PATH = "scalers/feature_scaler.pkl"
+SCORE_SCALER_PATH = "scalers/score_scaler.pkl"
+SHARD_CELLS = 25  # 0.25 deg at the 0.01 deg tile size
+MARGIN_CELLS = 0  # context around a shard a worker loads; tiles are scored on their own, so none
+SHARD_DIR = "region_shards"
+HEARTBEAT_SECONDS = 1.0
+TIMEOUT_SECONDS = 5.0
+
+
+# --------------------------
+# coordinator
+# --------------------------
+class Coordinator:
+    # all methods are called through manager proxies from worker processes, hence the lock
+    def __init__(self, shards, files, timeout=TIMEOUT_SECONDS, bounds=ROI_BOUNDS, cell_size=CELL_SIZE,
+                 margin=MARGIN_CELLS):
+        self.shards = shards  # shard id -> (rows, cols) of the cells to score
+        self.files = files  # shard id -> csv of the tiles in the shard's window
+        self.tiles = sum(len(rows) for rows, _ in shards.values())
+        self.bounds = [float(b) for b in bounds]
+        self.cell_size = float(cell_size)
+        self.margin = int(margin)
+        self.queue = deque(sorted(shards))
+        self.assigned = {}  # shard id -> worker id
+        self.results = {}  # shard id -> scores
+        self.workers = {}  # worker id -> {"last_seen", "tiles", "seconds", "dead"}
+        self.reassigned = 0
+        self.timeout = timeout
+        self._lock = threading.Lock()
+
+    def register(self, worker_id):
+        # returns the region grid (bounds, cell size) the shard rows and cols index into, and the margin
+        with self._lock:
+            self.workers[worker_id] = {"last_seen": time.time(), "tiles": 0, "seconds": 0.0, "dead": False}
+            return self.bounds, self.cell_size, self.margin
+
+    def heartbeat(self, worker_id):
+        with self._lock:
+            worker = self.workers.get(worker_id)
+            if worker is None or worker["dead"]:
+                return False  # told to stop: its shards have been handed out again
+            worker["last_seen"] = time.time()
+            return True
+
+    def request(self, worker_id):
+        # (shard id, rows, cols, window csv), or None once everything is scored; ("wait",) while shards are in flight
+        with self._lock:
+            if self.workers.get(worker_id, {}).get("dead"):
+                return None
+            self.workers[worker_id]["last_seen"] = time.time()
+            if self.queue:
+                shard = self.queue.popleft()
+                self.assigned[shard] = worker_id
+                rows, cols = self.shards[shard]
+                return shard, rows, cols, self.files[shard]
+            return None if len(self.results) == len(self.shards) else ("wait",)
+
+    def submit(self, worker_id, shard, scores, seconds):
+        with self._lock:
+            if shard in self.results:
+                return False
+            self.results[shard] = scores
+            self.assigned.pop(shard, None)
+            worker = self.workers[worker_id]
+            worker["tiles"] += len(scores)
+            worker["seconds"] += seconds
+            worker["last_seen"] = time.time()
+            return True
+
+    def reap(self):
+        # declares silent workers dead and requeues their shards at the front
+        now = time.time()
+        with self._lock:
+            for worker_id, worker in self.workers.items():
+                if worker["dead"] or now - worker["last_seen"] <= self.timeout:
+                    continue
+                worker["dead"] = True
+                lost = [shard for shard, owner in self.assigned.items() if owner == worker_id]
+                for shard in lost:
+                    del self.assigned[shard]
+                    self.queue.appendleft(shard)
+                self.reassigned += len(lost)
+                print(f"worker {worker_id} missed heartbeats, requeued {len(lost)} shards", flush=True)
+
+    def done(self):
+        with self._lock:
+            return len(self.results) == len(self.shards)
+
+    def status(self):
+        with self._lock:
+            return {"shards": len(self.shards), "scored": len(self.results), "queued": len(self.queue),
+                    "in_flight": len(self.assigned), "reassigned": self.reassigned,
+                    "workers": {k: {"tiles": v["tiles"], "seconds": round(v["seconds"], 3), "dead": v["dead"]}
+                                for k, v in self.workers.items()}}
+
+
+class QueueManager(BaseManager):
+    pass
+
+
+def make_coordinator(features=FEATURE_CSV_PATH, image_dir=IMAGE_DIR, shard_dir=SHARD_DIR, bounds=ROI_BOUNDS,
+                     cell_size=CELL_SIZE, shard_cells=SHARD_CELLS, margin=MARGIN_CELLS, timeout=TIMEOUT_SECONDS):
+    shards, files = partition_tiles(features, image_dir, shard_dir, bounds, cell_size, shard_cells, margin)
+    return Coordinator(shards, files, timeout, bounds, cell_size, margin)
+
+
+def make_shards(has_data, shard_cells=SHARD_CELLS):
+    # square blocks of cells; only cells with data are sent, empty blocks are skipped
+    shards = {}
+    height, width = has_data.shape
+    for r0 in range(0, height, shard_cells):
+        for c0 in range(0, width, shard_cells):
+            rows, cols = np.nonzero(has_data[r0:r0 + shard_cells, c0:c0 + shard_cells])
+            if len(rows):
+                shards[len(shards)] = ((rows + r0).tolist(), (cols + c0).tolist())
+    return shards
+
+
+def block_path(shard_dir, block_row, block_col):
+    return os.path.join(shard_dir, f"block_{block_row}_{block_col}.csv")
+
+
+def partition_tiles(features, image_dir, shard_dir, bounds=ROI_BOUNDS, cell_size=CELL_SIZE, shard_cells=SHARD_CELLS,
+                    margin=MARGIN_CELLS, chunksize=CSV_CHUNK_ROWS):
+    # one pass over the tile csv. a tile is scoreable with all its layers and its image, as in
+    # FeatureLayers.from_tiles; each scoreable row is appended to the file of every block whose
+    # window (block plus margin) holds it. returns shard id -> (rows, cols) and shard id -> file
+    grid = ScoreGrid(bounds, cell_size)
+    has_data = np.zeros((grid.height, grid.width), dtype=bool)
+    os.makedirs(shard_dir, exist_ok=True)
+    for name in os.listdir(shard_dir):
+        if name.startswith("block_") and name.endswith(".csv"):
+            os.remove(os.path.join(shard_dir, name))  # appended to below, so nothing from an earlier run
+    reach = margin // shard_cells + 1  # blocks away a margin can reach
+    for df in pd.read_csv(features, chunksize=chunksize):
+        rows, cols, valid = tile_cells(grid, df[".geo"])
+        df, rows, cols = df[valid], rows[valid], cols[valid]
+        images = np.array([os.path.exists(os.path.join(image_dir, f"sentinel2_{tile_id}.png"))
+                           for tile_id in df["tile_id"]], dtype=bool)
+        scoreable = df[TABULAR_FEATURES].notna().all(axis=1).to_numpy() & images
+        has_data[rows, cols] = scoreable  # a later row for a cell replaces an earlier one
+        df, rows, cols = df[scoreable], rows[scoreable], cols[scoreable]
+        for dr in range(-reach, reach + 1):
+            for dc in range(-reach, reach + 1):
+                block_rows, block_cols = rows // shard_cells + dr, cols // shard_cells + dc
+                inside = ((block_rows >= 0) & (block_cols >= 0)
+                          & (rows >= block_rows * shard_cells - margin) & (rows < (block_rows + 1) * shard_cells + margin)
+                          & (cols >= block_cols * shard_cells - margin) & (cols < (block_cols + 1) * shard_cells + margin))
+                for (block_row, block_col), block in df[inside].groupby([block_rows[inside], block_cols[inside]]):
+                    path = block_path(shard_dir, block_row, block_col)
+                    block.to_csv(path, mode="a", header=not os.path.exists(path), index=False)
+
+    shards = make_shards(has_data, shard_cells)
+    files = {shard: block_path(shard_dir, rows[0] // shard_cells, cols[0] // shard_cells)
+             for shard, (rows, cols) in shards.items()}
+    return shards, files
+
+
+def serve(coordinator, bind, authkey):
+    # runs the queue server on a daemon thread of this process so it shares `coordinator`
+    host, port = bind.rsplit(":", 1)
+    QueueManager.register("coordinator", callable=lambda: coordinator)
+    manager = QueueManager(address=(host, int(port)), authkey=authkey.encode())
+    server = manager.get_server()
+    threading.Thread(target=server.serve_forever, name="queue-server", daemon=True).start()
+    return server
+
+
+def coordinate(coordinator, poll=0.5, progress_every=5.0):
+    t0 = time.perf_counter()
+    last = t0
+    while not coordinator.done():
+        time.sleep(poll)
+        coordinator.reap()
+        if time.perf_counter() - last > progress_every:
+            status = coordinator.status()
+            print(f"{status['scored']}/{status['shards']} shards, {status['in_flight']} in flight, "
+                  f"{status['queued']} queued", flush=True)
+            last = time.perf_counter()
+    return time.perf_counter() - t0
+
+
+def merge(coordinator):
+    grid = ScoreGrid(coordinator.bounds, coordinator.cell_size)
+    for shard, scores in coordinator.results.items():
+        rows, cols = coordinator.shards[shard]
+        grid.scores[rows, cols] = scores
+    return grid
+
+
+# --------------------------
+# worker
+# --------------------------
+def load_model(checkpoint, random_model=False):
+    if random_model:
+        torch.manual_seed(0)
+        return CNNTFMModel(len(TABULAR_FEATURES), image_size=112, backbone="small_cnn").eval()
+    model, _ = load_scoring_model(checkpoint, len(TABULAR_FEATURES), FEATURE_SCALER_PATH, SCORE_SCALER_PATH)
+    return model
+
+
+def shard_layers(grid, rows, cols, features=FEATURE_CSV_PATH, image_dir=IMAGE_DIR, margin=MARGIN_CELLS):
+    # feature layers for the shard's bounding window plus margin cells, and the shard's cells
+    # in window coordinates; a worker never holds more of the region than one window.
+    # `features` is normally the shard's window csv from partition_tiles
+    rows, cols = np.asarray(rows), np.asarray(cols)
+    row0, row1 = max(rows.min() - margin, 0), min(rows.max() + 1 + margin, grid.height)
+    col0, col1 = max(cols.min() - margin, 0), min(cols.max() + 1 + margin, grid.width)
+    bounds = [grid.west + col0 * grid.cell_size, grid.north - row1 * grid.cell_size,
+              grid.west + col1 * grid.cell_size, grid.north - row0 * grid.cell_size]
+    layers = FeatureLayers.from_tiles(features, image_dir, bounds, grid.cell_size)
+    return layers, rows - row0, cols - col0
+
+
+def worker(address, authkey, checkpoint, worker_id=None, threads=1, random_model=False, image_dir=IMAGE_DIR,
+           batch_size=64):
+    torch.set_num_threads(threads)
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    host, port = address.rsplit(":", 1)
+    QueueManager.register("coordinator")
+    manager = QueueManager(address=(host, int(port)), authkey=authkey.encode())
+    manager.connect()
+    coordinator = manager.coordinator()
+
+    model = load_model(checkpoint, random_model)
+    preprocessor = Preprocessor(image_size=model.image_size)
+    bounds, cell_size, margin = coordinator.register(worker_id)
+    grid = ScoreGrid(bounds, cell_size)
+
+    stop = threading.Event()
+
+    def beat():
+        # proxies open one connection per thread, so this doesn't contend with the main loop
+        while not stop.wait(HEARTBEAT_SECONDS):
+            if not coordinator.heartbeat(worker_id):
+                stop.set()
+
+    threading.Thread(target=beat, name="heartbeat", daemon=True).start()
+    while not stop.is_set():
+        job = coordinator.request(worker_id)
+        if job is None:
+            break
+        if job[0] == "wait":
+            time.sleep(HEARTBEAT_SECONDS)
+            continue
+        shard, rows, cols, window = job
+        t0 = time.perf_counter()
+        layers, rows, cols = shard_layers(grid, rows, cols, window, image_dir, margin)
+        scores = score_cells(model, preprocessor, layers, 1, rows, cols, batch_size)
+        coordinator.submit(worker_id, shard, scores.tolist(), time.perf_counter() - t0)
+    stop.set()
+
+
+# --------------------------
+# local run: coordinator + worker processes standing in for nodes
+# --------------------------
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run_local(args):
+    coordinator = make_coordinator(args.features, args.image_dir, args.shard_dir, shard_cells=args.shard_cells,
+                                   margin=args.margin, timeout=args.timeout)
+    address = f"127.0.0.1:{free_port()}"
+    authkey = os.urandom(16).hex()
+    serve(coordinator, address, authkey)
+    tiles = coordinator.tiles
+    print(f"{tiles} tiles in {len(coordinator.shards)} shards, {args.workers} workers", flush=True)
+
+    ctx = mp.get_context("spawn")
+    procs = {}
+    for i in range(args.workers):
+        procs[f"node{i}"] = ctx.Process(target=worker, args=(address, authkey, args.checkpoint, f"node{i}",
+                                                             args.threads, args.random, args.image_dir,
+                                                             args.batch_size))
+        procs[f"node{i}"].start()
+
+    if args.kill_worker_after is not None:
+        def kill():
+            # simulated node loss: the process dies without a goodbye, only the missing heartbeats tell
+            time.sleep(args.kill_worker_after)
+            print("killing node0", flush=True)
+            procs["node0"].kill()
+        threading.Thread(target=kill, daemon=True).start()
+
+    seconds = coordinate(coordinator)
+    for proc in procs.values():
+        proc.join(timeout=args.timeout + 5)
+        if proc.is_alive():
+            proc.kill()
+
+    grid = merge(coordinator)
+    grid.save(args.output)
+    status = coordinator.status()
+    report = {
+        "tiles": tiles,
+        "shards": status["shards"],
+        "workers": args.workers,
+        "threads_per_worker": args.threads,
+        "seconds": round(seconds, 3),
+        "tiles_per_s": round(tiles / seconds, 2),
+        "reassigned_shards": status["reassigned"],
+        "per_worker": status["workers"],
+    }
+    print(f"scored {tiles} tiles in {seconds:.1f}s: {report['tiles_per_s']:.1f} tiles/s aggregate, "
+          f"{status['reassigned']} shards reassigned -> {args.output}")
+    for worker_id, w in status["workers"].items():
+        rate = w["tiles"] / w["seconds"] if w["seconds"] else 0.0
+        print(f"  {worker_id}: {w['tiles']} tiles, {rate:.1f} tiles/s{' (dead)' if w['dead'] else ''}")
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="sharded region inference over a work queue")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def common(p, model=True, queue=True):
+        if model:
+            p.add_argument("checkpoint", nargs="?", default="model/best_model.pth")
+            p.add_argument("--random", action="store_true", help="random small_cnn model, no checkpoint needed")
+            p.add_argument("--threads", type=int, default=1, help="torch threads per worker")
+            p.add_argument("--batch-size", type=int, default=64)
+        if queue:
+            p.add_argument("--features", default=FEATURE_CSV_PATH)
+            p.add_argument("--shard-dir", default=SHARD_DIR, help="per-shard window csvs, shared with the workers")
+            p.add_argument("--shard-cells", type=int, default=SHARD_CELLS, help="shard side, in cells")
+            p.add_argument("--margin", type=int, default=MARGIN_CELLS, help="context cells loaded around a shard")
+            p.add_argument("--timeout", type=float, default=TIMEOUT_SECONDS, help="heartbeat timeout, seconds")
+        p.add_argument("--image-dir", default=IMAGE_DIR)
+
+    run = sub.add_parser("run", help="coordinator plus local worker processes")
+    common(run)
+    run.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    run.add_argument("--kill-worker-after", type=float, help="kill node0 after this many seconds")
+    run.add_argument("--output", default="region_grid.npz")
+    run.add_argument("--report", default="distributed_report.json")
+
+    coord = sub.add_parser("coordinator", help="serve the shard queue for remote workers")
+    common(coord, model=False)
+    coord.add_argument("--bind", default="0.0.0.0:50070")
+    coord.add_argument("--authkey", required=True)
+    coord.add_argument("--output", default="region_grid.npz")
+
+    work = sub.add_parser("worker", help="pull shards from a coordinator")
+    common(work, queue=False)
+    work.add_argument("--address", required=True, help="coordinator host:port")
+    work.add_argument("--authkey", required=True)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run_local(args)
+    elif args.command == "coordinator":
+        coordinator = make_coordinator(args.features, args.image_dir, args.shard_dir, shard_cells=args.shard_cells,
+                                       margin=args.margin, timeout=args.timeout)
+        serve(coordinator, args.bind, args.authkey)
+        print(f"serving {len(coordinator.shards)} shards on {args.bind}", flush=True)
+        seconds = coordinate(coordinator)
+        merge(coordinator).save(args.output)
+        tiles = coordinator.tiles
+        print(f"scored {tiles} tiles in {seconds:.1f}s ({tiles / seconds:.1f} tiles/s) -> {args.output}")
+    else:
+        worker(args.address, args.authkey, args.checkpoint, threads=args.threads, random_model=args.random,
+               image_dir=args.image_dir, batch_size=args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
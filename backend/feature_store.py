@@ -0,0 +1,178 @@
+"""
+server-side store of model inputs, so /predict can score tiles by id or location with no upload.
+
+    python feature_store.py build --output feature_store --image-size 224
+    python feature_store.py build --output feature_store --image-size 224 --packed   # float32, no per-request normalize
+
+a store is a directory of .npy arrays opened memory-mapped, so only the tiles that are
+asked for are paged in and the store can be far bigger than RAM:
+    images.npy   (N, S, S, 3) uint8 at model size, or (N, 3, S, S) float32 normalized with --packed
+    tabular.npy  (N, D) float32 tabular vector in the model's input units
+    cells.npy    (H, W) int32 row of each grid cell, -1 where there is no tile
+    tile_ids.npy (N,) tile ids, lon.npy / lat.npy (N,) cell centres
+    sorted_ids.npy, id_positions.npy   tile ids in sorted order and their rows, for np.searchsorted
+    index.json   feature names, image size and the grid
+the tabular vector is stored raw because the feature scaler is folded into the model;
+scaling it here as well would apply it twice. uint8 images are 4x smaller than packed
+float32 and the normalize is one fused multiply-add in Preprocessor.batch.
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from adaptive_scoring import CSV_CHUNK_ROWS, FEATURE_CSV_PATH, IMAGE_DIR, TABULAR_FEATURES, tile_cells
+from preprocess import Preprocessor
+from score_grid import CELL_SIZE, ROI_BOUNDS, ScoreGrid
+
+FEATURE_STORE_PATH = "feature_store"
+
+
+class FeatureStore:
+    def __init__(self, path):
+        with open(os.path.join(path, "index.json")) as f:
+            self.meta = json.load(f)
+        self.path = path
+        self.image_size = self.meta["image_size"]
+        self.packed = self.meta["packed"]
+        self.feature_names = self.meta["feature_names"]
+        self.grid = ScoreGrid(self.meta["bounds"], self.meta["cell_size"])
+        # everything per tile stays on disk; a lookup only touches the pages it reads
+        for name in ("images", "tabular", "cells", "tile_ids", "lon", "lat", "sorted_ids", "id_positions"):
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+
+    def __len__(self):
+        return len(self.tile_ids)
+
+    # --- lookups: store rows, -1 for unknown ids and cells without a tile ---
+    def by_tile_ids(self, tile_ids):
+        keys = np.array([str(t) for t in tile_ids], dtype=str)
+        if not len(self):
+            return np.full(len(keys), -1, dtype=np.int64)
+        i = np.minimum(np.searchsorted(self.sorted_ids, keys), len(self) - 1)
+        return np.where(self.sorted_ids[i] == keys, self.id_positions[i], -1).astype(np.int64)
+
+    def by_points(self, lat, lon):
+        rows, cols, valid = self.grid.index(lon, lat)
+        found = np.full(rows.shape, -1, dtype=np.int64)
+        found[valid] = self.cells[rows[valid], cols[valid]]
+        return found
+
+    # --- model inputs ---
+    def inputs(self, positions, preprocessor):
+        # items for preprocessor.batch (copied out of the mapping) and the (n, D) tabular block
+        positions = np.asarray(positions)
+        items = []
+        for i in positions:
+            item = np.array(self.images[i])
+            if preprocessor.image_size != self.image_size:
+                if self.packed:
+                    raise ValueError(f"store holds packed {self.image_size} px tensors, "
+                                     f"model expects {preprocessor.image_size} px")
+                item = preprocessor.from_array(item)
+            items.append(item)
+        return items, np.array(self.tabular[positions], dtype=np.float32)
+
+    def describe(self):
+        return {"path": self.path, "tiles": len(self), "image_size": self.image_size, "packed": self.packed,
+                "feature_names": self.feature_names,
+                "bytes": sum(a.nbytes for a in (self.images, self.tabular, self.cells, self.tile_ids, self.lon,
+                                                self.lat, self.sorted_ids, self.id_positions))}
+
+
+def build(output, image_size=224, packed=False, features=FEATURE_CSV_PATH, image_dir=IMAGE_DIR,
+          bounds=ROI_BOUNDS, cell_size=CELL_SIZE, chunksize=CSV_CHUNK_ROWS):
+    # two passes over the csv a chunk at a time, as FeatureLayers.from_tiles reads it, and every
+    # per-tile array written through open_memmap, so building holds one chunk and the cell lookup
+    grid = ScoreGrid(bounds, cell_size)
+    os.makedirs(output, exist_ok=True)
+    preprocessor = Preprocessor(image_size=image_size)
+
+    def create(name, dtype, shape):
+        return np.lib.format.open_memmap(os.path.join(output, f"{name}.npy"), mode="w+", dtype=dtype, shape=shape)
+
+    def image_path(tile_id):
+        return os.path.join(image_dir, f"sentinel2_{tile_id}.png")
+
+    # pass 1: the csv row each cell takes its tile from, the last one in bounds with an image
+    lookup = create("cells", np.int32, (grid.height, grid.width))
+    lookup[:] = -1
+    start, id_width = 0, 1
+    for df in pd.read_csv(features, usecols=["tile_id", ".geo"], dtype={"tile_id": str}, chunksize=chunksize):
+        rows, cols, valid = tile_cells(grid, df[".geo"])
+        ids = df["tile_id"].to_numpy()
+        valid[valid] = [os.path.exists(image_path(tile_id)) for tile_id in ids[valid]]
+        lookup[rows[valid], cols[valid]] = start + np.flatnonzero(valid)
+        id_width = max([id_width] + [len(tile_id) for tile_id in ids[valid]])
+        start += len(df)
+
+    # store rows in (row, col) order; source_rows[i] is the csv row of store row i
+    flat = lookup.reshape(-1)
+    cells = np.flatnonzero(flat >= 0)
+    source_rows = flat[cells].astype(np.int64)
+    flat[cells] = np.arange(len(cells))
+    lookup.flush()
+    order = np.argsort(source_rows)
+    sources = source_rows[order]
+
+    # pass 2: each chunk's chosen rows go straight to their store rows
+    shape = (len(cells), 3, image_size, image_size) if packed else (len(cells), image_size, image_size, 3)
+    images = create("images", np.float32 if packed else np.uint8, shape)
+    tabular = create("tabular", np.float32, (len(cells), len(TABULAR_FEATURES)))
+    tile_ids = create("tile_ids", f"<U{id_width}", (len(cells),))
+    start = 0
+    for df in pd.read_csv(features, usecols=["tile_id"] + TABULAR_FEATURES, dtype={"tile_id": str},
+                          chunksize=chunksize):
+        lo, hi = np.searchsorted(sources, [start, start + len(df)])
+        chosen, positions = sources[lo:hi] - start, order[lo:hi]
+        tabular[positions] = df[TABULAR_FEATURES].to_numpy(np.float32)[chosen]
+        ids = df["tile_id"].to_numpy()[chosen]
+        tile_ids[positions] = ids
+        for i, tile_id in zip(positions, ids):
+            pixels = preprocessor.resize(Image.open(image_path(tile_id)).convert("RGB"))
+            images[i] = preprocessor.batch([pixels])[0].numpy() if packed else pixels
+        start += len(df)
+    for array in (images, tabular, tile_ids):
+        array.flush()
+
+    rows, cols = np.divmod(cells, grid.width)
+    lon, lat = grid.cell_centers(rows, cols)
+    np.save(os.path.join(output, "lon.npy"), lon.round(6))
+    np.save(os.path.join(output, "lat.npy"), lat.round(6))
+    order = np.argsort(tile_ids, kind="stable")
+    np.save(os.path.join(output, "sorted_ids.npy"), tile_ids[order])
+    np.save(os.path.join(output, "id_positions.npy"), order.astype(np.int64))
+
+    meta = {
+        "image_size": image_size,
+        "packed": packed,
+        "feature_names": list(TABULAR_FEATURES),
+        "bounds": [grid.west, grid.south, grid.east, grid.north],
+        "cell_size": grid.cell_size,
+    }
+    with open(os.path.join(output, "index.json"), "w") as f:
+        json.dump(meta, f)
+    return FeatureStore(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="build the memory-mapped feature store for /predict lookups")
+    sub = parser.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build")
+    b.add_argument("--output", default=FEATURE_STORE_PATH)
+    b.add_argument("--image-size", type=int, default=224, help="match the served model's input size")
+    b.add_argument("--packed", action="store_true", help="store normalized float32 tensors instead of uint8")
+    b.add_argument("--features", default=FEATURE_CSV_PATH)
+    b.add_argument("--image-dir", default=IMAGE_DIR)
+    args = parser.parse_args()
+
+    store = build(args.output, args.image_size, args.packed, args.features, args.image_dir)
+    info = store.describe()
+    print(f"{info['tiles']} tiles, {info['bytes'] / 1e6:.1f} MB -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
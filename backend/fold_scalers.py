@@ -0,0 +1,92 @@
+"""
+folds scalers/feature_scaler.pkl and scalers/score_scaler.pkl (or the scaler_params.json
+streaming_scaler.py writes) into a model checkpoint so serving needs neither scikit-learn nor joblib.
+
+    python fold_scalers.py model/best_model.pth model/best_model_folded.pth
+    python fold_scalers.py model/best_model.pth model/best_model_folded.pth --scaler-params ../model/data/scaler_params.json
+    MODEL_PATH=model/best_model_folded.pth python app.py
+"""
+import argparse
+import hashlib
+import json
+
+import torch
+
+from fusion import CNNTFMModel, ScaledFusionModel, read_metadata, write_metadata
+
+FOLD_FORMAT_VERSION = 1
+
+
+def sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="bake the StandardScalers into a checkpoint")
+    parser.add_argument("checkpoint")
+    parser.add_argument("output")
+    parser.add_argument("--feature-scaler", default="scalers/feature_scaler.pkl")
+    parser.add_argument("--score-scaler", default="scalers/score_scaler.pkl")
+    parser.add_argument("--scaler-params", help="scaler_params.json from model/data/streaming_scaler.py, "
+                                                "instead of the .pkl scalers")
+    args = parser.parse_args()
+
+    metadata = read_metadata(args.checkpoint)
+    if metadata.get("scalers_folded"):
+        parser.error(f"{args.checkpoint} already has its scalers folded in")
+
+    if args.scaler_params:
+        with open(args.scaler_params) as f:
+            params = json.load(f)
+        feature_names = params["features"]["columns"]
+        stats = [params["features"]["mean"], params["features"]["scale"],
+                 params["score"]["mean"], params["score"]["scale"]]
+        sources = {"scaler_params_sha256": sha256(args.scaler_params)}
+    else:
+        import joblib
+
+        feature_scaler = joblib.load(args.feature_scaler)
+        score_scaler = joblib.load(args.score_scaler)
+        feature_names = [str(f) for f in getattr(feature_scaler, "feature_names_in_", [])]
+        stats = [feature_scaler.mean_, feature_scaler.scale_, score_scaler.mean_, score_scaler.scale_]
+        sources = {"feature_scaler_sha256": sha256(args.feature_scaler),
+                   "score_scaler_sha256": sha256(args.score_scaler)}
+    feature_mean, feature_scale, score_mean, score_scale = (torch.as_tensor(v, dtype=torch.float64) for v in stats)
+    tabular_dim = len(feature_mean)
+
+    base = CNNTFMModel(tabular_dim=tabular_dim, image_size=metadata.get("image_size", 224),
+                       backbone=metadata.get("backbone", "resnet18"))
+    base.load_state_dict(torch.load(args.checkpoint, map_location="cpu"))
+    model = ScaledFusionModel(base, tabular_dim, feature_mean, feature_scale, score_mean[0], score_scale[0]).eval()
+
+    # sanity check against scaling explicitly, in float64, on random raw features
+    image = torch.randn(4, 3, base.image_size, base.image_size)
+    raw = torch.randn(4, tabular_dim).double() * feature_scale + feature_mean
+    with torch.no_grad():
+        folded = model(image, raw.float())
+        scaled = ((raw - feature_mean) / feature_scale).float()
+        expected = base(image, scaled).double().reshape(-1) * score_scale[0] + score_mean[0]
+    max_diff = float((folded.double().reshape(-1) - expected).abs().max())
+    print(f"max abs difference vs unfolded scaling: {max_diff:.2e}")
+
+    torch.save(model.state_dict(), args.output)
+    folded_metadata = dict(metadata)
+    folded_metadata.update(
+        image_size=base.image_size,
+        backbone=base.backbone,
+        tabular_dim=tabular_dim,
+        tabular_features=feature_names,
+        scalers_folded=True,
+        fold={"format_version": FOLD_FORMAT_VERSION, "source_checkpoint_sha256": sha256(args.checkpoint),
+              **sources, "max_abs_diff": max_diff},
+    )
+    write_metadata(args.output, **folded_metadata)
+    print(f"folded model written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
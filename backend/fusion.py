@@ -0,0 +1,195 @@
+import json
+import os
+
+import torch
+import torch.nn as nn
+from torchvision import models
+
+DEFAULT_IMAGE_SIZE = 224
+DEFAULT_BACKBONE = "resnet18"
+
+
+# --------------------------
+# image backbones
+# --------------------------
+class SmallCNN(nn.Module):
+    # compact custom backbone for 112 px tiles: 4 strided conv blocks, ~0.4M params
+    def __init__(self, widths=(32, 64, 128, 256)):
+        super().__init__()
+        layers = []
+        in_ch = 3
+        for out_ch in widths:
+            layers += [
+                nn.Conv2d(in_ch, out_ch, 3, stride=2, padding=1, bias=False),
+                nn.BatchNorm2d(out_ch),
+                nn.ReLU(inplace=True),
+                nn.Conv2d(out_ch, out_ch, 3, padding=1, groups=out_ch, bias=False),
+                nn.BatchNorm2d(out_ch),
+                nn.ReLU(inplace=True),
+            ]
+            in_ch = out_ch
+        layers.append(nn.AdaptiveAvgPool2d(1))
+        self.body = nn.Sequential(*layers)
+        self.out_dim = in_ch
+
+    def forward(self, x):
+        return self.body(x)
+
+
+def build_backbone(name, pretrained=False):
+    # returns (feature extractor ending in a global pool, feature dim).
+    # serving always loads a checkpoint, so imagenet weights are only needed for training
+    if name == "resnet18":
+        resnet = models.resnet18(weights=models.ResNet18_Weights.DEFAULT if pretrained else None)
+        return nn.Sequential(*list(resnet.children())[:-1]), resnet.fc.in_features
+    if name == "mobilenet_v3_small":
+        net = models.mobilenet_v3_small(weights=models.MobileNet_V3_Small_Weights.DEFAULT if pretrained else None)
+        return nn.Sequential(net.features, net.avgpool), net.classifier[0].in_features
+    if name == "small_cnn":
+        net = SmallCNN()
+        return net, net.out_dim
+    raise ValueError(f"unknown backbone: {name}")
+
+
+BACKBONES = ["resnet18", "mobilenet_v3_small", "small_cnn"]
+
+
+# --------------------------
+# model definition
+# --------------------------
+def fusion_head(in_dim, dropout=0.5):
+    # image features + tabular vector -> score
+    return nn.Sequential(
+        nn.Linear(in_dim, 256),
+        nn.ReLU(),
+        nn.Dropout(dropout),
+        nn.Linear(256, 1)
+    )
+
+
+class CNNTFMModel(nn.Module):
+    def __init__(self, tabular_dim, pretrained=False, image_size=DEFAULT_IMAGE_SIZE, backbone=DEFAULT_BACKBONE,
+                 dropout=0.5):
+        super().__init__()
+
+        # the adaptive pool makes the head resolution independent; image_size only tells
+        # the data pipeline what to feed (224 upsampled or the native 112 px tiles)
+        self.image_size = image_size
+        self.backbone = backbone
+
+        self.cnn, self.cnn_out_dim = build_backbone(backbone, pretrained)
+
+        self.fc = fusion_head(self.cnn_out_dim + tabular_dim, dropout)
+
+    def forward(self, image, tabular):
+        cnn_feat = self.cnn(image)
+        cnn_feat = cnn_feat.view(image.size(0), -1)
+        x = torch.cat((cnn_feat, tabular), dim=1)
+        return self.fc(x).squeeze()
+
+
+class ScaledFusionModel(nn.Module):
+    # CNNTFMModel with the two StandardScalers folded in as fixed affine buffers:
+    # raw tabular features in, score in original units out, one fused op on each side
+    def __init__(self, model, tabular_dim, feature_mean=None, feature_scale=None, score_mean=0.0, score_scale=1.0):
+        super().__init__()
+        self.model = model
+        feature_mean = torch.zeros(tabular_dim) if feature_mean is None else torch.as_tensor(feature_mean)
+        feature_scale = torch.ones(tabular_dim) if feature_scale is None else torch.as_tensor(feature_scale)
+        feature_mean = feature_mean.float().reshape(-1)
+        feature_scale = feature_scale.float().reshape(-1)
+
+        self.register_buffer("feature_weight", 1.0 / feature_scale)
+        self.register_buffer("feature_bias", -feature_mean / feature_scale)
+        self.register_buffer("score_weight", torch.as_tensor(score_scale, dtype=torch.float32).reshape(()))
+        self.register_buffer("score_bias", torch.as_tensor(score_mean, dtype=torch.float32).reshape(()))
+
+    @property
+    def image_size(self):
+        return self.model.image_size
+
+    @property
+    def backbone(self):
+        return self.model.backbone
+
+    def forward(self, image, tabular):
+        tabular = torch.addcmul(self.feature_bias, tabular, self.feature_weight)
+        pred = self.model(image, tabular)
+        return torch.addcmul(self.score_bias, pred, self.score_weight)
+
+    @classmethod
+    def from_sklearn(cls, model, feature_scaler, score_scaler):
+        # only reads the fitted arrays, so sklearn itself is never called
+        def stats(scaler):
+            n = scaler.n_features_in_
+            mean = scaler.mean_ if getattr(scaler, "mean_", None) is not None else torch.zeros(n)
+            scale = scaler.scale_ if getattr(scaler, "scale_", None) is not None else torch.ones(n)
+            return torch.as_tensor(mean), torch.as_tensor(scale)
+
+        feature_mean, feature_scale = stats(feature_scaler)
+        score_mean, score_scale = stats(score_scaler)
+        return cls(model, len(feature_mean), feature_mean, feature_scale, score_mean[0], score_scale[0])
+
+    @classmethod
+    def from_params(cls, model, path):
+        # the scaler_params.json model/data/streaming_scaler.py writes; same mean/scale as the pickles
+        with open(path) as f:
+            params = json.load(f)
+        features, score = params["features"], params["score"]
+        return cls(model, len(features["mean"]), features["mean"], features["scale"],
+                   score["mean"][0], score["scale"][0])
+
+
+def load_scoring_model(model_path, tabular_dim, feature_scaler_path=None, score_scaler_path=None,
+                       image_size=None, backbone=None, mmap=False, scaler_params=None):
+    # returns (ScaledFusionModel in eval mode, metadata). folded checkpoints (fold_scalers.py) load
+    # with torch alone; plain checkpoints take scaler_params.json when given, else fall back to
+    # unpickling the sklearn scalers with joblib.
+    # with mmap=True the weights stay backed by the checkpoint file's page cache, so every
+    # process that maps the same file shares one physical copy
+    metadata = read_metadata(model_path)
+    image_size = int(image_size or metadata.get("image_size", DEFAULT_IMAGE_SIZE))
+    backbone = backbone or metadata.get("backbone", DEFAULT_BACKBONE)
+    folded = metadata.get("scalers_folded")
+
+    # on the meta device nothing is allocated; the checkpoint tensors are assigned in directly
+    with torch.device("meta" if mmap else "cpu"):
+        base = CNNTFMModel(tabular_dim=tabular_dim, image_size=image_size, backbone=backbone)
+        if folded:
+            model = ScaledFusionModel(base, tabular_dim)
+    state = torch.load(model_path, map_location="cpu", mmap=mmap, weights_only=True)
+
+    if folded:
+        model.load_state_dict(state, assign=mmap)
+    elif scaler_params:
+        base.load_state_dict(state, assign=mmap)
+        model = ScaledFusionModel.from_params(base, scaler_params)
+    else:
+        import joblib
+
+        base.load_state_dict(state, assign=mmap)
+        model = ScaledFusionModel.from_sklearn(base, joblib.load(feature_scaler_path), joblib.load(score_scaler_path))
+
+    # frozen for serving: no autograd state, and nothing ever writes to (and un-shares) the weights
+    model.requires_grad_(False)
+    return model.eval(), metadata
+
+
+# --------------------------
+# checkpoint metadata (sidecar json next to the .pth)
+# --------------------------
+def metadata_path(model_path):
+    return os.path.splitext(model_path)[0] + ".json"
+
+
+def read_metadata(model_path):
+    path = metadata_path(model_path)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_metadata(model_path, **metadata):
+    with open(metadata_path(model_path), "w") as f:
+        json.dump(metadata, f, indent=2)
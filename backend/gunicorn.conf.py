@@ -0,0 +1,35 @@
+# gunicorn -c gunicorn.conf.py app:app
+#
+# the app (and its model weights) is loaded once in the master and then forked, so the
+# workers start from the parent's pages instead of each loading their own copy.
+# WEIGHT_SHARING=fork puts the weights in shared memory first; WEIGHT_SHARING=mmap maps
+# them from the checkpoint file, which also shares them with other servers on the host.
+import gc
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+preload_app = True
+timeout = 120
+
+os.environ.setdefault("WEIGHT_SHARING", "fork")
+# MODEL_VERSIONS load in the master before the fork: a background load thread started there
+# would not exist in the workers, leaving those versions "loading" forever
+os.environ.setdefault("PRELOAD_MODEL_VERSIONS", "1")
+# /models changes reach every worker through this file (each worker polls it), not just the
+# worker that served the request
+os.environ.setdefault("MODEL_STATE_PATH", "model_state.json")
+
+
+def pre_fork(server, worker):
+    # move everything allocated during import into the permanent generation so the
+    # workers' garbage collector doesn't write to (and un-share) those pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # one intra-op thread pool per worker, sized so the workers don't oversubscribe the cores
+    import torch
+
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
@@ -0,0 +1,116 @@
+"""
+measures per-worker RSS and PSS (linux /proc/<pid>/smaps_rollup) for N worker processes
+under each weight sharing mode, the numbers behind WEIGHT_SHARING in app.py.
+
+    python measure_memory.py model/best_model.pth --workers 4
+    python measure_memory.py --random --workers 4          # no checkpoint needed
+
+PSS splits each shared page between the processes mapping it, so the PSS sum is
+the real memory cost of the whole worker pool. the parent (gunicorn's master) is in
+the total for every mode: in fork mode it holds the weights the workers share, and
+leaving it out would hide its share of them.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import tempfile
+
+import torch
+
+from fusion import CNNTFMModel
+from registry import WEIGHT_SHARING_MODES, ModelRegistry
+
+TABULAR_DIM = 6
+FEATURE_SCALER_PATH = "scalers/feature_scaler.pkl"
+SCORE_SCALER_PATH = "scalers/score_scaler.pkl"
+
+
+def memory_kb(pid):
+    stats = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:", "Shared_Clean:", "Shared_Dirty:", "Private_Clean:", "Private_Dirty:"):
+                stats[parts[0][:-1].lower()] = int(parts[1])
+    return stats
+
+
+def load_registry(path, mode):
+    registry = ModelRegistry(TABULAR_DIM, FEATURE_SCALER_PATH, SCORE_SCALER_PATH, weight_sharing=mode)
+    registry.load("measure", path)
+    return registry
+
+
+def serve(registry, path, mode, ready, done):
+    # a stand-in worker: load (unless inherited from the parent), run one forward pass, then idle
+    if registry is None:
+        registry = load_registry(path, mode)
+    model = registry.get().model
+    size = model.image_size
+    with torch.no_grad():
+        model(torch.randn(1, 3, size, size), torch.randn(1, TABULAR_DIM))
+    ready.set()
+    done.wait()
+
+
+def measure(path, mode, workers):
+    # fork mode loads once in the parent like gunicorn preload_app; the others load per worker
+    ctx = mp.get_context("fork")
+    registry = load_registry(path, mode) if mode == "fork" else None
+    done = ctx.Event()
+    procs, events = [], []
+    for _ in range(workers):
+        ready = ctx.Event()
+        proc = ctx.Process(target=serve, args=(registry, path, mode, ready, done))
+        proc.start()
+        procs.append(proc)
+        events.append(ready)
+    for ready in events:
+        ready.wait()
+
+    per_worker = [memory_kb(p.pid) for p in procs]
+    parent = memory_kb(os.getpid())  # while the workers still share its pages
+    done.set()
+    for proc in procs:
+        proc.join()
+
+    return {
+        "mode": mode,
+        "workers": workers,
+        "rss_mb_per_worker": sum(m["rss"] for m in per_worker) / workers / 1024,
+        "pss_mb_per_worker": sum(m["pss"] for m in per_worker) / workers / 1024,
+        "pss_mb_parent": parent["pss"] / 1024,
+        "pss_mb_total": (parent["pss"] + sum(m["pss"] for m in per_worker)) / 1024,
+        "per_worker_kb": per_worker,
+        "parent_kb": parent,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="per-worker RSS/PSS for each weight sharing mode")
+    parser.add_argument("checkpoint", nargs="?", default="model/best_model.pth")
+    parser.add_argument("--random", action="store_true", help="measure a randomly initialized model")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--modes", default=",".join(WEIGHT_SHARING_MODES))
+    parser.add_argument("--output", default="memory_report.json")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.checkpoint
+        if args.random:
+            path = os.path.join(tmp, "random_model.pth")
+            torch.save(CNNTFMModel(tabular_dim=TABULAR_DIM).state_dict(), path)
+
+        report = [measure(path, mode, args.workers) for mode in args.modes.split(",")]
+
+    print(f"{'mode':<6} {'rss/worker MB':>14} {'pss/worker MB':>14} {'pss parent MB':>14} {'pss total MB':>13}")
+    for r in report:
+        print(f"{r['mode']:<6} {r['rss_mb_per_worker']:>14.1f} {r['pss_mb_per_worker']:>14.1f} "
+              f"{r['pss_mb_parent']:>14.1f} {r['pss_mb_total']:>13.1f}")
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
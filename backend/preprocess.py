@@ -0,0 +1,101 @@
+import threading
+
+import numpy as np
+import torch
+from PIL import Image
+
+
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+
+class Preprocessor:
+    # fast replacement for Resize -> ToTensor -> Normalize.
+    #  - decode straight to the model size (jpeg draft mode lets libjpeg scale by 1/2..1/8 while decoding)
+    #  - resize in uint8 with the same PIL bilinear filter torchvision uses for PIL images
+    #  - ToTensor + Normalize fused into one multiply-add written into a reusable per-thread batch buffer
+    def __init__(self, image_size=224, mean=IMAGENET_MEAN, std=IMAGENET_STD, use_draft=True):
+        self.image_size = image_size
+        self.use_draft = use_draft
+        std = torch.tensor(std, dtype=torch.float32)
+        mean = torch.tensor(mean, dtype=torch.float32)
+        self.scale = (1.0 / (255.0 * std)).view(1, 3, 1, 1)
+        self.bias = (-mean / std).view(1, 3, 1, 1)
+        self._local = threading.local()
+
+    # --- decoding ---
+    def decode(self, fp):
+        # returns the uint8 pixels at model size and the (width, height) of the upload
+        image = Image.open(fp)
+        source_size = image.size
+        if self.use_draft and image.format == "JPEG":
+            # only shrinks while the result stays at least image_size on both sides
+            image.draft("RGB", (self.image_size, self.image_size))
+        return self.resize(image.convert("RGB")), source_size
+
+    def resize(self, image):
+        size = (self.image_size, self.image_size)
+        if image.size != size:
+            image = image.resize(size, Image.BILINEAR)
+        return np.array(image, dtype=np.uint8)
+
+    def from_array(self, pixels):
+        # raw uint8 pixels, HWC (or CHW) RGB, any size
+        pixels = np.asarray(pixels)
+        if pixels.dtype != np.uint8 or pixels.ndim != 3:
+            raise ValueError("pixels must be a uint8 array of shape (H, W, 3)")
+        if pixels.shape[0] == 3 and pixels.shape[2] != 3:
+            pixels = pixels.transpose(1, 2, 0)
+        if pixels.shape[2] != 3:
+            raise ValueError("pixels must have 3 channels")
+        if pixels.shape[:2] != (self.image_size, self.image_size):
+            return self.resize(Image.fromarray(np.ascontiguousarray(pixels)))
+        return pixels
+
+    def check_tensor(self, tensor):
+        # already normalized float32 (3, S, S) tensor, the packed format the model consumes directly
+        tensor = np.asarray(tensor)
+        if tensor.dtype != np.float32 or tensor.shape != (3, self.image_size, self.image_size):
+            raise ValueError(f"tensor must be float32 of shape (3, {self.image_size}, {self.image_size})")
+        return tensor
+
+    # --- batching ---
+    def _buffer(self, n):
+        buf = getattr(self._local, "buffer", None)
+        if buf is None or buf.shape[0] < n:
+            buf = torch.empty(max(n, 1), 3, self.image_size, self.image_size, dtype=torch.float32)
+            self._local.buffer = buf
+        return buf[:n]
+
+    def batch(self, items):
+        # items are uint8 HWC arrays (from decode/from_array) or float32 CHW arrays (from check_tensor).
+        # the returned tensor is a view of this thread's buffer and is overwritten by the next call
+        out = self._buffer(len(items))
+        for i, item in enumerate(items):
+            if item.dtype == np.uint8:
+                out[i].copy_(torch.from_numpy(item).permute(2, 0, 1))
+            else:
+                out[i].copy_(torch.from_numpy(item))
+        pixel_rows = [i for i, item in enumerate(items) if item.dtype == np.uint8]
+        if len(pixel_rows) == len(items):
+            out.mul_(self.scale).add_(self.bias)
+        elif pixel_rows:
+            out[pixel_rows] = out[pixel_rows] * self.scale + self.bias
+        return out
+
+    def __call__(self, image):
+        # drop-in for the old torchvision transform on a single PIL image; returns (3, S, S)
+        return self.batch([self.resize(image.convert("RGB"))])[0].clone()
+
+
+def load_upload(preprocessor, files):
+    # picks the cheapest representation the client sent: tensor > pixels > encoded image.
+    # tensor and pixels are .npy files; returns (array, (width, height) of the upload)
+    if "tensor" in files:
+        tensor = preprocessor.check_tensor(np.load(files["tensor"], allow_pickle=False))
+        return tensor, (tensor.shape[2], tensor.shape[1])
+    if "pixels" in files:
+        pixels = np.load(files["pixels"], allow_pickle=False)
+        source_size = (pixels.shape[1], pixels.shape[0]) if pixels.ndim == 3 else (0, 0)
+        return preprocessor.from_array(pixels), source_size
+    return preprocessor.decode(files["image"])
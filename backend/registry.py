@@ -0,0 +1,245 @@
+import copy
+import json
+import os
+import threading
+import time
+
+from fusion import load_scoring_model
+from preprocess import Preprocessor
+
+try:
+    import psutil
+except ImportError:  # memory reporting falls back to parameter bytes only
+    psutil = None
+
+
+WEIGHT_SHARING_MODES = ("none", "mmap", "fork")
+STATE_POLL_SECONDS = 1.0
+
+
+def _rss():
+    return psutil.Process().memory_info().rss if psutil else None
+
+
+def _tensor_bytes(model):
+    return sum(t.numel() * t.element_size() for t in list(model.parameters()) + list(model.buffers()))
+
+
+class ModelVersion:
+    # one resident model: checkpoint (with scalers folded in), metadata and its preprocessor
+    def __init__(self, name, path, model, metadata, load_seconds, rss_delta):
+        self.name = name
+        self.path = path
+        self.model = model
+        self.metadata = metadata
+        self.preprocessor = Preprocessor(image_size=model.image_size)
+        self.loaded_at = time.time()
+        self.load_seconds = load_seconds
+        self.tensor_bytes = _tensor_bytes(model)
+        self.rss_delta = rss_delta  # approximate when other loads or requests overlap
+
+    def describe(self):
+        return {
+            "name": self.name,
+            "path": self.path,
+            "backbone": self.model.backbone,
+            "image_size": self.model.image_size,
+            "scalers_folded": bool(self.metadata.get("scalers_folded")),
+            "loaded_at": self.loaded_at,
+            "load_seconds": round(self.load_seconds, 3),
+            "tensor_bytes": self.tensor_bytes,
+            "rss_delta_bytes": self.rss_delta,
+        }
+
+
+class ModelRegistry:
+    # versions are loaded off the request path and published by swapping in a new dict,
+    # so readers never lock and in-flight requests keep the ModelVersion they started with.
+    # weight_sharing decides how weights are shared between worker processes:
+    #   "none"   every process holds a private copy
+    #   "mmap"   weights map the checkpoint file, all processes share its page cache
+    #   "fork"   weights move to shared memory before the server forks (gunicorn preload_app)
+    # changes (add, set_default, set_shadow, unload) go through a desired state: {"versions":
+    # {name: path}, "default", "shadow"}. with state_path it is a json file that every worker
+    # process polls, so a change made through any one worker reaches all of them; without it
+    # (a single process) it lives in memory only.
+    def __init__(self, tabular_dim, feature_scaler_path, score_scaler_path, weight_sharing="none", state_path=None,
+                 poll_seconds=STATE_POLL_SECONDS):
+        if weight_sharing not in WEIGHT_SHARING_MODES:
+            raise ValueError(f"weight_sharing must be one of {WEIGHT_SHARING_MODES}")
+        self.weight_sharing = weight_sharing
+        self.tabular_dim = tabular_dim
+        self.feature_scaler_path = feature_scaler_path
+        self.score_scaler_path = score_scaler_path
+        self.versions = {}
+        self.default = None
+        self.shadow = None
+        self.loading = {}  # name -> "loading" or the error of the last failed attempt
+        self.state = {"versions": {}, "default": None, "shadow": None}
+        self.state_path = state_path
+        self.poll_seconds = poll_seconds
+        self._state_mtime = None
+        self._next_poll = 0.0
+        self._pending_default = None  # desired default that is still loading here
+        self._lock = threading.Lock()
+
+    # --- loading ---
+    def load(self, name, path, make_default=False, image_size=None, backbone=None):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        rss_before = _rss()
+        t0 = time.perf_counter()
+        model, metadata = load_scoring_model(path, self.tabular_dim, self.feature_scaler_path,
+                                             self.score_scaler_path, image_size=image_size, backbone=backbone,
+                                             mmap=self.weight_sharing == "mmap")
+        if self.weight_sharing == "fork":
+            model.share_memory()
+        rss_after = _rss()
+        version = ModelVersion(name, path, model, metadata, time.perf_counter() - t0,
+                               None if rss_before is None else rss_after - rss_before)
+
+        with self._lock:
+            versions = dict(self.versions)
+            versions[name] = version
+            if name == self._pending_default:
+                # the old default was only kept until this one arrived
+                versions = {n: v for n, v in versions.items() if n in self.state["versions"]}
+                self._pending_default = None
+                make_default = True
+            self.versions = versions
+            if make_default or self.default is None:
+                self.default = name
+            self.loading.pop(name, None)
+        return version
+
+    def try_load(self, name, path, make_default=False, **kwargs):
+        # load() that records a failure in `loading` (shown by /models) instead of raising
+        try:
+            return self.load(name, path, make_default, **kwargs)
+        except Exception as e:
+            with self._lock:
+                self.loading[name] = f"failed: {e}"
+            return None
+
+    def load_async(self, name, path, make_default=False, **kwargs):
+        with self._lock:
+            if self.loading.get(name) == "loading":
+                return False
+            self.loading[name] = "loading"
+        threading.Thread(target=self.try_load, args=(name, path, make_default), kwargs=kwargs,
+                         name=f"load-{name}", daemon=True).start()
+        return True
+
+    # --- routing ---
+    def get(self, name=None):
+        # KeyError for unknown versions; None only when nothing is loaded yet
+        versions = self.versions
+        if name:
+            return versions[name]
+        return versions.get(self.default)
+
+    def get_shadow(self):
+        return self.versions.get(self.shadow) if self.shadow else None
+
+    # --- changes, through the desired state ---
+    def add(self, name, path, make_default=False):
+        # False when this process is already loading that name; the load itself is in the background
+        if self.loading.get(name) == "loading":
+            return False
+
+        def change(state):
+            state["versions"][name] = path
+            if make_default:
+                state["default"] = name
+        self.update(change)
+        return True
+
+    def set_default(self, name):
+        if name not in self.versions:
+            raise KeyError(name)
+        self.update(lambda state: state.update(default=name))
+
+    def set_shadow(self, name):
+        if name is not None and name not in self.versions:
+            raise KeyError(name)
+        self.update(lambda state: state.update(shadow=name))
+
+    def unload(self, name):
+        if name not in self.versions:
+            raise KeyError(name)
+        if name == self.default:
+            raise ValueError("cannot unload the default version")
+
+        def change(state):
+            state["versions"].pop(name, None)
+            if state["shadow"] == name:
+                state["shadow"] = None
+        self.update(change)
+
+    def update(self, change):
+        # change(state) edits the desired state in place. with a state file the edit is a locked
+        # read-modify-write of the file, so changes made through different workers don't race
+        if self.state_path is None:
+            state = copy.deepcopy(self.state)
+            change(state)
+            self.apply(state)
+            return
+        import fcntl
+
+        with open(self.state_path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            state = self._read_state() if os.path.exists(self.state_path) else copy.deepcopy(self.state)
+            change(state)
+            tmp = f"{self.state_path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp, self.state_path)
+            self._state_mtime = os.stat(self.state_path).st_mtime_ns
+        self.apply(state)
+
+    def poll(self):
+        # picks up changes other processes wrote to the state file; at most one stat per poll_seconds
+        if self.state_path is None or time.monotonic() < self._next_poll:
+            return
+        self._next_poll = time.monotonic() + self.poll_seconds
+        try:
+            mtime = os.stat(self.state_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._state_mtime:
+            self.apply(self._read_state())
+
+    def _read_state(self):
+        with open(self.state_path) as f:
+            self._state_mtime = os.fstat(f.fileno()).st_mtime_ns
+            return json.load(f)
+
+    def apply(self, state):
+        # brings this process to the desired state: missing versions load in the background, the
+        # default switches once its version is resident, the shadow applies once loaded (get_shadow)
+        # and versions no longer wanted are dropped. in-flight requests keep the version they hold
+        self.state = state
+        for name, path in state["versions"].items():
+            if name not in self.versions or self.versions[name].path != path:
+                self.load_async(name, path)
+        with self._lock:
+            if state["default"] in self.versions:
+                self.default = state["default"]
+                self._pending_default = None
+            else:
+                self._pending_default = state["default"]
+            self.shadow = state["shadow"]
+            self.versions = {n: v for n, v in self.versions.items() if n in state["versions"] or n == self.default}
+
+    def describe(self):
+        versions = self.versions
+        return {
+            "default": self.default,
+            "shadow": self.shadow,
+            "versions": [v.describe() for v in versions.values()],
+            "loading": dict(self.loading),
+            "tensor_bytes_total": sum(v.tensor_bytes for v in versions.values()),
+            "rss_bytes": _rss(),
+            "weight_sharing": self.weight_sharing,
+            "state_path": self.state_path,
+        }
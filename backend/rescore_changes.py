@@ -0,0 +1,228 @@
+"""
+incremental rescoring for a new imagery composite: only tiles that actually changed go
+through the model, everything else keeps its score.
+
+    # once, for the composite the current scores were made from
+    python rescore_changes.py index --image-dir ../model/earth_engine/converted_png
+    # after exporting and converting the new season
+    python rescore_changes.py update model/best_model.pth --image-dir ../model/earth_engine/converted_png_2023q1 \
+        --features ../model/data/tile_features_2023q1.csv --threshold 0.05
+
+per tile we cache a cheap descriptor of the image it was last scored from: per-band
+mean/std and an 8x8 thumbnail. a cnn embedding would cost as much as scoring the tile,
+so the descriptor has to be much cheaper than the model to save anything. a tile is
+rescored when
+  - the rms difference of its thumbnails (0..1 pixel units) is above --threshold, or
+  - a band mean moved by more than --band-threshold, or
+  - one of its tabular features moved by more than --feature-threshold training stds, or
+  - it has no cached descriptor or no previous score
+carried tiles keep their old descriptor, so slow drift still adds up to a rescore.
+scores are read from and written to the predictions csv that pipeline/run_pipeline.py
+produces (tile_id, lon, lat, score, input_hash).
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from adaptive_scoring import FEATURE_CSV_PATH, IMAGE_DIR, TABULAR_FEATURES, FeatureLayers, score_cells
+from fusion import load_scoring_model
+from preprocess import Preprocessor
+from score_grid import ScoreGrid
+
+STATS_PATH = "tile_stats.npz"
+PREDICTIONS_PATH = "../model/predictions.csv"
+FEATURE_SCALER_PATH = "scalers/feature_scaler.pkl"
+SCORE_SCALER_PATH = "scalers/score_scaler.pkl"
+THUMBNAIL_SIZE = 8
+
+
+# --------------------------
+# per-tile descriptors
+# --------------------------
+def describe_tile(path):
+    # (band mean, band std, thumbnail) in 0..1 pixel units
+    image = Image.open(path).convert("RGB")
+    pixels = np.asarray(image, dtype=np.float32) / 255.0
+    thumbnail = np.asarray(image.resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.BOX), dtype=np.float32) / 255.0
+    return pixels.mean(axis=(0, 1)), pixels.std(axis=(0, 1)), thumbnail
+
+
+def tile_id(path):
+    return os.path.basename(path)[len("sentinel2_"):-len(".png")]
+
+
+class TileStats:
+    # descriptors of the images the current scores were computed from, by tile id
+    def __init__(self, tile_ids, band_mean, band_std, thumbnails, features=None):
+        self.tile_ids = list(tile_ids)
+        self.band_mean = band_mean
+        self.band_std = band_std
+        self.thumbnails = thumbnails
+        self.features = features  # raw tabular vectors, nan rows when unknown
+        self.position = {t: i for i, t in enumerate(self.tile_ids)}
+
+    @classmethod
+    def from_images(cls, paths, features=None):
+        described = [describe_tile(path) for path in paths]
+        return cls([tile_id(path) for path in paths],
+                   np.stack([d[0] for d in described]), np.stack([d[1] for d in described]),
+                   np.stack([d[2] for d in described]), features)
+
+    def save(self, path):
+        features = self.features if self.features is not None else np.full((len(self.tile_ids), 0), np.nan)
+        np.savez_compressed(path, tile_ids=np.asarray(self.tile_ids), band_mean=self.band_mean,
+                            band_std=self.band_std, thumbnails=self.thumbnails, features=features)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        features = data["features"] if data["features"].shape[1] else None
+        return cls(data["tile_ids"].tolist(), data["band_mean"], data["band_std"], data["thumbnails"], features)
+
+
+# --------------------------
+# change detection
+# --------------------------
+def detect_changes(old, new, thresholds, feature_weight=None):
+    # returns {tile_id: reason} for every tile of `new` that needs the model
+    changed = {}
+    for i, tid in enumerate(new.tile_ids):
+        j = old.position.get(tid)
+        if j is None:
+            changed[tid] = "new tile"
+            continue
+        if np.sqrt(np.mean((new.thumbnails[i] - old.thumbnails[j]) ** 2)) > thresholds["thumbnail"]:
+            changed[tid] = "image"
+        elif np.abs(new.band_mean[i] - old.band_mean[j]).max() > thresholds["band"]:
+            changed[tid] = "band mean"
+        elif new.features is not None:
+            if old.features is None or np.isnan(old.features[j]).any():
+                changed[tid] = "features"
+            else:
+                weight = np.ones(new.features.shape[1]) if feature_weight is None else np.abs(feature_weight)
+                if (np.abs(new.features[i] - old.features[j]) * weight).max() > thresholds["feature"]:
+                    changed[tid] = "features"
+    return changed
+
+
+def update(model_path, image_dir, features_csv, stats_path, predictions_path, thresholds, grid_output=None,
+           batch_size=64):
+    t0 = time.perf_counter()
+    model, _ = load_scoring_model(model_path, len(TABULAR_FEATURES), FEATURE_SCALER_PATH, SCORE_SCALER_PATH)
+    layers = FeatureLayers.from_tiles(features_csv, image_dir)
+    cells = sorted(layers.image_paths)
+    paths = [layers.image_paths[cell] for cell in cells]
+
+    old = TileStats.load(stats_path)
+    new = TileStats.from_images(paths, np.stack([layers.features[cell] for cell in cells]))
+    changed = detect_changes(old, new, thresholds,
+                             model.feature_weight.numpy() if hasattr(model, "feature_weight") else None)
+
+    previous = pd.read_csv(predictions_path) if os.path.exists(predictions_path) else pd.DataFrame(
+        columns=["tile_id", "score"])
+    previous_scores = dict(zip(previous["tile_id"].astype(str), previous["score"]))
+    for tid in new.tile_ids:
+        if tid not in changed and tid not in previous_scores:
+            changed[tid] = "no previous score"
+    t_detect = time.perf_counter() - t0
+
+    todo = [i for i, tid in enumerate(new.tile_ids) if tid in changed]
+    scores = np.array([previous_scores.get(tid, np.nan) for tid in new.tile_ids], dtype=np.float32)
+    t1 = time.perf_counter()
+    if todo:
+        rows = np.array([cells[i][0] for i in todo])
+        cols = np.array([cells[i][1] for i in todo])
+        scores[todo] = score_cells(model, Preprocessor(image_size=model.image_size), layers, 1, rows, cols,
+                                   batch_size)
+    t_score = time.perf_counter() - t1
+
+    # carried tiles keep the descriptor they were scored from
+    merged = TileStats(new.tile_ids, new.band_mean.copy(), new.band_std.copy(), new.thumbnails.copy(),
+                       new.features.copy())
+    for i, tid in enumerate(new.tile_ids):
+        if tid not in changed:
+            j = old.position[tid]
+            merged.band_mean[i], merged.band_std[i] = old.band_mean[j], old.band_std[j]
+            merged.thumbnails[i], merged.features[i] = old.thumbnails[j], old.features[j]
+    merged.save(stats_path)
+
+    rows, cols = np.array(cells).T
+    lon, lat = layers.grid.cell_centers(rows, cols)
+    out = pd.DataFrame({"tile_id": new.tile_ids, "lon": lon, "lat": lat, "score": scores})
+    if "input_hash" in previous.columns:  # keep the pipeline's per-tile keys for carried tiles
+        hashes = dict(zip(previous["tile_id"].astype(str), previous["input_hash"]))
+        out["input_hash"] = [None if tid in changed else hashes.get(tid) for tid in new.tile_ids]
+    out.to_csv(predictions_path, index=False)
+    if grid_output:
+        grid = ScoreGrid([layers.grid.west, layers.grid.south, layers.grid.east, layers.grid.north],
+                         layers.grid.cell_size)
+        grid.set_scores(lon, lat, scores)
+        grid.save(grid_output)
+
+    reasons = {}
+    for reason in changed.values():
+        reasons[reason] = reasons.get(reason, 0) + 1
+    per_tile = t_score / len(todo) if todo else 0.0
+    return {
+        "tiles": len(new.tile_ids),
+        "recomputed": len(todo),
+        "carried_forward": len(new.tile_ids) - len(todo),
+        "fraction_recomputed": round(len(todo) / len(new.tile_ids), 4) if new.tile_ids else 0.0,
+        "reasons": reasons,
+        "thresholds": thresholds,
+        "detect_seconds": round(t_detect, 3),
+        "score_seconds": round(t_score, 3),
+        "full_rescore_seconds_estimate": round(per_tile * len(new.tile_ids), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="rescore only the tiles a new composite changed")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    index = sub.add_parser("index", help="cache descriptors for the composite the current scores came from")
+    index.add_argument("--image-dir", default=IMAGE_DIR)
+    index.add_argument("--features", default=FEATURE_CSV_PATH)
+    index.add_argument("--stats", default=STATS_PATH)
+
+    upd = sub.add_parser("update", help="detect changed tiles in a new composite and rescore only those")
+    upd.add_argument("checkpoint", nargs="?", default="model/best_model.pth")
+    upd.add_argument("--image-dir", required=True, help="converted pngs of the new composite")
+    upd.add_argument("--features", default=FEATURE_CSV_PATH, help="tile features exported with the new composite")
+    upd.add_argument("--stats", default=STATS_PATH)
+    upd.add_argument("--predictions", default=PREDICTIONS_PATH)
+    upd.add_argument("--threshold", type=float, default=0.05, help="thumbnail rms difference, 0..1 pixel units")
+    upd.add_argument("--band-threshold", type=float, default=0.03, help="largest band mean shift, 0..1")
+    upd.add_argument("--feature-threshold", type=float, default=0.25, help="largest feature shift, training stds")
+    upd.add_argument("--output-grid", help="also write the merged ScoreGrid .npz")
+    upd.add_argument("--report", default="rescore_report.json")
+    args = parser.parse_args()
+
+    if args.command == "index":
+        layers = FeatureLayers.from_tiles(args.features, args.image_dir)
+        cells = sorted(layers.image_paths)
+        stats = TileStats.from_images([layers.image_paths[cell] for cell in cells],
+                                      np.stack([layers.features[cell] for cell in cells]))
+        stats.save(args.stats)
+        print(f"indexed {len(cells)} tiles -> {args.stats}")
+        return
+
+    thresholds = {"thumbnail": args.threshold, "band": args.band_threshold, "feature": args.feature_threshold}
+    report = update(args.checkpoint, args.image_dir, args.features, args.stats, args.predictions, thresholds,
+                    args.output_grid)
+    print(f"{report['recomputed']} of {report['tiles']} tiles recomputed "
+          f"({report['fraction_recomputed']:.1%}), {report['carried_forward']} carried forward")
+    print("reasons: " + ", ".join(f"{k} {v}" for k, v in report["reasons"].items()))
+    print(f"detection {report['detect_seconds']:.1f}s, scoring {report['score_seconds']:.1f}s "
+          f"(full rescore ~{report['full_rescore_seconds_estimate']:.1f}s)")
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
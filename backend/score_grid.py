@@ -0,0 +1,181 @@
+import json
+from collections import OrderedDict
+
+import numpy as np
+from affine import Affine
+from rasterio.features import rasterize
+
+
+# --------------------------
+# grid defaults (match the earth engine tile exports)
+# --------------------------
+ROI_BOUNDS = [31.9, 0.2, 34.5, 2.5]  # west, south, east, north
+CELL_SIZE = 0.01
+MASK_CACHE_SIZE = 64
+
+
+class ScoreGrid:
+    # dense north-up raster of tile scores; nan marks cells with no score.
+    # transform follows the rasterio/gdal order (a, b, c, d, e, f):
+    #   lon = c + col * a,  lat = f + row * e
+    def __init__(self, bounds=ROI_BOUNDS, cell_size=CELL_SIZE, scores=None):
+        self.west, self.south, self.east, self.north = [float(b) for b in bounds]
+        self.cell_size = float(cell_size)
+        self.width = int(round((self.east - self.west) / self.cell_size))
+        self.height = int(round((self.north - self.south) / self.cell_size))
+        self.transform = (self.cell_size, 0.0, self.west, 0.0, -self.cell_size, self.north)
+
+        if scores is None:
+            scores = np.full((self.height, self.width), np.nan, dtype=np.float32)
+        if scores.shape != (self.height, self.width):
+            raise ValueError(f"scores shape {scores.shape} does not match grid {(self.height, self.width)}")
+        self.scores = scores
+        self._mask_cache = OrderedDict()
+        self.mask_hits = 0
+        self.mask_misses = 0
+
+    # --- coordinates <-> cells ---
+    def index(self, lon, lat):
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        cols = np.floor((lon - self.west) / self.cell_size).astype(np.int64)
+        rows = np.floor((self.north - lat) / self.cell_size).astype(np.int64)
+        valid = (cols >= 0) & (cols < self.width) & (rows >= 0) & (rows < self.height)
+        return rows, cols, valid
+
+    def cell_centers(self, rows, cols):
+        lon = self.west + (np.asarray(cols) + 0.5) * self.cell_size
+        lat = self.north - (np.asarray(rows) + 0.5) * self.cell_size
+        return lon, lat
+
+    def set_scores(self, lon, lat, scores):
+        rows, cols, valid = self.index(lon, lat)
+        scores = np.asarray(scores, dtype=self.scores.dtype)
+        self.scores[rows[valid], cols[valid]] = scores[valid]
+        self._mask_cache.clear()
+        return int(valid.sum())
+
+    # --- point lookup ---
+    def lookup(self, lon, lat):
+        # vectorized; out of bounds or unscored cells come back as nan
+        rows, cols, valid = self.index(lon, lat)
+        out = np.full(rows.shape, np.nan, dtype=self.scores.dtype)
+        out[valid] = self.scores[rows[valid], cols[valid]]
+        return out
+
+    # --- bbox windows ---
+    def window_slices(self, west, south, east, north):
+        col0 = max(int(np.floor((west - self.west) / self.cell_size)), 0)
+        col1 = min(int(np.ceil((east - self.west) / self.cell_size)), self.width)
+        row0 = max(int(np.floor((self.north - north) / self.cell_size)), 0)
+        row1 = min(int(np.ceil((self.north - south) / self.cell_size)), self.height)
+        return slice(row0, max(row0, row1)), slice(col0, max(col0, col1))
+
+    def window_transform(self, rows, cols):
+        # transform of the window's top-left cell
+        return (
+            self.cell_size, 0.0, self.west + cols.start * self.cell_size,
+            0.0, -self.cell_size, self.north - rows.start * self.cell_size,
+        )
+
+    def window(self, west, south, east, north):
+        # returns a view (no copy) plus the window's transform
+        rows, cols = self.window_slices(west, south, east, north)
+        return self.scores[rows, cols], self.window_transform(rows, cols)
+
+    # --- zonal aggregation ---
+    def mask(self, geometry):
+        # rasterize a geojson polygon/multipolygon onto the grid by cell centre (gdal's scanline
+        # fill, so the cost is per row and edge rather than per cell and edge).
+        # masks are cached per geometry and stored only for the geometry's bbox window.
+        key = json.dumps(geometry, sort_keys=True)
+        cached = self._mask_cache.get(key)
+        if cached is not None:
+            self.mask_hits += 1
+            self._mask_cache.move_to_end(key)
+            return cached
+        self.mask_misses += 1
+
+        geometry = _polygon_geometry(geometry)
+        if geometry is None:
+            raise ValueError("geometry must be a Polygon or MultiPolygon")
+        all_xy = np.concatenate(_geometry_rings(geometry))
+        rows, cols = self.window_slices(all_xy[:, 0].min(), all_xy[:, 1].min(),
+                                        all_xy[:, 0].max(), all_xy[:, 1].max())
+
+        shape = (rows.stop - rows.start, cols.stop - cols.start)
+        if 0 in shape:
+            inside = np.zeros(shape, dtype=bool)
+        else:
+            inside = rasterize([geometry], out_shape=shape, transform=Affine(*self.window_transform(rows, cols)),
+                               fill=0, default_value=1, dtype="uint8").astype(bool)
+
+        entry = (rows, cols, inside)
+        self._mask_cache[key] = entry
+        if len(self._mask_cache) > MASK_CACHE_SIZE:
+            self._mask_cache.popitem(last=False)
+        return entry
+
+    def zonal_stats(self, geometry):
+        rows, cols, inside = self.mask(geometry)
+        values = self.scores[rows, cols][inside]
+        values = values[~np.isnan(values)]
+        stats = {"cells": int(inside.sum()), "count": int(values.size)}
+        if values.size:
+            stats.update({
+                "mean": float(values.mean()),
+                "min": float(values.min()),
+                "max": float(values.max()),
+                "std": float(values.std()),
+            })
+        else:
+            stats.update({"mean": None, "min": None, "max": None, "std": None})
+        return stats
+
+    # --- persistence ---
+    def save(self, path):
+        np.savez_compressed(path, scores=self.scores,
+                            bounds=np.array([self.west, self.south, self.east, self.north]),
+                            cell_size=np.array(self.cell_size))
+
+    @classmethod
+    def load(cls, path):
+        if path.endswith(".npz"):
+            data = np.load(path)
+            return cls(bounds=data["bounds"].tolist(), cell_size=float(data["cell_size"]),
+                       scores=data["scores"])
+        return cls.from_geojson(path)
+
+    @classmethod
+    def from_geojson(cls, path, bounds=ROI_BOUNDS, cell_size=CELL_SIZE, score_key="score"):
+        # scored tiles are axis aligned cells, so the sw corner of each ring locates the cell
+        with open(path) as f:
+            fc = json.load(f)
+
+        lons, lats, scores = [], [], []
+        for feature in fc["features"]:
+            score = feature["properties"].get(score_key)
+            if score is None:
+                continue
+            ring = np.asarray(feature["geometry"]["coordinates"][0], dtype=np.float64)
+            lons.append(ring[:, 0].min() + cell_size / 2)
+            lats.append(ring[:, 1].min() + cell_size / 2)
+            scores.append(score)
+
+        grid = cls(bounds=bounds, cell_size=cell_size)
+        grid.set_scores(lons, lats, scores)
+        return grid
+
+
+# --------------------------
+# polygon helpers
+# --------------------------
+def _polygon_geometry(geometry):
+    if geometry.get("type") == "Feature":
+        geometry = geometry["geometry"]
+    return geometry if geometry.get("type") in ("Polygon", "MultiPolygon") else None
+
+
+def _geometry_rings(geometry):
+    polygons = [geometry["coordinates"]] if geometry["type"] == "Polygon" else geometry["coordinates"]
+    return [np.asarray(ring, dtype=np.float64)[:, :2] for polygon in polygons for ring in polygon]
@@ -0,0 +1,369 @@
+"""
+streaming writers for scored tiles: GeoJSON-seq, FlatGeobuf and GeoParquet.
+
+    python tile_writer.py ../model/predictions.csv scores.fgb
+    python tile_writer.py ../model/predictions.csv scores.geojsonl.gz --precision 5
+    python tile_writer.py score_grid.npz scores.parquet --elide-geometry
+
+    with open_writer("scores.fgb", grid, precision=6) as writer:
+        for rows, cols, scores, tile_ids in batches:
+            writer.write(rows, cols, scores, tile_ids)
+
+tiles are written batch by batch as they are produced, so peak memory is one batch no
+matter how large the region is; nothing builds a FeatureCollection. every tile is a cell
+of a regular grid (ScoreGrid), so geometry comes from (row, col):
+  --precision       rounds coordinates to that many decimals (6 ~ 0.1 m). shrinks text
+                    formats directly and makes binary ones compress better
+  --elide-geometry  stores only the cell index (row, col) and writes the grid definition
+                    once: FlatGeobuf header metadata, parquet key-value metadata, or a
+                    .grid.json next to a GeoJSON-seq file. cell_polygon() rebuilds shapes.
+formats, by extension:
+  .geojsonl / .geojsons (optionally .gz)  one Feature per line (RFC 8142 style, no RS byte)
+  .fgb         FlatGeobuf without spatial index, encoded here, no extra dependency
+  .parquet     GeoParquet 1.0 (WKB, zstd row groups), needs pyarrow
+scores are stored as float32, which is what the model produces.
+"""
+import argparse
+import gzip
+import json
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+
+from score_grid import ScoreGrid
+
+GEO_PARQUET_VERSION = "1.0.0"
+GRID_METADATA_KEY = "canai:grid"
+BATCH_ROWS = 65536
+
+
+def grid_definition(grid):
+    return {"bounds": [grid.west, grid.south, grid.east, grid.north], "cell_size": grid.cell_size,
+            "width": grid.width, "height": grid.height}
+
+
+def cell_polygon(definition, row, col):
+    # closed ring of a grid cell, counter-clockwise from the south-west corner
+    west, _, _, north = definition["bounds"]
+    size = definition["cell_size"]
+    x0, y1 = west + col * size, north - row * size
+    x1, y0 = x0 + size, y1 - size
+    return [[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]
+
+
+def cell_rings(grid, rows, cols, precision):
+    # (n, 5, 2) float64 rings for a batch of cells
+    x0 = grid.west + np.asarray(cols, dtype=np.float64) * grid.cell_size
+    y1 = grid.north - np.asarray(rows, dtype=np.float64) * grid.cell_size
+    x1, y0 = x0 + grid.cell_size, y1 - grid.cell_size
+    rings = np.stack([np.stack(corner, axis=-1) for corner in ((x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0))],
+                     axis=1)
+    return rings if precision is None else rings.round(precision)
+
+
+# --------------------------
+# writers
+# --------------------------
+class TileWriter:
+    # subclasses implement _write(rows, cols, scores, tile_ids, rings) and _close()
+    def __init__(self, path, grid, precision=6, elide_geometry=False):
+        self.path = path
+        self.grid = grid
+        self.precision = precision
+        self.elide_geometry = elide_geometry
+        self.count = 0
+        self.bbox = [np.inf, np.inf, -np.inf, -np.inf]
+
+    def write(self, rows, cols, scores, tile_ids=None):
+        rows = np.asarray(rows, dtype=np.int32)
+        cols = np.asarray(cols, dtype=np.int32)
+        scores = np.asarray(scores, dtype=np.float32)
+        if not len(rows):
+            return
+        size = self.grid.cell_size
+        self.bbox = [min(self.bbox[0], self.grid.west + cols.min() * size),
+                     min(self.bbox[1], self.grid.north - (rows.max() + 1) * size),
+                     max(self.bbox[2], self.grid.west + (cols.max() + 1) * size),
+                     max(self.bbox[3], self.grid.north - rows.min() * size)]
+        rings = None if self.elide_geometry else cell_rings(self.grid, rows, cols, self.precision)
+        self._write(rows, cols, scores, None if tile_ids is None else [str(t) for t in tile_ids], rings)
+        self.count += len(rows)
+
+    def close(self):
+        self._close()
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class GeoJSONSeqWriter(TileWriter):
+    def __init__(self, path, grid, precision=6, elide_geometry=False):
+        super().__init__(path, grid, precision, elide_geometry)
+        self.file = gzip.open(path, "wt", compresslevel=6) if path.endswith(".gz") else open(path, "w")
+        if elide_geometry:
+            with open(path + ".grid.json" if not path.endswith(".gz") else path[:-3] + ".grid.json", "w") as f:
+                json.dump(grid_definition(grid), f)
+
+    def _write(self, rows, cols, scores, tile_ids, rings):
+        lines = []
+        score_text = scores.astype(str)  # shortest float32 repr, not float64 noise
+        for i in range(len(rows)):
+            props = f'"score":{score_text[i]}'
+            if tile_ids is not None:
+                props = f'"tile_id":{json.dumps(tile_ids[i])},' + props
+            if rings is None:
+                lines.append(f'{{"type":"Feature","geometry":null,"properties":{{{props},'
+                             f'"row":{rows[i]},"col":{cols[i]}}}}}\n')
+            else:
+                ring = ",".join(f"[{x!r},{y!r}]" for x, y in rings[i].tolist())
+                lines.append(f'{{"type":"Feature","geometry":{{"type":"Polygon","coordinates":[[{ring}]]}},'
+                             f'"properties":{{{props}}}}}\n')
+        self.file.write("".join(lines))
+
+    def _close(self):
+        self.file.close()
+
+
+class FlatGeobufWriter(TileWriter):
+    # no spatial index (index_node_size 0), so features stream out in arrival order;
+    # feature count and envelope are patched into the header on close
+    MAGIC = b"fgb\x03fgb\x00"
+
+    def __init__(self, path, grid, precision=6, elide_geometry=False, with_tile_ids=True):
+        super().__init__(path, grid, precision, elide_geometry)
+        self.columns = [("score", FGB_FLOAT)]
+        if with_tile_ids:
+            self.columns.insert(0, ("tile_id", FGB_STRING))
+        if elide_geometry:
+            self.columns += [("row", FGB_INT), ("col", FGB_INT)]
+        self.file = open(path, "wb")
+        self.file.write(self.MAGIC)
+        header = _Builder()
+        header.finish([
+            (0, "string", "scored_tiles"),
+            (1, "vector:d", [0.0, 0.0, 0.0, 0.0], "envelope"),
+            (2, "B", FGB_UNKNOWN if elide_geometry else FGB_POLYGON),
+            (7, "tables", [[(0, "string", name), (1, "B", kind)] for name, kind in self.columns]),
+            (8, "Q", 0, "features_count"),
+            (9, "H", 0),
+            (10, "table", [(0, "string", "EPSG"), (1, "i", 4326)]),
+            (13, "string", json.dumps({GRID_METADATA_KEY: grid_definition(grid)})),
+        ])
+        self.header_marks = {name: 12 + pos for name, pos in header.marks.items()}  # magic + size prefix
+        self.file.write(struct.pack("<I", len(header.buf)) + header.buf)
+        self.column_index = {name: i for i, (name, _) in enumerate(self.columns)}
+
+    def _write(self, rows, cols, scores, tile_ids, rings):
+        chunks = []
+        for i in range(len(rows)):
+            props = []
+            if tile_ids is not None and "tile_id" in self.column_index:
+                encoded = tile_ids[i].encode()
+                props.append(struct.pack("<HI", self.column_index["tile_id"], len(encoded)) + encoded)
+            props.append(struct.pack("<Hf", self.column_index["score"], scores[i]))
+            if rings is None:
+                props.append(struct.pack("<HiHi", self.column_index["row"], rows[i], self.column_index["col"], cols[i]))
+            fields = [(1, "bytes", b"".join(props))]
+            if rings is not None:
+                fields.insert(0, (0, "table", [(1, "vector:d", rings[i].reshape(-1))]))
+            feature = _Builder()
+            feature.finish(fields)
+            chunks.append(struct.pack("<I", len(feature.buf)) + feature.buf)
+        self.file.write(b"".join(chunks))
+
+    def _close(self):
+        if self.file.seekable():
+            self.file.seek(self.header_marks["features_count"])
+            self.file.write(struct.pack("<Q", self.count))
+            if self.count:
+                self.file.seek(self.header_marks["envelope"])
+                self.file.write(struct.pack("<4d", *self.bbox))
+        self.file.close()
+
+
+class GeoParquetWriter(TileWriter):
+    def __init__(self, path, grid, precision=6, elide_geometry=False, compression="zstd"):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        super().__init__(path, grid, precision, elide_geometry)
+        self.pa = pa
+        fields = [pa.field("tile_id", pa.string()), pa.field("score", pa.float32())]
+        metadata = {GRID_METADATA_KEY: json.dumps(grid_definition(grid))}
+        if elide_geometry:
+            fields += [pa.field("row", pa.int32()), pa.field("col", pa.int32())]
+        else:
+            fields.append(pa.field("geometry", pa.binary()))
+            # bbox is optional in the spec and unknown until the last batch, so it's left out
+            metadata["geo"] = json.dumps({"version": GEO_PARQUET_VERSION, "primary_column": "geometry", "columns": {
+                "geometry": {"encoding": "WKB", "geometry_types": ["Polygon"]}}})  # crs omitted = OGC:CRS84
+        self.schema = pa.schema(fields, metadata=metadata)
+        self.writer = pq.ParquetWriter(path, self.schema, compression=compression)
+
+    def _write(self, rows, cols, scores, tile_ids, rings):
+        pa = self.pa
+        n = len(rows)
+        columns = [pa.array(tile_ids if tile_ids is not None else [None] * n, pa.string()), pa.array(scores)]
+        if rings is None:
+            columns += [pa.array(rows), pa.array(cols)]
+        else:
+            # little-endian WKB polygon, one ring of 5 points: 13 byte header + 80 bytes of doubles
+            wkb = np.empty((n, 93), dtype=np.uint8)
+            wkb[:, :13] = np.frombuffer(struct.pack("<BIII", 1, 3, 1, 5), dtype=np.uint8)
+            wkb[:, 13:] = rings.astype("<f8").reshape(n, 10).view(np.uint8)
+            offsets = np.arange(0, 93 * (n + 1), 93, dtype=np.int32)
+            columns.append(pa.Array.from_buffers(pa.binary(), n, [None, pa.py_buffer(offsets),
+                                                                  pa.py_buffer(wkb.tobytes())]))
+        self.writer.write_table(pa.Table.from_arrays(columns, schema=self.schema))
+
+    def _close(self):
+        self.writer.close()
+
+
+WRITERS = {".geojsonl": GeoJSONSeqWriter, ".geojsons": GeoJSONSeqWriter, ".fgb": FlatGeobufWriter,
+           ".parquet": GeoParquetWriter}
+
+
+def open_writer(path, grid, **kwargs):
+    ext = os.path.splitext(path[:-3] if path.endswith(".gz") else path)[1]
+    if ext not in WRITERS:
+        raise ValueError(f"unknown output format {ext}, expected one of {sorted(WRITERS)}")
+    return WRITERS[ext](path, grid, **kwargs)
+
+
+# --------------------------
+# minimal flatbuffers encoder for the FlatGeobuf header and features
+# --------------------------
+FGB_UNKNOWN, FGB_POLYGON = 0, 3
+FGB_INT, FGB_FLOAT, FGB_STRING = 5, 9, 11
+_SIZES = {"B": 1, "?": 1, "H": 2, "i": 4, "I": 4, "Q": 8, "d": 8}
+
+
+class _Builder:
+    # writes front to back: root offset, then each table's vtable, the table, and the objects it
+    # points to, so every uoffset points forward. alignment is relative to the 4 byte size prefix
+    # the buffer is written after, as flatbuffers' own size-prefixed builders lay it out.
+    # fields are (slot, kind, value[, mark]); marked fields record where their bytes landed.
+    def __init__(self):
+        self.buf = bytearray(4)
+        self.marks = {}
+
+    def _align(self, n, extra=0):
+        self.buf.extend(b"\0" * (-(len(self.buf) + 4 + extra) % n))
+
+    def finish(self, fields):
+        struct.pack_into("<I", self.buf, 0, self._table(fields))
+        self._align(8)
+        return self.buf
+
+    def _table(self, fields):
+        inline = sorted(fields, key=lambda f: -_SIZES.get(f[1], 4))
+        offsets, cursor = {}, 4
+        for field in inline:
+            size = _SIZES.get(field[1], 4)
+            cursor += -cursor % size
+            offsets[field[0]] = cursor
+            cursor += size
+        slots = max(offsets) + 1
+        self._align(2)
+        vtable = len(self.buf)
+        self.buf += struct.pack(f"<HH{slots}H", 4 + 2 * slots, cursor, *[offsets.get(s, 0) for s in range(slots)])
+        self._align(8)
+        table = len(self.buf)
+        self.buf += bytes(cursor)
+        struct.pack_into("<i", self.buf, table, table - vtable)
+        children = []
+        for field in fields:
+            slot, kind, value = field[:3]
+            pos = table + offsets[slot]
+            if kind in _SIZES:
+                struct.pack_into("<" + kind, self.buf, pos, value)
+                if len(field) > 3:
+                    self.marks[field[3]] = pos
+            else:
+                children.append((pos, field))
+        for pos, field in children:
+            struct.pack_into("<I", self.buf, pos, self._child(*field) - pos)
+        return table
+
+    def _child(self, slot, kind, value, mark=None):
+        if kind == "table":
+            return self._table(value)
+        if kind == "string":
+            value = value.encode()
+            self._align(4)
+            pos = len(self.buf)
+            self.buf += struct.pack("<I", len(value)) + value + b"\0"
+            return pos
+        if kind == "tables":
+            self._align(4)
+            pos = len(self.buf)
+            self.buf += struct.pack("<I", len(value)) + bytes(4 * len(value))
+            for i, fields in enumerate(value):
+                slot_pos = pos + 4 + 4 * i
+                struct.pack_into("<I", self.buf, slot_pos, self._table(fields) - slot_pos)
+            return pos
+        if kind == "bytes":
+            self._align(4)
+            pos = len(self.buf)
+            self.buf += struct.pack("<I", len(value)) + value
+            return pos
+        fmt = kind.split(":")[1]  # vector:<scalar>
+        self._align(max(_SIZES[fmt], 4), extra=4)
+        pos = len(self.buf)
+        self.buf += struct.pack(f"<I{len(value)}{fmt}", len(value), *value)
+        if mark:
+            self.marks[mark] = pos + 4
+        return pos
+
+
+# --------------------------
+# streaming sources
+# --------------------------
+def batches_from_csv(path, grid, batch_rows=BATCH_ROWS):
+    # predictions csv (tile_id, lon, lat, score) read in chunks
+    for chunk in pd.read_csv(path, usecols=["tile_id", "lon", "lat", "score"], chunksize=batch_rows):
+        chunk = chunk[chunk["score"].notna()]
+        rows, cols, valid = grid.index(chunk["lon"].to_numpy(), chunk["lat"].to_numpy())
+        yield rows[valid], cols[valid], chunk["score"].to_numpy()[valid], chunk["tile_id"].to_numpy()[valid]
+
+
+def batches_from_grid(grid, batch_rows=BATCH_ROWS):
+    # scored cells of a ScoreGrid, a band of grid rows at a time
+    band = max(1, batch_rows // max(grid.width, 1))
+    for start in range(0, grid.height, band):
+        rows, cols = np.nonzero(~np.isnan(grid.scores[start:start + band]))
+        rows += start
+        yield rows, cols, grid.scores[rows, cols], None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="stream scored tiles to GeoJSON-seq, FlatGeobuf or GeoParquet")
+    parser.add_argument("source", help="predictions csv (tile_id, lon, lat, score) or ScoreGrid .npz/.geojson")
+    parser.add_argument("output", help=".geojsonl[.gz], .geojsons[.gz], .fgb or .parquet")
+    parser.add_argument("--precision", type=int, default=6, help="coordinate decimals, -1 keeps full precision")
+    parser.add_argument("--elide-geometry", action="store_true", help="store only the grid cell index")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS)
+    args = parser.parse_args()
+
+    precision = None if args.precision < 0 else args.precision
+    if args.source.endswith(".csv"):
+        grid = ScoreGrid()
+        batches = batches_from_csv(args.source, grid, args.batch_rows)
+    else:
+        grid = ScoreGrid.load(args.source)
+        batches = batches_from_grid(grid, args.batch_rows)
+    with open_writer(args.output, grid, precision=precision, elide_geometry=args.elide_geometry) as writer:
+        for batch in batches:
+            writer.write(*batch)
+    print(f"{writer.count} tiles, {os.path.getsize(args.output) / 1e6:.2f} MB -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+
+EARTH_RADIUS_M = 6371008.8
+COLUMNS = ['latitude', 'longitude', 'status_id', 'water_source_category', 'pressure_score', 'water_point_population']
+
+
+def _to_unit_xyz(lat, lon):
+    # points on the unit sphere; chord distance maps one-to-one onto great-circle distance
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def _chord_to_m(chord):
+    return 2.0 * EARTH_RADIUS_M * np.arcsin(np.clip(chord / 2.0, 0.0, 1.0))
+
+
+def _m_to_chord(meters):
+    return 2.0 * np.sin(np.minimum(meters / EARTH_RADIUS_M, np.pi) / 2.0)
+
+
+class WaterPointIndex:
+    # water points held column-wise (float32 coords, categorical codes) with one
+    # kd-tree over all points and one over functional ('Yes') points only
+    def __init__(self, csv_path):
+        df = pd.read_csv(csv_path, usecols=COLUMNS)
+        df = df.dropna(subset=['latitude', 'longitude']).reset_index(drop=True)
+
+        self.lat = df['latitude'].to_numpy(np.float32)
+        self.lon = df['longitude'].to_numpy(np.float32)
+        self.pressure = df['pressure_score'].to_numpy(np.float32)
+        self.population = df['water_point_population'].to_numpy(np.float32)
+
+        status = pd.Categorical(df['status_id'].fillna('Unknown'))
+        category = pd.Categorical(df['water_source_category'].fillna('unknown'))
+        self.status_codes = status.codes.astype(np.int8)
+        self.status_labels = list(status.categories)
+        self.category_codes = category.codes.astype(np.int8)
+        self.category_labels = list(category.categories)
+
+        xyz = _to_unit_xyz(df['latitude'].to_numpy(), df['longitude'].to_numpy())
+        self.functional_ids = np.flatnonzero(df['status_id'].to_numpy() == 'Yes')
+        self.trees = {
+            False: (cKDTree(xyz), np.arange(len(df))),
+            True: (cKDTree(xyz[self.functional_ids]), self.functional_ids),
+        }
+
+    def __len__(self):
+        return len(self.lat)
+
+    def nearest(self, lat, lon, k=1, functional_only=False, max_distance_m=None):
+        # batched k-nearest; returns (distances_m, ids) shaped (n, k), id -1 where nothing was found
+        tree, ids = self.trees[functional_only]
+        k = min(k, len(ids))
+        upper = np.inf if max_distance_m is None else _m_to_chord(max_distance_m)
+        chord, idx = tree.query(_to_unit_xyz(lat, lon), k=k, distance_upper_bound=upper, workers=-1)
+        chord = chord.reshape(len(chord), -1)
+        idx = idx.reshape(len(idx), -1)
+
+        found = idx < len(ids)
+        point_ids = np.where(found, ids[np.minimum(idx, len(ids) - 1)], -1)
+        distances = np.where(found, _chord_to_m(np.where(found, chord, 0.0)), np.inf)
+        return distances, point_ids
+
+    def within(self, lat, lon, radius_m, functional_only=False):
+        # batched radius query; returns one array of point ids per query point, nearest first
+        tree, ids = self.trees[functional_only]
+        xyz = _to_unit_xyz(lat, lon)
+        hits = tree.query_ball_point(xyz, _m_to_chord(radius_m), workers=-1)
+        out = []
+        for q, hit in zip(xyz, hits):
+            hit = ids[np.asarray(hit, dtype=np.int64)]
+            if len(hit):
+                hit = hit[np.argsort(self.distances_m(q, hit))]
+            out.append(hit)
+        return out
+
+    def count_within(self, lat, lon, radius_m, functional_only=False):
+        tree, _ = self.trees[functional_only]
+        return tree.query_ball_point(_to_unit_xyz(lat, lon), _m_to_chord(radius_m),
+                                     return_length=True, workers=-1)
+
+    def distances_m(self, query_xyz, point_ids):
+        xyz = _to_unit_xyz(self.lat[point_ids], self.lon[point_ids])
+        return _chord_to_m(np.linalg.norm(xyz - query_xyz, axis=-1))
+
+    def describe(self, point_id, distance_m=None):
+        record = {
+            "id": int(point_id),
+            "lat": float(self.lat[point_id]),
+            "lon": float(self.lon[point_id]),
+            "status": self.status_labels[self.status_codes[point_id]],
+            "category": self.category_labels[self.category_codes[point_id]],
+            "pressure_score": float(self.pressure[point_id]),
+            "population": float(self.population[point_id]),
+        }
+        if distance_m is not None:
+            record["distance_m"] = float(distance_m)
+        return record
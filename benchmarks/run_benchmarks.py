@@ -0,0 +1,339 @@
+"""
+offline benchmark suite for the serving, data and feature paths.
+
+runs entirely on the committed sample data with a randomly initialized
+CNNTFMModel, so it needs no trained checkpoint and no network access.
+
+    python benchmarks/run_benchmarks.py --output bench.json
+    python benchmarks/run_benchmarks.py --suites model,dataset --baseline bench.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT, "backend")
+TRAINING_DIR = os.path.join(ROOT, "model", "training")
+EE_DIR = os.path.join(ROOT, "model", "earth_engine")
+PNG_DIR = os.path.join(EE_DIR, "converted_png")
+TIF_DIR = os.path.join(EE_DIR, "exports")
+RAW_CSV = os.path.join(ROOT, "model", "data", "tile_features.csv")
+SCALED_CSV = os.path.join(ROOT, "model", "data", "tile_features_scaled.csv")
+
+sys.path[:0] = [BACKEND_DIR, TRAINING_DIR, EE_DIR]
+
+SUITES = ["predict", "model", "preprocess", "dataset", "convert_png", "score_engine"]
+
+
+# --------------------------
+# helpers
+# --------------------------
+def summarize(latencies_s):
+    ms = np.asarray(latencies_s) * 1000.0
+    return {
+        "n": int(ms.size),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+    }
+
+
+def rate(count, seconds):
+    return float(count / seconds) if seconds > 0 else float("inf")
+
+
+def sample_tiles(n):
+    # raw (unscaled) feature rows for tiles that have a converted png
+    df = pd.read_csv(RAW_CSV)
+    df = df[df["tile_id"].map(lambda t: os.path.exists(os.path.join(PNG_DIR, f"sentinel2_{t}.png")))]
+    return df.head(n).reset_index(drop=True)
+
+
+def load_app(checkpoint_path):
+    # app.py resolves its scaler paths relative to the backend directory
+    os.environ["MODEL_PATH"] = checkpoint_path
+    os.chdir(BACKEND_DIR)
+    import app
+    return app
+
+
+def write_random_checkpoint(path, tabular_dim=6):
+    from fusion import CNNTFMModel
+    torch.manual_seed(0)
+    torch.save(CNNTFMModel(tabular_dim=tabular_dim).state_dict(), path)
+
+
+# --------------------------
+# suites
+# --------------------------
+def bench_predict(args, app_module):
+    from app import TABULAR_FEATURES
+
+    tiles = sample_tiles(args.requests)
+    payloads = []
+    for _, row in tiles.iterrows():
+        with open(os.path.join(PNG_DIR, f"sentinel2_{row['tile_id']}.png"), "rb") as f:
+            image_bytes = f.read()
+        features = json.dumps({feat: float(row[feat]) for feat in TABULAR_FEATURES})
+        payloads.append((image_bytes, features))
+
+    def post(client, payload):
+        image_bytes, features = payload
+        return client.post("/predict/", data={
+            "image": (io.BytesIO(image_bytes), "tile.png"),
+            "features": features,
+        }, content_type="multipart/form-data")
+
+    # warm up
+    client = app_module.app.test_client()
+    for payload in payloads[:3]:
+        post(client, payload)
+
+    results = {}
+    for concurrency in args.concurrency:
+        latencies = []
+        lock = threading.Lock()
+        errors = [0]
+
+        def worker(worker_id):
+            client = app_module.app.test_client()
+            local = []
+            for i in range(worker_id, len(payloads), concurrency):
+                t0 = time.perf_counter()
+                response = post(client, payloads[i])
+                local.append(time.perf_counter() - t0)
+                if response.status_code != 200:
+                    with lock:
+                        errors[0] += 1
+            with lock:
+                latencies.extend(local)
+
+        threads = [threading.Thread(target=worker, args=(w,)) for w in range(concurrency)]
+        t0 = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - t0
+
+        stats = summarize(latencies)
+        stats["requests_per_s"] = rate(len(latencies), wall)
+        stats["errors"] = errors[0]
+        results[f"concurrency_{concurrency}"] = stats
+    return results
+
+
+def bench_model(args, app_module=None):
+    from fusion import CNNTFMModel
+
+    model = CNNTFMModel(tabular_dim=6).eval()
+    default_threads = torch.get_num_threads()
+    results = {}
+    for threads in args.threads:
+        torch.set_num_threads(threads)
+        for batch_size in args.batch_sizes:
+            images = torch.randn(batch_size, 3, args.image_size, args.image_size)
+            tabular = torch.randn(batch_size, 6)
+            with torch.inference_mode():
+                model(images, tabular)
+                times = []
+                for _ in range(args.repeats):
+                    t0 = time.perf_counter()
+                    model(images, tabular)
+                    times.append(time.perf_counter() - t0)
+            stats = summarize(times)
+            stats["samples_per_s"] = rate(batch_size * len(times), sum(times))
+            results[f"threads_{threads}/batch_{batch_size}"] = stats
+    torch.set_num_threads(default_threads)
+    return results
+
+
+def bench_preprocess(args, app_module=None):
+    # torchvision Resize/ToTensor/Normalize vs the fused Preprocessor, plus their max abs difference
+    from PIL import Image
+    from dataset import make_transform
+    from preprocess import Preprocessor
+
+    paths = [os.path.join(PNG_DIR, f) for f in sorted(os.listdir(PNG_DIR))[:args.samples]]
+    reference = make_transform(args.image_size)
+    fast = Preprocessor(image_size=args.image_size)
+
+    t0 = time.perf_counter()
+    expected = torch.stack([reference(Image.open(p).convert("RGB")) for p in paths])
+    reference_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    actual = fast.batch([fast.decode(p)[0] for p in paths])
+    fast_s = time.perf_counter() - t0
+
+    return {
+        "images": len(paths),
+        "torchvision": {"images_per_s": rate(len(paths), reference_s)},
+        "preprocessor": {"images_per_s": rate(len(paths), fast_s)},
+        "max_abs_diff": float((expected - actual).abs().max()),
+    }
+
+
+def bench_dataset(args, app_module=None):
+    from torch.utils.data import DataLoader, Subset
+    from dataset import WaterAccessDataset, make_transform
+
+    dataset = WaterAccessDataset(SCALED_CSV, PNG_DIR, transform=make_transform(args.image_size))
+    subset = Subset(dataset, range(min(args.samples, len(dataset))))
+
+    results = {}
+    for workers in args.loader_workers:
+        loader = DataLoader(subset, batch_size=32, shuffle=False, num_workers=workers)
+        t0 = time.perf_counter()
+        seen = sum(labels.shape[0] for _, labels in loader)
+        results[f"workers_{workers}"] = {"samples": seen, "samples_per_s": rate(seen, time.perf_counter() - t0)}
+    return results
+
+
+def bench_convert_png(args, app_module=None):
+    from convert_png import convert_tif
+
+    names = sorted(f for f in os.listdir(TIF_DIR) if f.endswith(".tif"))[:args.samples]
+    with tempfile.TemporaryDirectory() as out_dir:
+        t0 = time.perf_counter()
+        for name in names:
+            convert_tif(os.path.join(TIF_DIR, name), os.path.join(out_dir, name.replace(".tif", ".png")))
+        wall = time.perf_counter() - t0
+    return {"files": len(names), "files_per_s": rate(len(names), wall)}
+
+
+def bench_score_engine(args, app_module):
+    # batched end-to-end tile scoring: png decode + transform + model (scalers folded in)
+    from app import TABULAR_FEATURES
+    from score_grid import ScoreGrid
+
+    tiles = sample_tiles(args.samples)
+    version = app_module.models.get()
+    model, preprocessor = version.model, version.preprocessor
+    results = {}
+    for batch_size in args.batch_sizes:
+        t0 = time.perf_counter()
+        scores = []
+        with torch.inference_mode():
+            for start in range(0, len(tiles), batch_size):
+                chunk = tiles.iloc[start:start + batch_size]
+                images = preprocessor.batch([
+                    preprocessor.decode(os.path.join(PNG_DIR, f"sentinel2_{t}.png"))[0]
+                    for t in chunk["tile_id"]
+                ])
+                tabular = torch.from_numpy(chunk[TABULAR_FEATURES].to_numpy(np.float32))
+                scores.append(model(images, tabular).reshape(-1).numpy())
+        wall = time.perf_counter() - t0
+        results[f"batch_{batch_size}"] = {"tiles": len(tiles), "tiles_per_s": rate(len(tiles), wall)}
+
+    # raster lookups over the scored output
+    grid = ScoreGrid()
+    rng = np.random.default_rng(0)
+    lon = rng.uniform(grid.west, grid.east, 100000)
+    lat = rng.uniform(grid.south, grid.north, 100000)
+    grid.set_scores(lon, lat, rng.normal(size=lon.size))
+    t0 = time.perf_counter()
+    grid.lookup(lon, lat)
+    results["grid_lookup"] = {"points": int(lon.size), "points_per_s": rate(lon.size, time.perf_counter() - t0)}
+    return results
+
+
+# --------------------------
+# runner
+# --------------------------
+def environment():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+    }
+
+
+def compare(results, baseline):
+    # prints every shared throughput / latency metric as a ratio against the baseline run
+    for suite, cases in results.items():
+        for case, stats in cases.items():
+            old = baseline.get("results", {}).get(suite, {}).get(case)
+            if not isinstance(stats, dict) or not isinstance(old, dict):
+                continue
+            for key, value in stats.items():
+                if key in old and old[key] and (key.endswith("_per_s") or key.startswith("p")):
+                    print(f"{suite}/{case}/{key}: {old[key]:.2f} -> {value:.2f} ({value / old[key]:.2f}x)")
+
+
+def parse_ints(text):
+    return [int(v) for v in text.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="offline benchmarks for can-ai")
+    parser.add_argument("--suites", default=",".join(SUITES))
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", "results.json"))
+    parser.add_argument("--baseline", help="previous results json to compare against")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--samples", type=int, default=256)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--image-size", type=int, default=224)
+    parser.add_argument("--concurrency", type=parse_ints, default=[1, 4, 8])
+    parser.add_argument("--batch-sizes", type=parse_ints, default=[1, 8, 32, 64])
+    parser.add_argument("--threads", type=parse_ints, default=sorted({1, os.cpu_count() or 1}))
+    parser.add_argument("--loader-workers", type=parse_ints, default=[0, 2])
+    args = parser.parse_args()
+
+    suites = [s for s in args.suites.split(",") if s]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+    # load_app changes the working directory, so resolve the output path and read the
+    # baseline (failing before the suites run if it is missing) up front
+    output = os.path.abspath(args.output)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app_module = None
+        if {"predict", "score_engine"} & set(suites):
+            checkpoint = os.path.join(tmp, "random_model.pth")
+            write_random_checkpoint(checkpoint)
+            app_module = load_app(checkpoint)
+
+        results = {}
+        for suite in suites:
+            print(f"--- running {suite} ---")
+            t0 = time.perf_counter()
+            results[suite] = globals()[f"bench_{suite}"](args, app_module)
+            print(f"{suite} done in {time.perf_counter() - t0:.1f}s")
+
+    report = {"environment": environment(), "config": vars(args), "results": results}
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {output}")
+
+    if baseline is not None:
+        compare(results, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+out-of-core replacement for the StandardScaler step in clean_tile_feature_data.py.
+
+fits per-column mean/variance chunk by chunk (chan/welford merge), so memory is
+bounded by the chunk size, and writes only the fitted parameters. normalization is
+applied lazily by the data loader instead of writing a scaled copy of the table.
+
+    python streaming_scaler.py tile_features.csv --output scaler_params.json
+    python streaming_scaler.py tile_features.csv --pkl-dir ../../backend/scalers   # also emit sklearn pickles
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# --- same columns clean_tile_feature_data.py drops ---
+DROP_COLUMNS = [
+    'system:index',
+    'category_bonus',
+    'distance_weighted_score',
+    'norm_distance_weighted',
+    'num_sources',
+    'pressure_score',
+    'random',
+    'water_point_population',
+    'water_source_category',
+    '.geo'
+]
+ID_COLUMN = 'tile_id'
+LABEL_COLUMN = 'score'
+
+
+class RunningStats:
+    # nan-aware running mean / sum of squared deviations, merged one chunk at a time
+    def __init__(self, width):
+        self.count = np.zeros(width, dtype=np.int64)
+        self.mean = np.zeros(width, dtype=np.float64)
+        self.m2 = np.zeros(width, dtype=np.float64)
+
+    def update(self, chunk):
+        chunk = np.asarray(chunk, dtype=np.float64)
+        valid = np.isfinite(chunk)
+        n_b = valid.sum(axis=0)
+        safe = np.where(valid, chunk, 0.0)
+        mean_b = np.divide(safe.sum(axis=0), n_b, out=np.zeros_like(self.mean), where=n_b > 0)
+        m2_b = (np.where(valid, chunk - mean_b, 0.0) ** 2).sum(axis=0)
+
+        n = self.count + n_b
+        delta = mean_b - self.mean
+        weight = np.divide(n_b, n, out=np.zeros_like(self.mean), where=n > 0)
+        self.m2 += m2_b + delta ** 2 * self.count * weight
+        self.mean += delta * weight
+        self.count = n
+
+    @property
+    def var(self):
+        # population variance, as StandardScaler uses
+        return np.divide(self.m2, self.count, out=np.zeros_like(self.m2), where=self.count > 0)
+
+    @property
+    def scale(self):
+        scale = np.sqrt(self.var)
+        return np.where(scale == 0.0, 1.0, scale)  # constant columns pass through, like sklearn
+
+
+class Normalizer:
+    # fitted parameters for one block of columns; applied on the fly by the data loader
+    def __init__(self, columns, mean, scale, count=None):
+        self.columns = list(columns)
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.count = None if count is None else np.asarray(count, dtype=np.int64)
+
+    def transform(self, values):
+        return ((np.asarray(values, dtype=np.float64) - self.mean) / self.scale).astype(np.float32)
+
+    def inverse_transform(self, values):
+        return (np.asarray(values, dtype=np.float64) * self.scale + self.mean).astype(np.float32)
+
+    def to_dict(self):
+        return {
+            "columns": self.columns,
+            "mean": self.mean.tolist(),
+            "scale": self.scale.tolist(),
+            "count": None if self.count is None else self.count.tolist(),
+        }
+
+    def to_sklearn(self):
+        # an equivalent fitted StandardScaler, for tools that still expect the .pkl files
+        from sklearn.preprocessing import StandardScaler
+
+        scaler = StandardScaler()
+        scaler.mean_ = self.mean.copy()
+        scaler.scale_ = self.scale.copy()
+        scaler.var_ = scaler.scale_ ** 2
+        scaler.n_features_in_ = len(self.columns)
+        scaler.n_samples_seen_ = self.count if self.count is not None else 0
+        if self.columns != [LABEL_COLUMN]:
+            scaler.feature_names_in_ = np.asarray(self.columns, dtype=object)
+        return scaler
+
+
+def feature_columns(csv_path):
+    header = pd.read_csv(csv_path, nrows=0).columns
+    return [c for c in header if c not in DROP_COLUMNS and c not in (ID_COLUMN, LABEL_COLUMN)]
+
+
+def fit(csv_path, chunksize=100_000):
+    # returns (feature normalizer, score normalizer, rows seen)
+    columns = feature_columns(csv_path)
+    features = RunningStats(len(columns))
+    score = RunningStats(1)
+
+    rows = 0
+    for chunk in pd.read_csv(csv_path, usecols=columns + [LABEL_COLUMN], chunksize=chunksize):
+        features.update(chunk[columns].to_numpy())
+        score.update(chunk[[LABEL_COLUMN]].to_numpy())
+        rows += len(chunk)
+
+    return (Normalizer(columns, features.mean, features.scale, features.count),
+            Normalizer([LABEL_COLUMN], score.mean, score.scale, score.count),
+            rows)
+
+
+def save(path, feature_norm, score_norm, rows):
+    with open(path, "w") as f:
+        json.dump({"rows": rows, "features": feature_norm.to_dict(), "score": score_norm.to_dict()}, f, indent=2)
+
+
+def load(path):
+    with open(path) as f:
+        params = json.load(f)
+    return Normalizer(**params["features"]), Normalizer(**params["score"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fit feature/score scalers in bounded memory")
+    parser.add_argument("csv", nargs="?", default="tile_features.csv")
+    parser.add_argument("--output", default="scaler_params.json")
+    parser.add_argument("--chunksize", type=int, default=100_000)
+    parser.add_argument("--pkl-dir", help="also write feature_scaler.pkl / score_scaler.pkl here")
+    args = parser.parse_args()
+
+    feature_norm, score_norm, rows = fit(args.csv, args.chunksize)
+    save(args.output, feature_norm, score_norm, rows)
+    print(f"fitted {len(feature_norm.columns)} features over {rows} rows -> {args.output}")
+
+    if args.pkl_dir:
+        import joblib
+
+        os.makedirs(args.pkl_dir, exist_ok=True)
+        joblib.dump(feature_norm.to_sklearn(), os.path.join(args.pkl_dir, 'feature_scaler.pkl'))
+        joblib.dump(score_norm.to_sklearn(), os.path.join(args.pkl_dir, 'score_scaler.pkl'))
+        print("scalers saved!")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,15 +7,27 @@ import numpy as np
 src_dir = "./exports_test"
 dst_dir = "./converted_test"
 
-os.makedirs(dst_dir, exist_ok=True)
 
 # --- convert tif to png ---
-for fname in os.listdir(src_dir):
-    if fname.endswith(".tif"):
-        with rasterio.open(os.path.join(src_dir, fname)) as src:
-            arr = src.read([1, 2, 3])
-            arr = np.transpose(arr, (1, 2, 0))
-            arr = (arr / 3000.0).clip(0, 1) * 255
-            arr = arr.astype(np.uint8)
+def convert_tif(src_path, dst_path):
+    with rasterio.open(src_path) as src:
+        arr = src.read([1, 2, 3])
+        arr = np.transpose(arr, (1, 2, 0))
+        arr = (arr / 3000.0).clip(0, 1) * 255
+        arr = arr.astype(np.uint8)
+        Image.fromarray(arr).save(dst_path)
+
+
+def convert_dir(src_dir, dst_dir):
+    os.makedirs(dst_dir, exist_ok=True)
+    converted = 0
+    for fname in os.listdir(src_dir):
+        if fname.endswith(".tif"):
             out_name = fname.replace(".tif", ".png")
-            Image.fromarray(arr).save(os.path.join(dst_dir, out_name))
+            convert_tif(os.path.join(src_dir, fname), os.path.join(dst_dir, out_name))
+            converted += 1
+    return converted
+
+
+if __name__ == "__main__":
+    convert_dir(src_dir, dst_dir)
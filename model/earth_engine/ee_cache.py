@@ -0,0 +1,278 @@
+"""
+local memoization for earth engine computations, so iterating on one feature doesn't
+recompute (and bill) every other one.
+
+    from ee_cache import EECache
+    cache = EECache()                         # ./.ee_cache, 2 GB, EE_CACHE_MODE or "cache"
+    cache.initialize(project="gen-lang-client-0972336843")
+    elev = cache.reduce_regions(elevation, tiles, ee.Reducer.mean(), scale=30)   # list of feature dicts
+    tif = cache.pixels(composite, tile_geom, scale=10)                           # GeoTIFF bytes
+    n = cache.info(tiles.size())                                                 # any getInfo()
+    rows = cache.features(tiles.map(add_attrs))                                  # paged table
+
+    python ee_cache.py stats
+    python ee_cache.py evict --max-gb 1
+    python ee_cache.py clear
+
+results are keyed by the sha256 of the canonical serialized expression (ee.serializer,
+json with sorted keys) plus the region and request parameters, so the same composite,
+slope or water-distance reduction is only computed once, and changing the ndvi expression
+leaves the cached elevation, slope and land cover reductions valid. tables are stored as
+json, rasters as the bytes (GeoTIFF) or .npy (NUMPY_NDARRAY) computePixels returned, and
+an sqlite index tracks size and last access; least recently used entries are evicted once
+the cache is over max_bytes.
+
+modes (mode=... or EE_CACHE_MODE):
+  cache   serve hits locally, compute and store misses (default)
+  record  always compute and store, pinned so eviction never drops them (test fixtures)
+  replay  never contact earth engine; a miss raises CacheMiss. initialize() restores the
+          algorithm table saved while recording, so expressions still build and hash offline
+  off     pass straight through
+export tasks (ee.batch.Export.*) are asynchronous drive jobs and are not cached; the
+cache covers the synchronous getInfo / computePixels calls.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import ee
+import numpy as np
+
+CACHE_DIR = os.environ.get("EE_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".ee_cache"))
+MAX_BYTES = int(float(os.environ.get("EE_CACHE_MAX_GB", "2")) * 1e9)
+MODES = ("cache", "record", "replay", "off")
+ALGORITHMS_KEY = "algorithms"
+PAGE_SIZE = 1000  # features per reduce_regions page, under the 5000 element getInfo limit
+MISSING = object()
+
+
+class CacheMiss(KeyError):
+    pass
+
+
+# --------------------------
+# canonical keys
+# --------------------------
+def serialize(obj):
+    # ee objects through the cloud api serializer, plain values as they are
+    if isinstance(obj, ee.ComputedObject):
+        return ee.serializer.encode(obj, for_cloud_api=True)
+    return obj
+
+
+def expression_key(kind, expression, region=None, **params):
+    payload = {"kind": kind, "expression": serialize(expression), "region": serialize(region),
+               "params": {k: serialize(v) for k, v in params.items()}}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+# --------------------------
+# on-disk store
+# --------------------------
+class EECache:
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES, mode=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.mode = mode or os.environ.get("EE_CACHE_MODE", "cache")
+        if self.mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}, got {self.mode}")
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(cache_dir, "objects"), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(cache_dir, "index.db"), check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, kind TEXT, file TEXT, bytes INTEGER, created REAL, accessed REAL,
+                pinned INTEGER, label TEXT);
+        """)
+
+    def _path(self, key, ext):
+        return os.path.join(self.cache_dir, "objects", key[:2], key + ext)
+
+    def get(self, key, default=None):
+        with self._lock:
+            row = self.db.execute("SELECT file FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or not os.path.exists(os.path.join(self.cache_dir, row[0])):
+                return default
+            self.db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+            self.db.commit()
+        path = os.path.join(self.cache_dir, row[0])
+        if path.endswith(".json"):
+            with open(path) as f:
+                return json.load(f)
+        if path.endswith(".npy"):
+            return np.load(path)
+        with open(path, "rb") as f:
+            return f.read()
+
+    def put(self, key, kind, value, label=""):
+        # json-able values, numpy arrays or raw bytes; written to a temp file and renamed
+        ext = ".npy" if isinstance(value, np.ndarray) else ".bin" if isinstance(value, bytes) else ".json"
+        path = self._path(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            if ext == ".npy":
+                np.save(f, value)
+            elif ext == ".bin":
+                f.write(value)
+            else:
+                f.write(json.dumps(value).encode())
+        os.replace(tmp, path)
+        now = time.time()
+        with self._lock:
+            self.db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (key, kind, os.path.relpath(path, self.cache_dir), os.path.getsize(path), now, now,
+                             int(self.mode == "record"), label))
+            self.db.commit()
+        self.evict()
+
+    def evict(self, max_bytes=None):
+        # least recently used first; pinned (recorded) entries are never dropped
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        removed = 0
+        with self._lock:
+            total = self.db.execute("SELECT COALESCE(SUM(bytes), 0) FROM entries").fetchone()[0]
+            if total <= max_bytes:
+                return 0
+            for key, file, size in self.db.execute(
+                    "SELECT key, file, bytes FROM entries WHERE pinned = 0 ORDER BY accessed").fetchall():
+                if total <= max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.cache_dir, file))
+                except FileNotFoundError:
+                    pass
+                self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                total -= size
+                removed += 1
+            self.db.commit()
+        return removed
+
+    def clear(self, include_pinned=False):
+        with self._lock:
+            query = "SELECT key, file FROM entries" + ("" if include_pinned else " WHERE pinned = 0")
+            rows = self.db.execute(query).fetchall()
+            for key, file in rows:
+                try:
+                    os.remove(os.path.join(self.cache_dir, file))
+                except FileNotFoundError:
+                    pass
+                self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.db.commit()
+        return len(rows)
+
+    def stats(self):
+        with self._lock:
+            rows = self.db.execute("SELECT kind, COUNT(*), COALESCE(SUM(bytes), 0), COALESCE(SUM(pinned), 0) "
+                                   "FROM entries GROUP BY kind").fetchall()
+        return {
+            "mode": self.mode,
+            "cache_dir": self.cache_dir,
+            "max_bytes": self.max_bytes,
+            "bytes": sum(r[2] for r in rows),
+            "entries": {kind: {"count": n, "bytes": size, "pinned": pinned} for kind, n, size, pinned in rows},
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    # --------------------------
+    # memoized earth engine calls
+    # --------------------------
+    def memoize(self, kind, key, compute, label=""):
+        if self.mode == "off":
+            return compute()
+        if self.mode != "record":
+            value = self.get(key, MISSING)
+            if value is not MISSING:
+                self.hits += 1
+                return value
+            if self.mode == "replay":
+                raise CacheMiss(f"{kind} {label or key[:12]} was not recorded")
+        self.misses += 1
+        value = compute()
+        self.put(key, kind, value, label)
+        return value
+
+    def initialize(self, project=None, **kwargs):
+        # replay initializes from the recorded algorithm table instead of the server
+        if self.mode == "replay":
+            algorithms = self.get(ALGORITHMS_KEY)
+            if algorithms is None:
+                raise CacheMiss("no recorded algorithm table, record once with mode='record'")
+            ee.data.getAlgorithms = lambda: algorithms
+            ee.Initialize(credentials=None, project=project, **kwargs)
+            return
+        ee.Initialize(project=project, **kwargs)
+        if self.mode != "off":
+            self.put(ALGORITHMS_KEY, "algorithms", ee.data.getAlgorithms(), "api algorithms")
+
+    def info(self, obj, label=""):
+        # any getInfo(): numbers, dictionaries, small feature collections
+        key = expression_key("info", obj)
+        return self.memoize("info", key, obj.getInfo, label)
+
+    def features(self, collection, page_size=PAGE_SIZE, label=""):
+        # a computed feature collection as feature dicts, fetched and cached page by page
+        count = self.info(collection.size(), f"{label} size")
+        features = []
+        for offset in range(0, count, page_size):
+            page = ee.FeatureCollection(collection.toList(page_size, offset))
+            features.extend(self.info(page, f"{label} [{offset}:]")["features"])
+        return features
+
+    def reduce_region(self, image, reducer, geometry, scale, label="", **kwargs):
+        key = expression_key("reduce_region", image, geometry, reducer=reducer, scale=scale, **kwargs)
+        return self.memoize("reduce_region", key, lambda: image.reduceRegion(
+            reducer=reducer, geometry=geometry, scale=scale, **kwargs).getInfo(), label)
+
+    def reduce_regions(self, image, collection, reducer, scale, page_size=PAGE_SIZE, label=""):
+        # per-tile reductions as a list of feature dicts, fetched and cached page by page so
+        # a failed run resumes where it stopped and big collections stay under the getInfo limit
+        count = self.info(collection.size(), f"{label} size")
+        features = []
+        for offset in range(0, count, page_size):
+            page = ee.FeatureCollection(collection.toList(page_size, offset))
+            key = expression_key("reduce_regions", image, page, reducer=reducer, scale=scale)
+            result = self.memoize("reduce_regions", key, lambda: image.reduceRegions(
+                collection=page, reducer=reducer, scale=scale).getInfo(), f"{label} [{offset}:]")
+            features.extend(result["features"])
+        return features
+
+    def pixels(self, image, region, scale, file_format="GEO_TIFF", bands=None, label=""):
+        # raster over region as computePixels returns it: GeoTIFF bytes or a numpy structured array
+        if bands:
+            image = image.select(bands)
+        key = expression_key("pixels", image, region, scale=scale, file_format=file_format)
+        clipped = image.clipToBoundsAndScale(geometry=region, scale=scale)
+        return self.memoize("pixels", key, lambda: ee.data.computePixels(
+            {"expression": clipped, "fileFormat": file_format}), label)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="inspect or trim the local earth engine result cache")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats")
+    evict = sub.add_parser("evict")
+    evict.add_argument("--max-gb", type=float, required=True)
+    clear = sub.add_parser("clear")
+    clear.add_argument("--pinned", action="store_true", help="also drop recorded fixtures")
+    args = parser.parse_args()
+
+    cache = EECache(args.cache_dir)
+    if args.command == "stats":
+        print(json.dumps(cache.stats(), indent=2))
+    elif args.command == "evict":
+        print(f"evicted {cache.evict(int(args.max_gb * 1e9))} entries")
+    else:
+        print(f"removed {cache.clear(include_pinned=args.pinned)} entries")
+
+
+if __name__ == "__main__":
+    main()
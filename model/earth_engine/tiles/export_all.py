@@ -1,6 +1,36 @@
+"""
+tile features and sentinel-2 tiles for the roi.
+
+    python export_all.py              # fetch through the local ee cache into ../exports and model/data
+    python export_all.py --drive      # the original drive export tasks
+    EE_CACHE_MODE=replay python export_all.py   # offline, served entirely from the cache
+
+the local path sends every per-tile reduction and pixel fetch through ee_cache, so a
+re-run (or a change to one feature layer) only recomputes what actually changed.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+
 import ee
 
-ee.Initialize(project='gen-lang-client-0972336843')
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+from ee_cache import EECache
+
+EXPORT_DIR = os.path.join(os.path.dirname(HERE), "exports")
+FEATURE_CSV = os.path.join(os.path.dirname(os.path.dirname(HERE)), "data", "tile_features.csv")
+
+parser = argparse.ArgumentParser(description="export tile features and sentinel-2 tiles")
+parser.add_argument("--drive", action="store_true", help="start drive export tasks instead of fetching locally")
+parser.add_argument("--export-dir", default=EXPORT_DIR)
+parser.add_argument("--features-csv", default=FEATURE_CSV)
+args = parser.parse_args()
+
+cache = EECache()
+cache.initialize(project='gen-lang-client-0972336843')
 
 # --- parameters ---
 ROI_BOUNDS = [31.9, 0.2, 34.5, 2.5]  # parts of kenya & uganda
@@ -124,52 +154,6 @@ def add_attrs(tile):
         .add(category_bonus)
     )
 
-    # 7) elevation & slope 
-    elev = elevation.reduceRegion(
-        reducer=ee.Reducer.mean(),
-        geometry=tile_geom,
-        scale=30
-    ).get('elevation')
-
-    slp = slope.reduceRegion(
-        reducer=ee.Reducer.mean(),
-        geometry=tile_geom,
-        scale=30
-    ).get('slope')
-
-    # 8) land cover
-    lc = landcover.reduceRegion(
-        reducer=ee.Reducer.mode(),
-        geometry=tile_geom,
-        scale=10,
-        maxPixels=1e8
-    ).get('Map')
-
-    # 9) ndvi (vegetation health)
-    mean_ndvi = ndvi.reduceRegion(
-        reducer=ee.Reducer.mean(),
-        geometry=tile_geom,
-        scale=10,
-        maxPixels=1e8
-    ).get('NDVI')
-
-    # 10) nighttime lights
-    night = viirs.reduceRegion(
-        reducer=ee.Reducer.mean(),
-        geometry=tile_geom,
-        scale=500,
-        maxPixels=1e8
-    ).get('avg_rad')
-
-    # 11) waterbody distance
-    raw_dist = water_distance.reduceRegion(
-        reducer=ee.Reducer.mean(),
-        geometry=tile_geom,
-        scale=30,
-        maxPixels=1e8
-    ).get('distance_to_water')
-    capped_dist = ee.Number(raw_dist).min(2000)
-
     return tile.set({
         'score': var_score,
         'pressure_score': pressure,
@@ -178,42 +162,102 @@ def add_attrs(tile):
         'distance_weighted_score': sum_w,
         'norm_distance_weighted': weighted_score,
         'water_source_category': category,
-        'category_bonus': category_bonus,
-        'elevation': elev,
-        'slope': slp,
-        'land_cover_class': lc,
-        'mean_ndvi': mean_ndvi,
-        'nighttime_light': night,
-        'mean_distance_to_water': capped_dist
+        'category_bonus': category_bonus
     })
 
-feature_collection = sampled_fc.map(add_attrs)
+# --- raster features per tile (7-11): (property, image, band, reducer, scale) ---
+# each layer is its own expression, so the cache keeps the others valid while one changes
+RASTER_FEATURES = [
+    ('elevation', elevation, 'elevation', ee.Reducer.mean(), 30),
+    ('slope', slope, 'slope', ee.Reducer.mean(), 30),
+    ('land_cover_class', landcover, 'Map', ee.Reducer.mode(), 10),
+    ('mean_ndvi', ndvi, 'NDVI', ee.Reducer.mean(), 10),
+    ('nighttime_light', viirs, 'avg_rad', ee.Reducer.mean(), 500),
+    ('mean_distance_to_water', water_distance, 'distance_to_water', ee.Reducer.mean(), 30),
+]
+MAX_WATER_DISTANCE = 2000
 
-# --- export CSV ---
-feature_task = ee.batch.Export.table.toDrive(
-    collection=feature_collection,
-    description='tile_feature_export',
-    fileFormat='CSV',
-    folder='EarthEngineExports'
-)
-feature_task.start()
-print("feature csv export task started.")
+def add_raster_attrs(tile):
+    values = {}
+    for name, image, band, reducer, scale in RASTER_FEATURES:
+        values[name] = image.reduceRegion(
+            reducer=reducer, geometry=tile.geometry(), scale=scale, maxPixels=1e8
+        ).get(band)
+    values['mean_distance_to_water'] = ee.Number(values['mean_distance_to_water']).min(MAX_WATER_DISTANCE)
+    return tile.set(values)
 
-# --- export image tiles ---
-sampled_list = sampled_fc.toList(NUM_TILES)
-for i in range(NUM_TILES):
-    tile = ee.Feature(sampled_list.get(i))
-    tile_geom = tile.geometry()
-    export_task = ee.batch.Export.image.toDrive(
-        image=composite.clip(tile_geom),
-        description=f"sentinel2_tile_{i}",
-        folder="EarthEngineExports",
-        region=tile_geom,
-        scale=10,
-        maxPixels=1e8
+
+# --- local export through the cache ---
+def export_local():
+    # water point attributes as one paged table, raster layers as one reduce_regions each
+    tiles = {f['properties']['tile_id']: f for f in cache.features(sampled_fc.map(add_attrs), label='water attrs')}
+    for name, image, _, reducer, scale in RASTER_FEATURES:
+        for f in cache.reduce_regions(image, sampled_fc, reducer.setOutputs([name]), scale, label=name):
+            value = f['properties'].get(name)
+            if name == 'mean_distance_to_water' and value is not None:
+                value = min(value, MAX_WATER_DISTANCE)
+            tiles[f['properties']['tile_id']]['properties'][name] = value
+
+    columns = ['system:index', 'category_bonus', 'distance_weighted_score', 'elevation', 'land_cover_class',
+               'mean_distance_to_water', 'mean_ndvi', 'nighttime_light', 'norm_distance_weighted', 'num_sources',
+               'pressure_score', 'random', 'score', 'slope', 'tile_id', 'water_point_population',
+               'water_source_category', '.geo']
+    os.makedirs(os.path.dirname(args.features_csv), exist_ok=True)
+    with open(args.features_csv, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for tile in tiles.values():
+            props = dict(tile['properties'], **{'system:index': tile.get('id', ''),
+                                                '.geo': json.dumps(tile['geometry'], separators=(',', ':'))})
+            writer.writerow(['' if props.get(c) is None else props[c] for c in columns])
+    print(f"wrote {len(tiles)} tile features -> {args.features_csv}")
+
+    os.makedirs(args.export_dir, exist_ok=True)
+    for i, tile in enumerate(tiles.values()):
+        tif = cache.pixels(composite, ee.Geometry(tile['geometry']), scale=10, label=tile['properties']['tile_id'])
+        with open(os.path.join(args.export_dir, f"sentinel2_{tile['properties']['tile_id']}.tif"), 'wb') as f:
+            f.write(tif)
+        if (i + 1) % 100 == 0 or i == len(tiles) - 1:
+            print(f"fetched {i + 1} / {len(tiles)} tiles")
+    stats = cache.stats()
+    print(f"ee cache: {stats['hits']} hits, {stats['misses']} misses ({stats['mode']})")
+
+
+# --- drive export tasks ---
+def export_drive():
+    feature_collection = sampled_fc.map(add_attrs).map(add_raster_attrs)
+
+    # --- export CSV ---
+    feature_task = ee.batch.Export.table.toDrive(
+        collection=feature_collection,
+        description='tile_feature_export',
+        fileFormat='CSV',
+        folder='EarthEngineExports'
     )
-    export_task.start()
-    if (i + 1) % 100 == 0 or i == NUM_TILES - 1:
-        print(f"started export task {i + 1} / {NUM_TILES}")
+    feature_task.start()
+    print("feature csv export task started.")
+
+    # --- export image tiles ---
+    sampled_list = sampled_fc.toList(NUM_TILES)
+    for i in range(NUM_TILES):
+        tile = ee.Feature(sampled_list.get(i))
+        tile_geom = tile.geometry()
+        export_task = ee.batch.Export.image.toDrive(
+            image=composite.clip(tile_geom),
+            description=f"sentinel2_tile_{i}",
+            folder="EarthEngineExports",
+            region=tile_geom,
+            scale=10,
+            maxPixels=1e8
+        )
+        export_task.start()
+        if (i + 1) % 100 == 0 or i == NUM_TILES - 1:
+            print(f"started export task {i + 1} / {NUM_TILES}")
+
+    print(f"started export tasks for {NUM_TILES} image tiles.")
+
 
-print(f"started export tasks for {NUM_TILES} image tiles.")
\ No newline at end of file
+if args.drive:
+    export_drive()
+else:
+    export_local()
@@ -0,0 +1,77 @@
+"""
+compares the 224 px (upsampled) model against the native 112 px model:
+validation accuracy on the shared split and cpu inference throughput.
+
+    python model/training/compare_resolution.py --checkpoint 224=best_model.pth --checkpoint 112=best_model_112.pth
+    python model/training/compare_resolution.py --train-epochs 10   # trains both first
+"""
+import argparse
+import json
+import time
+
+import torch
+
+from train import CNNTFMModel, evaluate, make_loaders, train, write_metadata
+
+
+def throughput(model, image_size, batch_size=32, repeats=10, tabular_dim=6):
+    images = torch.randn(batch_size, 3, image_size, image_size)
+    tabular = torch.randn(batch_size, tabular_dim)
+    model.eval()
+    with torch.inference_mode():
+        model(images, tabular)  # warm up
+        t0 = time.perf_counter()
+        for _ in range(repeats):
+            model(images, tabular)
+        elapsed = time.perf_counter() - t0
+    return {"tiles_per_s": batch_size * repeats / elapsed, "ms_per_batch": elapsed / repeats * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="224 px vs native 112 px accuracy and speed")
+    parser.add_argument("--checkpoint", action="append", default=[], help="SIZE=PATH, repeatable")
+    parser.add_argument("--train-epochs", type=int, default=0, help="train a checkpoint per size first")
+    parser.add_argument("--sizes", default="224,112")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--output", default="resolution_comparison.json")
+    args = parser.parse_args()
+
+    checkpoints = dict(item.split("=", 1) for item in args.checkpoint)
+    sizes = [int(s) for s in args.sizes.split(",")]
+
+    report = {}
+    for size in sizes:
+        dataset, train_loader, val_loader = make_loaders(size, num_workers=args.workers)
+        tabular_dim = dataset[0][0][1].shape[0]
+        path = checkpoints.get(str(size))
+
+        if path is None and args.train_epochs:
+            path = f"best_model_{size}.pth"
+            model = CNNTFMModel(tabular_dim=tabular_dim, pretrained=True, image_size=size)
+            best = train(model, train_loader, val_loader, epochs=args.train_epochs, output=path)
+            write_metadata(path, image_size=size, tabular_dim=tabular_dim, val=best)
+        if path is None:
+            print(f"no checkpoint for {size} px, pass --checkpoint {size}=PATH or --train-epochs")
+            continue
+
+        model = CNNTFMModel(tabular_dim=tabular_dim, image_size=size)
+        model.load_state_dict(torch.load(path, map_location="cpu"))
+        report[size] = {
+            "checkpoint": path,
+            "val": evaluate(model, val_loader),
+            "throughput": throughput(model, size, tabular_dim=tabular_dim),
+        }
+        print(f"{size} px: {report[size]}")
+
+    if 224 in report and 112 in report:
+        report["speedup_112_vs_224"] = (report[112]["throughput"]["tiles_per_s"]
+                                        / report[224]["throughput"]["tiles_per_s"])
+        report["val_mae_delta_112_vs_224"] = report[112]["val"]["mae"] - report[224]["val"]["mae"]
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"comparison written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+import torch
+import torchvision.transforms as transforms
+from PIL import Image
+from torch.utils.data import Dataset
+
+
+# --- default locations of the committed sample data ---
+MODEL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(MODEL_DIR, 'data')
+CSV_PATH = os.path.join(DATA_DIR, 'tile_features_scaled.csv')
+RAW_CSV_PATH = os.path.join(DATA_DIR, 'tile_features.csv')
+IMAGE_DIR = os.path.join(MODEL_DIR, 'earth_engine', 'converted_png')
+CSV_CHUNK_ROWS = 10_000
+
+sys.path.insert(0, DATA_DIR)
+import streaming_scaler  # noqa: E402
+
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+
+def make_transform(image_size=224):
+    return transforms.Compose([
+        transforms.Resize((image_size, image_size)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)
+    ])
+
+
+class WaterAccessDataset(Dataset):
+
+    # constructor
+    # the csv is converted a chunk at a time into .npy files under cache_dir (a temporary
+    # directory by default) and rows are read back memory-mapped, so memory is one chunk
+    # however large the table. with scaler_params (from model/data/streaming_scaler.py)
+    # csv_path is the raw, unscaled table: only the needed columns are read and each chunk
+    # is normalized as it is converted
+    def __init__(self, csv_path=CSV_PATH, image_dir=IMAGE_DIR, transform=None, scaler_params=None, cache_dir=None,
+                 chunksize=CSV_CHUNK_ROWS):
+        self.feature_norm = self.score_norm = None
+        if scaler_params:
+            self.feature_norm, self.score_norm = streaming_scaler.load(scaler_params)
+            columns = self.feature_norm.columns
+        else:
+            columns = [c for c in pd.read_csv(csv_path, nrows=0).columns if c not in ('tile_id', 'score')]
+        self._tmp = None
+        if cache_dir is None:
+            self._tmp = tempfile.TemporaryDirectory(prefix='water_access_')
+            cache_dir = self._tmp.name
+        self.cache_dir = cache_dir
+        self.length = self._convert(csv_path, columns, chunksize)
+        self.image_dir = image_dir
+        self.transform = transform
+        self._arrays = None
+
+    def _convert(self, csv_path, columns, chunksize):
+        # first pass: row count and tile id width; second: rows into the preallocated files
+        rows, width = 0, 1
+        for chunk in pd.read_csv(csv_path, usecols=['tile_id'], dtype={'tile_id': str}, chunksize=chunksize):
+            rows += len(chunk)
+            width = max(width, int(chunk['tile_id'].str.len().max()))
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        def create(name, dtype, shape):
+            return np.lib.format.open_memmap(os.path.join(self.cache_dir, f'{name}.npy'), mode='w+', dtype=dtype,
+                                             shape=shape)
+        tabular = create('tabular', np.float32, (rows, len(columns)))
+        labels = create('labels', np.float32, (rows,))
+        tile_ids = create('tile_ids', f'S{width}', (rows,))
+        start = 0
+        for chunk in pd.read_csv(csv_path, usecols=['tile_id', 'score'] + columns, dtype={'tile_id': str},
+                                 chunksize=chunksize):
+            end = start + len(chunk)
+            tab = chunk[columns].to_numpy(np.float32)
+            score = chunk['score'].to_numpy(np.float64)
+            if self.feature_norm is not None:
+                tab = self.feature_norm.transform(tab)
+                score = self.score_norm.transform(score[:, None])[:, 0]
+            tabular[start:end] = tab
+            labels[start:end] = score
+            tile_ids[start:end] = chunk['tile_id'].to_numpy(dtype=f'S{width}')
+            start = end
+        for arr in (tabular, labels, tile_ids):
+            arr.flush()
+        return rows
+
+    # memory-mapped on first use in each process, so DataLoader workers map the files
+    # themselves rather than being sent a copy
+    def arrays(self):
+        if self._arrays is None:
+            self._arrays = {name: np.load(os.path.join(self.cache_dir, f'{name}.npy'), mmap_mode='r')
+                            for name in ('tabular', 'labels', 'tile_ids')}
+        return self._arrays
+
+    def __getstate__(self):
+        # the temporary directory stays owned (and removed) by the original dataset
+        return dict(self.__dict__, _arrays=None, _tmp=None)
+
+    # len(dataset)
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        arrays = self.arrays()
+        tile_id = arrays['tile_ids'][index].decode()
+        label = torch.tensor(arrays['labels'][index], dtype=torch.float32)
+
+        # load and process image
+        img_path = os.path.join(self.image_dir, f"sentinel2_{tile_id}.png")
+        image = Image.open(img_path).convert("RGB")
+        if self.transform:
+            image = self.transform(image)
+
+        tab = torch.tensor(np.array(arrays['tabular'][index]))
+
+        return (image, tab), label
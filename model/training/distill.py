@@ -0,0 +1,167 @@
+"""
+distills the resnet18 fusion model (teacher) into compact students that keep the
+same tabular fusion head, then reports accuracy vs cpu tiles/sec as a pareto table.
+
+    python model/training/distill.py --teacher best_model.pth --students mobilenet_v3_small:112,small_cnn:112
+
+the teacher is run once over every tile up front, so student epochs never touch it.
+"""
+import argparse
+import json
+import os
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.optim.lr_scheduler import ReduceLROnPlateau
+from torch.utils.data import DataLoader, Dataset, Subset
+
+from compare_resolution import throughput
+from dataset import WaterAccessDataset, make_transform
+from train import CNNTFMModel, evaluate, read_metadata, split_dataset, write_metadata
+
+
+class WithTeacher(Dataset):
+    # wraps a dataset so each sample also carries the teacher's prediction
+    def __init__(self, dataset, teacher_preds):
+        self.dataset = dataset
+        self.teacher_preds = teacher_preds
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        inputs, label = self.dataset[index]
+        return inputs, label, self.teacher_preds[index]
+
+
+def teacher_predictions(teacher, dataset, batch_size=64, num_workers=2):
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    teacher.eval()
+    preds = []
+    with torch.no_grad():
+        for (images, tabular), _ in loader:
+            preds.append(teacher(images, tabular).reshape(-1))
+    return torch.cat(preds)
+
+
+def distill(student, train_loader, val_loader, epochs=10, lr=1e-3, alpha=0.5, delta=1.0, output=None):
+    # loss = alpha * huber(student, label) + (1 - alpha) * mse(student, teacher)
+    hard = nn.HuberLoss(delta=delta)
+    soft = nn.MSELoss()
+    optimizer = optim.Adam(student.parameters(), lr=lr, weight_decay=1e-4)
+    scheduler = ReduceLROnPlateau(optimizer, mode='min', patience=2, factor=0.5)
+
+    best = {"loss": float('inf')}
+    for epoch in range(epochs):
+        student.train()
+        total_loss = 0
+        for (images, tabular), labels, teacher_pred in train_loader:
+            optimizer.zero_grad()
+            pred = student(images, tabular).reshape(-1)
+            loss = alpha * hard(pred, labels) + (1 - alpha) * soft(pred, teacher_pred)
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item()
+
+        val = evaluate(student, val_loader)
+        scheduler.step(val["loss"])
+        print(f"epoch {epoch+1}/{epochs} - distill loss: {total_loss / len(train_loader):.4f} "
+              f"- val loss: {val['loss']:.4f} - val mae: {val['mae']:.4f}")
+        if val["loss"] < best["loss"]:
+            best = dict(val, epoch=epoch + 1)
+            if output:
+                torch.save(student.state_dict(), output)
+    return best
+
+
+def pareto(rows):
+    # a row is on the front if no other row is both more accurate (lower mae) and faster
+    for row in rows:
+        row["pareto"] = not any(
+            other is not row
+            and other["val_mae"] <= row["val_mae"] and other["tiles_per_s"] >= row["tiles_per_s"]
+            and (other["val_mae"] < row["val_mae"] or other["tiles_per_s"] > row["tiles_per_s"])
+            for other in rows
+        )
+    return rows
+
+
+def print_table(rows):
+    print("| model | backbone | px | params | val mae | val r2 | tiles/s | pareto |")
+    print("|---|---|---|---|---|---|---|---|")
+    for r in sorted(rows, key=lambda r: -r["tiles_per_s"]):
+        print(f"| {r['name']} | {r['backbone']} | {r['image_size']} | {r['params'] / 1e6:.2f}M | "
+              f"{r['val_mae']:.4f} | {r['val_r2']:.3f} | {r['tiles_per_s']:.0f} | {'*' if r['pareto'] else ''} |")
+
+
+def summarize(name, model, val_loader, tabular_dim):
+    val = evaluate(model, val_loader)
+    return {
+        "name": name,
+        "backbone": model.backbone,
+        "image_size": model.image_size,
+        "params": sum(p.numel() for p in model.parameters()),
+        "val_mae": val["mae"],
+        "val_r2": val["r2"],
+        "tiles_per_s": throughput(model, model.image_size, tabular_dim=tabular_dim)["tiles_per_s"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="distill the fusion model into lightweight students")
+    parser.add_argument("--teacher", default="best_model.pth")
+    parser.add_argument("--students", default="mobilenet_v3_small:112,small_cnn:112", help="backbone:size,...")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--alpha", type=float, default=0.5, help="weight of the true label vs the teacher")
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--output-dir", default="students")
+    args = parser.parse_args()
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # --- teacher ---
+    meta = read_metadata(args.teacher)
+    teacher_size = meta.get("image_size", 224)
+    teacher_data = WaterAccessDataset(transform=make_transform(teacher_size))
+    tabular_dim = teacher_data[0][0][1].shape[0]
+    teacher = CNNTFMModel(tabular_dim=tabular_dim, image_size=teacher_size, backbone=meta.get("backbone", "resnet18"))
+    teacher.load_state_dict(torch.load(args.teacher, map_location="cpu"))
+    teacher_preds = teacher_predictions(teacher, teacher_data, num_workers=args.workers)
+
+    _, teacher_val = split_dataset(teacher_data)
+    rows = [summarize("teacher", teacher,
+                      DataLoader(teacher_val, batch_size=args.batch_size, num_workers=args.workers), tabular_dim)]
+
+    # --- students ---
+    for spec in args.students.split(","):
+        backbone, size = spec.split(":")
+        size = int(size)
+        data = WaterAccessDataset(transform=make_transform(size))
+        train_split, val_split = split_dataset(data)  # same indices as the teacher's split
+        train_loader = DataLoader(Subset(WithTeacher(data, teacher_preds), train_split.indices),
+                                  batch_size=args.batch_size, shuffle=True, num_workers=args.workers)
+        val_loader = DataLoader(val_split, batch_size=args.batch_size, num_workers=args.workers)
+
+        name = f"{backbone}_{size}"
+        path = os.path.join(args.output_dir, f"{name}.pth")
+        student = CNNTFMModel(tabular_dim=tabular_dim, pretrained=backbone != "small_cnn",
+                              image_size=size, backbone=backbone)
+        print(f"--- distilling {name} ---")
+        best = distill(student, train_loader, val_loader, epochs=args.epochs, lr=args.lr,
+                       alpha=args.alpha, output=path)
+        write_metadata(path, image_size=size, backbone=backbone, tabular_dim=tabular_dim,
+                       teacher=args.teacher, val=best)
+
+        student.load_state_dict(torch.load(path, map_location="cpu"))
+        rows.append(summarize(name, student, val_loader, tabular_dim))
+
+    pareto(rows)
+    print_table(rows)
+    with open(os.path.join(args.output_dir, "pareto.json"), "w") as f:
+        json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+sharded training data for datasets too big for one-png-per-tile + one csv.
+
+each shard is one file holding its tiles contiguously: decoded uint8 images,
+float32 tabular vectors, float32 labels and the tile ids, behind a small json
+header. an index.json next to the shards records counts and columns.
+
+    python model/training/shards.py write shards/ --shard-size 1024 --split
+    (converts converted_png + tile_features_scaled.csv, into shards/train and shards/val)
+    python model/training/train.py --shards shards/ --image-size 224
+
+ShardedTileDataset streams shards sequentially through a shuffle buffer and splits
+shards between DDP ranks and DataLoader workers, so each process only ever opens its
+own files and memory is bounded by the shuffle buffer. under DDP every reader yields
+the same number of rows, so no rank waits in an all-reduce the others never reach.
+"""
+import argparse
+import json
+import os
+import random
+import warnings
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.distributed as dist
+import torch.nn.functional as F
+from PIL import Image
+from torch.utils.data import IterableDataset, get_worker_info
+
+from dataset import CSV_PATH, IMAGE_DIR, IMAGENET_MEAN, IMAGENET_STD
+
+MAGIC = b"CANSHRD1"
+ALIGN = 64
+CSV_CHUNK_ROWS = 10_000
+
+
+# --------------------------
+# shard files
+# --------------------------
+def write_shard(path, images, tabular, labels, tile_ids):
+    arrays = {
+        "images": np.ascontiguousarray(images, dtype=np.uint8),
+        "tabular": np.ascontiguousarray(tabular, dtype=np.float32),
+        "labels": np.ascontiguousarray(labels, dtype=np.float32),
+        "tile_ids": np.asarray(tile_ids, dtype="S"),
+    }
+    # lay the arrays out back to back, each aligned, after a fixed size header slot
+    layout, offset = {}, 0
+    for name, arr in arrays.items():
+        layout[name] = {"offset": offset, "dtype": arr.dtype.str, "shape": list(arr.shape)}
+        offset += -(-arr.nbytes // ALIGN) * ALIGN
+    header = json.dumps({"count": len(labels), "arrays": layout}).encode()
+    data_start = -(-(len(MAGIC) + 4 + len(header)) // ALIGN) * ALIGN
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(4, "little"))
+        f.write(header)
+        for name, arr in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(arr.tobytes())
+        f.truncate(data_start + offset)
+
+
+def read_shard(path):
+    # returns memory mapped arrays; pages are read as rows are touched, front to back
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a tile shard")
+        header_len = int.from_bytes(f.read(4), "little")
+        header = json.loads(f.read(header_len))
+    data_start = -(-(len(MAGIC) + 4 + header_len) // ALIGN) * ALIGN
+
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        arrays[name] = np.memmap(path, dtype=np.dtype(spec["dtype"]), mode="r",
+                                 offset=data_start + spec["offset"], shape=tuple(spec["shape"]))
+    return arrays
+
+
+# --------------------------
+# writer: converted_png + csv -> shards
+# --------------------------
+def load_tile(path, image_size):
+    # exported tiles are 112 or 113 px a side; resize the same way make_transform does
+    image = Image.open(path).convert("RGB")
+    if image.size != (image_size, image_size):
+        image = image.resize((image_size, image_size), Image.BILINEAR)
+    return np.asarray(image)
+
+
+class ShardWriter:
+    # takes csv rows a chunk at a time and writes a shard every shard_size tiles
+    def __init__(self, out_dir, image_dir, columns, shard_size=1024, image_size=224):
+        os.makedirs(out_dir, exist_ok=True)
+        self.out_dir = out_dir
+        self.image_dir = image_dir
+        self.columns = columns
+        self.shard_size = shard_size
+        self.image_size = image_size
+        self.pending = []
+        self.buffered = 0
+        self.shards = []
+        self.image_shape = None
+
+    def add(self, rows):
+        if len(rows):
+            self.pending.append(rows)
+            self.buffered += len(rows)
+        while self.buffered >= self.shard_size:
+            self._flush(self.shard_size)
+
+    def _flush(self, n):
+        rows = pd.concat(self.pending)
+        chunk, rest = rows.iloc[:n], rows.iloc[n:]
+        self.pending, self.buffered = ([rest] if len(rest) else []), len(rest)
+
+        images = np.stack([load_tile(os.path.join(self.image_dir, f"sentinel2_{tile_id}.png"), self.image_size)
+                           for tile_id in chunk['tile_id']])
+        name = f"shard-{len(self.shards):05d}.bin"
+        write_shard(os.path.join(self.out_dir, name), images, chunk[self.columns].to_numpy(np.float32),
+                    chunk['score'].to_numpy(np.float32), chunk['tile_id'].astype(str).to_numpy())
+        self.shards.append({"file": name, "count": len(chunk)})
+        self.image_shape = list(images.shape[1:])
+        print(f"wrote {name} ({len(chunk)} tiles)")
+
+    def close(self):
+        if self.buffered:
+            self._flush(self.buffered)
+        index = {
+            "shards": self.shards,
+            "count": int(sum(s["count"] for s in self.shards)),
+            "tabular_columns": self.columns,
+            "image_shape": self.image_shape,
+        }
+        with open(os.path.join(self.out_dir, "index.json"), "w") as f:
+            json.dump(index, f, indent=2)
+        return index
+
+
+def write_shards(out_dir, rows, image_dir, columns, shard_size=1024, image_size=224):
+    writer = ShardWriter(out_dir, image_dir, columns, shard_size, image_size)
+    writer.add(rows)
+    return writer.close()
+
+
+def convert(out_dir, csv_path=CSV_PATH, image_dir=IMAGE_DIR, shard_size=1024, image_size=224, split=False, seed=0,
+            chunksize=CSV_CHUNK_ROWS):
+    # the csv is read a chunk at a time (twice with --split: once to count rows). rows are
+    # shuffled within each chunk; ShardedTileDataset shuffles shard order and through its buffer
+    columns = [c for c in pd.read_csv(csv_path, nrows=0).columns if c not in ('tile_id', 'score')]
+    args = (image_dir, columns, shard_size, image_size)
+    rng = np.random.default_rng(seed)
+    if split:
+        # same train/val indices as train.split_dataset, so results compare with the png pipeline
+        from train import split_dataset
+        total = sum(len(chunk) for chunk in pd.read_csv(csv_path, usecols=['score'], chunksize=chunksize))
+        is_val = np.zeros(total, dtype=bool)
+        is_val[split_dataset(range(total))[1].indices] = True
+        writers = {False: ShardWriter(os.path.join(out_dir, "train"), *args),
+                   True: ShardWriter(os.path.join(out_dir, "val"), *args)}
+    else:
+        writers = {False: ShardWriter(out_dir, *args)}
+
+    start = 0
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+        chunk_val = is_val[start:start + len(chunk)] if split else np.zeros(len(chunk), dtype=bool)
+        start += len(chunk)
+        writers[False].add(chunk[~chunk_val].iloc[rng.permutation(int((~chunk_val).sum()))])
+        if split:
+            writers[True].add(chunk[chunk_val])  # val keeps csv order
+    indexes = {key: writer.close() for key, writer in writers.items()}
+    return None if split else indexes[False]
+
+
+# --------------------------
+# streaming dataset
+# --------------------------
+class ShardedTileDataset(IterableDataset):
+    # yields ((image, tabular), label) like WaterAccessDataset, normalized the same way
+    def __init__(self, root, image_size=224, shuffle_buffer=2048, shuffle=True, seed=0):
+        with open(os.path.join(root, "index.json")) as f:
+            self.index = json.load(f)
+        self.paths = [os.path.join(root, s["file"]) for s in self.index["shards"]]
+        self.counts = [s["count"] for s in self.index["shards"]]
+        self.image_size = image_size
+        self.shuffle_buffer = shuffle_buffer if shuffle else 0
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.mean = torch.tensor(IMAGENET_MEAN).view(3, 1, 1) * 255
+        self.std = torch.tensor(IMAGENET_STD).view(3, 1, 1) * 255
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return sum(self.counts)
+
+    def _reader(self):
+        # (slot, slots, world size): this process among all (rank, worker) readers
+        rank, world = (dist.get_rank(), dist.get_world_size()) if dist.is_available() and dist.is_initialized() else (0, 1)
+        info = get_worker_info()
+        worker, workers = (info.id, info.num_workers) if info else (0, 1)
+        return rank * workers + worker, world * workers, world
+
+    def _plan(self):
+        # [(shard, first row, row step)] this reader opens, and how many rows it yields.
+        # shards go round robin over readers; under DDP every reader gets the same number of rows
+        slot, slots, world = self._reader()
+        order = list(range(len(self.paths)))
+        if self.shuffle:
+            random.Random(self.seed + self.epoch).shuffle(order)
+        if world == 1:
+            return [(s, 0, 1) for s in order[slot::slots]], sum(self.counts[s] for s in order[slot::slots])
+
+        if len(order) < slots:
+            # too few shards to give each reader whole ones: stripe rows across readers instead
+            warnings.warn(f"{len(order)} shards for {slots} readers, striping rows across readers")
+            offsets = np.cumsum([0] + [self.counts[s] for s in order[:-1]])
+            return [(s, (slot - offset) % slots, slots) for s, offset in zip(order, offsets)], sum(self.counts) // slots
+        # shards past a multiple of the reader count sit out this epoch (the shuffle rotates
+        # which), and every reader stops at the smallest reader's row count
+        usable = len(order) // slots * slots
+        if usable < len(order):
+            warnings.warn(f"{len(order)} shards for {slots} readers, {len(order) - usable} skipped each epoch")
+        limit = min(sum(self.counts[s] for s in order[i:usable:slots]) for i in range(slots))
+        return [(s, 0, 1) for s in order[slot:usable:slots]], limit
+
+    def _sample(self, image, tabular, label):
+        image = torch.from_numpy(np.array(image)).permute(2, 0, 1).float()
+        if image.shape[-1] != self.image_size:  # stored at another resolution than we train at
+            image = F.interpolate(image[None], size=(self.image_size, self.image_size),
+                                  mode="bilinear", align_corners=False, antialias=True)[0]
+        image = (image - self.mean) / self.std
+        return (image, torch.from_numpy(np.array(tabular))), torch.tensor(float(label))
+
+    def _rows(self):
+        plan, limit = self._plan()
+        for shard, first, step in plan:
+            arrays = read_shard(self.paths[shard])
+            for i in range(first, len(arrays["labels"]), step):
+                if limit == 0:
+                    return
+                limit -= 1
+                yield arrays["images"][i], arrays["tabular"][i], arrays["labels"][i]
+
+    def __iter__(self):
+        if not self.shuffle_buffer:
+            for row in self._rows():
+                yield self._sample(*row)
+            return
+
+        # keep shuffle_buffer rows; each new row replaces (and emits) a random one of them.
+        # seeded per (rank, worker) reader, so ranks don't shuffle their rows in lockstep
+        rng = random.Random(self.seed + self.epoch * 9973 + self._reader()[0])
+        buffer = []
+        for row in self._rows():
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(row)
+                continue
+            i = rng.randrange(len(buffer))
+            buffer[i], row = row, buffer[i]
+            yield self._sample(*row)
+        rng.shuffle(buffer)
+        for row in buffer:
+            yield self._sample(*row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pack tiles into streaming shards")
+    sub = parser.add_subparsers(dest="command", required=True)
+    write = sub.add_parser("write", help="convert converted_png + csv into shards")
+    write.add_argument("out_dir")
+    write.add_argument("--csv", default=CSV_PATH)
+    write.add_argument("--image-dir", default=IMAGE_DIR)
+    write.add_argument("--shard-size", type=int, default=1024)
+    write.add_argument("--image-size", type=int, default=224,
+                       help="stored resolution; 112 keeps the native tiles at a quarter of the space")
+    write.add_argument("--split", action="store_true", help="write train/ and val/ using the fixed split")
+    args = parser.parse_args()
+
+    if args.command == "write":
+        convert(args.out_dir, args.csv, args.image_dir, args.shard_size, args.image_size, args.split)
+
+
+if __name__ == "__main__":
+    main()
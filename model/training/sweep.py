@@ -0,0 +1,378 @@
+"""
+hyperparameter sweep for the fusion model: a process pool where each trial process owns
+a fixed slice of cores, asha early stopping, and a local sqlite results store.
+
+    python model/training/sweep.py --trials 27 --procs 4 --head-only          # minutes: frozen cnn, cached embeddings
+    python model/training/sweep.py --trials 9 --procs 2 --max-epochs 9        # full fine-tuning
+    python model/training/sweep.py --report                                   # print the store
+
+asha: trials start at the smallest epoch budget (rung 0). whenever a process frees up,
+the best not-yet-promoted trial in the top 1/eta of any rung is continued to the next
+rung; otherwise a new trial starts. trials resume from their own checkpoint, so a
+promotion only pays for the extra epochs.
+
+--head-only runs the backbone once over every tile, caches the embeddings on disk and
+then only trains the fusion head, which is what makes large sweeps cheap on cpu.
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import torch
+import torch.multiprocessing as mp
+import torch.nn as nn
+import torch.optim as optim
+from torch.optim.lr_scheduler import ReduceLROnPlateau
+from torch.utils.data import DataLoader, Dataset
+
+from dataset import CSV_PATH, WaterAccessDataset, make_transform
+from train import CNNTFMModel, evaluate, fusion_head, split_dataset, write_metadata
+from train_ddp import pin_cores
+
+# the notebook's values come first so the baseline is always among the trials
+SEARCH_SPACE = {
+    "lr": ("log", 1e-5, 3e-3, 1e-4),
+    "batch_size": ("choice", [16, 32, 64, 128], 32),
+    "delta": ("choice", [0.5, 1.0, 2.0], 1.0),
+    "dropout": ("uniform", 0.0, 0.6, 0.5),
+    "weight_decay": ("log", 1e-6, 1e-3, 1e-4),
+}
+
+
+def sample_configs(n, space=SEARCH_SPACE, seed=0):
+    rng = random.Random(seed)
+    configs = [{name: spec[-1] for name, spec in space.items()}]
+    while len(configs) < n:
+        config = {}
+        for name, spec in space.items():
+            if spec[0] == "log":
+                config[name] = math.exp(rng.uniform(math.log(spec[1]), math.log(spec[2])))
+            elif spec[0] == "uniform":
+                config[name] = rng.uniform(spec[1], spec[2])
+            else:
+                config[name] = rng.choice(spec[1])
+        configs.append(config)
+    return configs[:n]
+
+
+def rung_budgets(min_epochs, max_epochs, eta):
+    budgets = [min_epochs]
+    while budgets[-1] * eta <= max_epochs:
+        budgets.append(budgets[-1] * eta)
+    return budgets
+
+
+# --------------------------
+# results store
+# --------------------------
+class ResultsStore:
+    # one row per trial (latest state) and one per finished rung, only written by the coordinator
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS trials (
+                sweep TEXT, trial INTEGER, config TEXT, status TEXT, rung INTEGER, epochs INTEGER,
+                val_loss REAL, val_mae REAL, seconds REAL, checkpoint TEXT, PRIMARY KEY (sweep, trial));
+            CREATE TABLE IF NOT EXISTS rungs (
+                sweep TEXT, trial INTEGER, rung INTEGER, epochs INTEGER,
+                val_loss REAL, val_mae REAL, val_rmse REAL, val_r2 REAL, seconds REAL,
+                PRIMARY KEY (sweep, trial, rung));
+        """)
+
+    def add_trial(self, sweep, trial, config):
+        self.db.execute("INSERT OR REPLACE INTO trials (sweep, trial, config, status, rung, epochs, seconds) "
+                        "VALUES (?, ?, ?, 'running', -1, 0, 0)", (sweep, trial, json.dumps(config)))
+        self.db.commit()
+
+    def add_result(self, sweep, trial, rung, result):
+        val = result["val"]
+        self.db.execute("INSERT OR REPLACE INTO rungs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (sweep, trial, rung, result["epochs"], val["loss"], val["mae"], val["rmse"], val["r2"],
+                         result["seconds"]))
+        self.db.execute("UPDATE trials SET status = 'paused', rung = ?, epochs = ?, val_loss = ?, val_mae = ?, "
+                        "seconds = seconds + ?, checkpoint = ? WHERE sweep = ? AND trial = ?",
+                        (rung, result["epochs"], val["loss"], val["mae"], result["seconds"], result["checkpoint"],
+                         sweep, trial))
+        self.db.commit()
+
+    def set_status(self, sweep, trial, status):
+        self.db.execute("UPDATE trials SET status = ? WHERE sweep = ? AND trial = ?", (status, sweep, trial))
+        self.db.commit()
+
+    def trials(self, sweep=None):
+        query = "SELECT sweep, trial, config, status, rung, epochs, val_loss, val_mae, seconds, checkpoint FROM trials"
+        rows = self.db.execute(query + " WHERE sweep = ?" if sweep else query, (sweep,) if sweep else ())
+        keys = ("sweep", "trial", "config", "status", "rung", "epochs", "val_loss", "val_mae", "seconds", "checkpoint")
+        return [dict(zip(keys, row), config=json.loads(row[2])) for row in rows]
+
+
+# --------------------------
+# head-only data: cached backbone embeddings
+# --------------------------
+class EmbeddingHead(nn.Module):
+    # the fusion head of CNNTFMModel, fed precomputed backbone features instead of images
+    def __init__(self, cnn_out_dim, tabular_dim, dropout=0.5):
+        super().__init__()
+        self.fc = fusion_head(cnn_out_dim + tabular_dim, dropout)
+
+    def forward(self, embedding, tabular):
+        return self.fc(torch.cat((embedding, tabular), dim=1)).squeeze()
+
+
+class EmbeddingDataset(Dataset):
+    def __init__(self, embeddings, tabular, labels):
+        self.embeddings, self.tabular, self.labels = embeddings, tabular, labels
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, index):
+        return (self.embeddings[index], self.tabular[index]), self.labels[index]
+
+
+def backbone_model(backbone, image_size, tabular_dim, weights=None, pretrained=True):
+    torch.manual_seed(0)  # a random backbone (--no-pretrained) must come out the same when exporting
+    model = CNNTFMModel(tabular_dim, pretrained=pretrained and not weights, image_size=image_size, backbone=backbone)
+    if weights:
+        model.load_state_dict(torch.load(weights, map_location="cpu"))
+    return model.eval()
+
+
+def cached_embeddings(cache_dir, backbone, image_size, weights=None, pretrained=True, batch_size=64):
+    # keyed by everything the embeddings depend on, so a changed checkpoint or table recomputes
+    sources = [CSV_PATH] + ([weights] if weights else [])
+    key = json.dumps([backbone, image_size, pretrained, [(p, os.path.getmtime(p), os.path.getsize(p)) for p in sources]])
+    path = os.path.join(cache_dir, f"embeddings_{backbone}_{image_size}_{hashlib.sha256(key.encode()).hexdigest()[:12]}.pt")
+    if os.path.exists(path):
+        print(f"using cached embeddings {path}")
+        return path
+
+    dataset = WaterAccessDataset(transform=make_transform(image_size))
+    tabular_dim = dataset[0][0][1].shape[0]
+    model = backbone_model(backbone, image_size, tabular_dim, weights, pretrained)
+    embeddings, tabular, labels = [], [], []
+    t0 = time.perf_counter()
+    with torch.no_grad():
+        for (images, tab), y in DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=2):
+            embeddings.append(model.cnn(images).view(images.size(0), -1))
+            tabular.append(tab)
+            labels.append(y)
+    data = {"embeddings": torch.cat(embeddings), "tabular": torch.cat(tabular), "labels": torch.cat(labels),
+            "backbone": backbone, "image_size": image_size, "weights": weights, "pretrained": pretrained}
+    os.makedirs(cache_dir, exist_ok=True)
+    torch.save(data, path)
+    print(f"embedded {len(dataset)} tiles in {time.perf_counter() - t0:.1f}s -> {path}")
+    return path
+
+
+# --------------------------
+# trial processes
+# --------------------------
+_worker = {}
+
+
+def init_worker(slots, procs, setup):
+    # each pool process claims a slot once and keeps its core slice for every trial it runs
+    slot = slots.get()
+    cores = pin_cores(slot, procs)
+    _worker.update(setup, slot=slot, cores=cores)
+
+    if setup["head_only"]:
+        data = torch.load(setup["embeddings"])
+        dataset = EmbeddingDataset(data["embeddings"], data["tabular"], data["labels"])
+        _worker["cnn_out_dim"] = data["embeddings"].shape[1]
+        _worker["tabular_dim"] = data["tabular"].shape[1]
+    else:
+        dataset = WaterAccessDataset(transform=make_transform(setup["image_size"]))
+        _worker["tabular_dim"] = dataset[0][0][1].shape[0]
+    _worker["train"], _worker["val"] = split_dataset(dataset)
+
+
+def build_trial_model(config):
+    if _worker["head_only"]:
+        return EmbeddingHead(_worker["cnn_out_dim"], _worker["tabular_dim"], dropout=config["dropout"])
+    return CNNTFMModel(_worker["tabular_dim"], pretrained=_worker["pretrained"], image_size=_worker["image_size"],
+                       backbone=_worker["backbone"], dropout=config["dropout"])
+
+
+def run_trial(trial, config, epochs, checkpoint):
+    # trains `trial` up to `epochs` total, resuming from its checkpoint when there is one
+    t0 = time.perf_counter()
+    torch.manual_seed(trial)
+    model = build_trial_model(config)
+    criterion = nn.HuberLoss(delta=config["delta"])
+    optimizer = optim.Adam(model.parameters(), lr=config["lr"], weight_decay=config["weight_decay"])
+    scheduler = ReduceLROnPlateau(optimizer, mode='min', patience=2, factor=0.5)
+    done = 0
+    if os.path.exists(checkpoint):
+        state = torch.load(checkpoint)
+        model.load_state_dict(state["model"])
+        optimizer.load_state_dict(state["optimizer"])
+        scheduler.load_state_dict(state["scheduler"])
+        done = state["epochs"]
+
+    train_loader = DataLoader(_worker["train"], batch_size=config["batch_size"], shuffle=True)
+    val_loader = DataLoader(_worker["val"], batch_size=256, shuffle=False)
+    for _ in range(done, epochs):
+        model.train()
+        for (inputs, tabular), labels in train_loader:
+            optimizer.zero_grad()
+            loss = criterion(model(inputs, tabular).reshape(-1), labels)
+            loss.backward()
+            optimizer.step()
+        val = evaluate(model, val_loader, criterion)
+        scheduler.step(val["loss"])
+
+    # reported with the default huber delta so trials with different deltas compare
+    val = evaluate(model, val_loader, nn.HuberLoss(delta=1.0))
+    torch.save({"model": model.state_dict(), "optimizer": optimizer.state_dict(),
+                "scheduler": scheduler.state_dict(), "epochs": epochs}, checkpoint)
+    return {"trial": trial, "epochs": epochs, "trained": epochs - done, "val": val,
+            "seconds": time.perf_counter() - t0, "checkpoint": checkpoint, "slot": _worker["slot"],
+            "tabular_dim": _worker["tabular_dim"]}
+
+
+# --------------------------
+# asha coordinator
+# --------------------------
+def next_job(rungs, promoted, budgets, eta, pending):
+    # highest rung first: continue a trial that sits in the top 1/eta of its rung
+    for rung in reversed(range(len(budgets) - 1)):
+        finished = sorted(rungs[rung].items(), key=lambda item: item[1])
+        top = [trial for trial, _ in finished[:len(finished) // eta]]
+        for trial in top:
+            if trial not in promoted[rung]:
+                promoted[rung].add(trial)
+                return trial, rung + 1
+    if pending:
+        return pending.pop(0), 0
+    return None
+
+
+def sweep(args):
+    os.makedirs(args.sweep_dir, exist_ok=True)
+    store = ResultsStore(os.path.join(args.sweep_dir, "results.db"))
+    budgets = rung_budgets(args.min_epochs, args.max_epochs, args.eta)
+    configs = sample_configs(args.trials, seed=args.seed)
+    name = args.name or time.strftime("sweep-%Y%m%d-%H%M%S")
+
+    setup = {"head_only": args.head_only, "image_size": args.image_size, "backbone": args.backbone,
+             "pretrained": args.pretrained}
+    if args.head_only:
+        setup["embeddings"] = cached_embeddings(os.path.join(args.sweep_dir, "cache"), args.backbone,
+                                                args.image_size, args.weights, args.pretrained)
+    print(f"{name}: {len(configs)} trials, rungs {budgets} epochs, {args.procs} processes")
+
+    ctx = mp.get_context("spawn")
+    slots = ctx.Queue()
+    for slot in range(args.procs):
+        slots.put(slot)
+
+    rungs = [dict() for _ in budgets]  # rung -> {trial: val loss}
+    promoted = [set() for _ in budgets]
+    pending = list(range(len(configs)))
+    running = {}
+    trained = 0
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(args.procs, mp_context=ctx, initializer=init_worker,
+                             initargs=(slots, args.procs, setup)) as pool:
+        while True:
+            while len(running) < args.procs:
+                job = next_job(rungs, promoted, budgets, args.eta, pending)
+                if job is None:
+                    break
+                trial, rung = job
+                if rung == 0:
+                    store.add_trial(name, trial, configs[trial])
+                else:
+                    store.set_status(name, trial, "running")
+                checkpoint = os.path.join(args.sweep_dir, f"{name}-trial{trial}.pt")
+                future = pool.submit(run_trial, trial, configs[trial], budgets[rung], checkpoint)
+                running[future] = (trial, rung)
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                trial, rung = running.pop(future)
+                result = future.result()
+                rungs[rung][trial] = result["val"]["loss"]
+                trained += result["trained"]
+                store.add_result(name, trial, rung, result)
+                print(f"trial {trial:>3} rung {rung} ({result['epochs']} epochs, slot {result['slot']}): "
+                      f"val loss {result['val']['loss']:.4f} mae {result['val']['mae']:.4f} "
+                      f"({result['seconds']:.1f}s)")
+
+    # trials that never got promoted stopped early; the best is taken from the highest rung reached
+    top_rung = max(r for r in range(len(budgets)) if rungs[r])
+    best = min(rungs[top_rung], key=rungs[top_rung].get)
+    for trial in range(len(configs)):
+        store.set_status(name, trial, "best" if trial == best else "stopped" if trial not in rungs[-1] else "completed")
+    print(f"{name} done in {time.perf_counter() - t0:.1f}s, "
+          f"{trained} epochs trained vs {len(configs) * budgets[-1]} without early stopping")
+    print(f"best trial {best}: {json.dumps(configs[best])} val loss {rungs[top_rung][best]:.4f}")
+
+    if args.output:
+        export_best(args, store, name, best, setup, result["tabular_dim"])
+    return name
+
+
+def export_best(args, store, name, best, setup, tabular_dim):
+    # writes a normal CNNTFMModel checkpoint; head-only trials get the backbone they were embedded with
+    trial = next(t for t in store.trials(name) if t["trial"] == best)
+    state = torch.load(trial["checkpoint"])["model"]
+    if args.head_only:
+        model = backbone_model(args.backbone, args.image_size, tabular_dim, args.weights, args.pretrained)
+        model.fc.load_state_dict({k[len("fc."):]: v for k, v in state.items()})
+        state = model.state_dict()
+    torch.save(state, args.output)
+    write_metadata(args.output, image_size=args.image_size, backbone=args.backbone, tabular_dim=tabular_dim,
+                   sweep={"name": name, "trial": best, "config": trial["config"], "val_loss": trial["val_loss"],
+                          "epochs": trial["epochs"], "head_only": args.head_only})
+    print(f"saved {args.output}")
+
+
+def report(path, name=None):
+    store = ResultsStore(path)
+    trials = sorted(store.trials(name), key=lambda t: (t["sweep"], -t["epochs"], t["val_loss"] or float('inf')))
+    print(f"{'sweep':<24} {'trial':>5} {'status':>9} {'epochs':>6} {'val loss':>9} {'val mae':>8}  config")
+    for t in trials:
+        loss = f"{t['val_loss']:.4f}" if t["val_loss"] is not None else "-"
+        mae = f"{t['val_mae']:.4f}" if t["val_mae"] is not None else "-"
+        config = " ".join(f"{k}={v:.3g}" if isinstance(v, float) else f"{k}={v}" for k, v in t["config"].items())
+        print(f"{t['sweep']:<24} {t['trial']:>5} {t['status']:>9} {t['epochs']:>6} {loss:>9} {mae:>8}  {config}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="parallel hyperparameter sweep with asha early stopping")
+    parser.add_argument("--trials", type=int, default=27)
+    parser.add_argument("--procs", type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    parser.add_argument("--min-epochs", type=int, default=1)
+    parser.add_argument("--max-epochs", type=int, default=9)
+    parser.add_argument("--eta", type=int, default=3, help="keep the top 1/eta of each rung")
+    parser.add_argument("--head-only", action="store_true", help="freeze the backbone and train on cached embeddings")
+    parser.add_argument("--weights", help="checkpoint whose backbone is frozen for --head-only (default: imagenet)")
+    parser.add_argument("--image-size", type=int, default=224)
+    parser.add_argument("--backbone", default="resnet18")
+    parser.add_argument("--no-pretrained", dest="pretrained", action="store_false")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--name", help="sweep name in the results store")
+    parser.add_argument("--sweep-dir", default="sweeps", help="results.db, trial checkpoints and the embedding cache")
+    parser.add_argument("--output", help="save the best trial as a regular checkpoint")
+    parser.add_argument("--report", action="store_true", help="print the results store and exit")
+    args = parser.parse_args()
+
+    if args.report:
+        report(os.path.join(args.sweep_dir, "results.db"), args.name)
+        return
+    sweep(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+script version of the training loop in model_colab.ipynb.
+
+    python model/training/train.py --image-size 112 --output best_model_112.pth
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.optim.lr_scheduler import ReduceLROnPlateau
+from torch.utils.data import DataLoader, random_split
+
+from dataset import CSV_PATH, IMAGE_DIR, RAW_CSV_PATH, WaterAccessDataset, make_transform
+from shards import ShardedTileDataset
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'backend')
+sys.path.insert(0, BACKEND_DIR)
+from fusion import BACKBONES, CNNTFMModel, fusion_head, read_metadata, write_metadata  # noqa: E402
+
+SPLIT_SEED = 42  # fixed so every run (and every resolution) validates on the same tiles
+
+
+# --- data ---
+def split_dataset(dataset, val_ratio=0.2, seed=SPLIT_SEED):
+    val_size = int(len(dataset) * val_ratio)
+    train_size = len(dataset) - val_size
+    return random_split(dataset, [train_size, val_size], generator=torch.Generator().manual_seed(seed))
+
+
+def make_loaders(image_size=224, batch_size=32, num_workers=2, csv_path=CSV_PATH, image_dir=IMAGE_DIR,
+                 scaler_params=None):
+    if scaler_params and csv_path == CSV_PATH:
+        csv_path = RAW_CSV_PATH  # normalize the raw table on the fly instead of reading the scaled copy
+    dataset = WaterAccessDataset(csv_path=csv_path, image_dir=image_dir, transform=make_transform(image_size),
+                                 scaler_params=scaler_params)
+    train_dataset, val_dataset = split_dataset(dataset)
+    print(f"train length: {len(train_dataset)}, validation length: {len(val_dataset)}")
+
+    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers)
+    val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    return dataset, train_loader, val_loader
+
+
+def make_shard_loaders(shard_dir, image_size=224, batch_size=32, num_workers=2, shuffle_buffer=2048):
+    # shards written by shards.py --split; shuffling happens inside the dataset
+    train_dataset = ShardedTileDataset(os.path.join(shard_dir, "train"), image_size, shuffle_buffer)
+    val_dataset = ShardedTileDataset(os.path.join(shard_dir, "val"), image_size, shuffle=False)
+    print(f"train length: {len(train_dataset)}, validation length: {len(val_dataset)}")
+
+    train_loader = DataLoader(train_dataset, batch_size=batch_size, num_workers=num_workers)
+    val_loader = DataLoader(val_dataset, batch_size=batch_size, num_workers=num_workers)
+    return train_dataset, train_loader, val_loader
+
+
+# --- evaluation ---
+def evaluate(model, loader, criterion=None, device="cpu"):
+    criterion = criterion or nn.HuberLoss(delta=1.0)
+    model.eval()
+    preds, labels = [], []
+    with torch.no_grad():
+        for (images, tabular), y in loader:
+            preds.append(model(images.to(device), tabular.to(device)).reshape(-1).cpu())
+            labels.append(y.reshape(-1))
+    preds, labels = torch.cat(preds), torch.cat(labels)
+
+    err = preds - labels
+    return {
+        "loss": float(criterion(preds, labels)),
+        "mae": float(err.abs().mean()),
+        "rmse": float(err.pow(2).mean().sqrt()),
+        "r2": float(1 - err.pow(2).sum() / (labels - labels.mean()).pow(2).sum()),
+    }
+
+
+# --- training loop ---
+def train(model, train_loader, val_loader, epochs=10, lr=1e-4, weight_decay=1e-4, delta=1.0,
+          device="cpu", output=None, log_every=0):
+    model.to(device)
+    criterion = nn.HuberLoss(delta=delta)
+    optimizer = optim.Adam(model.parameters(), lr=lr, weight_decay=weight_decay)
+    scheduler = ReduceLROnPlateau(optimizer, mode='min', patience=2, factor=0.5)
+
+    best = {"loss": float('inf')}
+    for epoch in range(epochs):
+        total_loss, batches = 0, 0  # batches seen; a sharded loader's len() counts every rank's rows
+        model.train()  # set model to training mode
+        if hasattr(train_loader.dataset, "set_epoch"):
+            train_loader.dataset.set_epoch(epoch)  # new shard order and shuffle per epoch
+        t0 = time.perf_counter()
+
+        for batch_idx, ((images, tabular), labels) in enumerate(train_loader):
+            images, tabular, labels = images.to(device), tabular.to(device), labels.to(device)
+
+            optimizer.zero_grad()
+            predictions = model(images, tabular).reshape(-1)
+            loss = criterion(predictions, labels)
+            loss.backward()
+            optimizer.step()
+
+            total_loss += loss.item()
+            batches += 1
+            if log_every and (batch_idx + 1) % log_every == 0:
+                print(f"epoch {epoch+1} | batch {batch_idx+1}/{len(train_loader)} | batch loss: {loss.item():.4f}")
+
+        # --- validation phase ---
+        val = evaluate(model, val_loader, criterion, device)
+        scheduler.step(val["loss"])
+        print(f"epoch {epoch+1}/{epochs} - train loss: {total_loss / max(batches, 1):.4f} "
+              f"- val loss: {val['loss']:.4f} - val mae: {val['mae']:.4f} ({time.perf_counter() - t0:.1f}s)")
+
+        # --- save best model ---
+        if val["loss"] < best["loss"]:
+            best = dict(val, epoch=epoch + 1)
+            if output:
+                torch.save(model.state_dict(), output)
+                print("new best model saved!")
+
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="train the cnn + tabular fusion model")
+    parser.add_argument("--image-size", type=int, default=224, help="224 (upsampled, original) or 112 (native tiles)")
+    parser.add_argument("--backbone", default="resnet18", choices=BACKBONES)
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--lr", type=float, default=1e-4)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--scaler-params", help="json from model/data/streaming_scaler.py, normalizes lazily")
+    parser.add_argument("--shards", help="directory from shards.py write --split, streams instead of pngs")
+    parser.add_argument("--output", default="best_model.pth")
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if args.shards:
+        dataset, train_loader, val_loader = make_shard_loaders(args.shards, args.image_size, args.batch_size,
+                                                               args.workers)
+        tabular_dim = len(dataset.index["tabular_columns"])
+    else:
+        dataset, train_loader, val_loader = make_loaders(args.image_size, args.batch_size, args.workers,
+                                                         scaler_params=args.scaler_params)
+        tabular_dim = dataset[0][0][1].shape[0]  # length of the feature vector
+    model = CNNTFMModel(tabular_dim=tabular_dim, pretrained=args.backbone != "small_cnn",
+                        image_size=args.image_size, backbone=args.backbone)
+    best = train(model, train_loader, val_loader, epochs=args.epochs, lr=args.lr, device=device,
+                 output=args.output, log_every=10)
+
+    write_metadata(args.output, image_size=args.image_size, backbone=args.backbone,
+                   tabular_dim=tabular_dim, val=best)
+    print(f"training completed, best val loss {best['loss']:.4f} at epoch {best['epoch']}")
+
+
+if __name__ == "__main__":
+    main()
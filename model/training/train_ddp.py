@@ -0,0 +1,186 @@
+"""
+cpu data-parallel training: N local processes, DistributedDataParallel over gloo.
+
+each rank is pinned to its own slice of cores with a matching torch thread count,
+reads its shard of the training split through a DistributedSampler, and only rank 0
+writes checkpoints.
+
+    python model/training/train_ddp.py --procs 4 --image-size 112 --output best_model_ddp.pth
+    python model/training/train_ddp.py --scaling 1,2,4,8 --steps 20   # samples/sec vs process count
+"""
+import argparse
+import json
+import os
+import socket
+import time
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn as nn
+import torch.optim as optim
+from torch.nn.parallel import DistributedDataParallel
+from torch.optim.lr_scheduler import ReduceLROnPlateau
+from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
+
+from dataset import WaterAccessDataset, make_transform
+from train import CNNTFMModel, split_dataset, write_metadata
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def pin_cores(rank, world_size):
+    # contiguous, non-overlapping core slices so ranks don't fight over the same cores
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    per_rank = max(1, len(cores) // world_size)
+    mine = cores[rank * per_rank:(rank + 1) * per_rank] or cores[-per_rank:]
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, mine)
+    torch.set_num_threads(len(mine))
+    torch.set_num_interop_threads(1)
+    return mine
+
+
+def all_reduce_sum(*values):
+    tensor = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor.tolist()
+
+
+def evaluate(model, loader, criterion):
+    # each rank scores its shard; sums are reduced so every rank sees the same val loss
+    model.eval()
+    loss_sum, abs_sum, count = 0.0, 0.0, 0
+    with torch.no_grad():
+        for (images, tabular), labels in loader:
+            preds = model(images, tabular).reshape(-1)
+            loss_sum += criterion(preds, labels).item() * len(labels)
+            abs_sum += (preds - labels).abs().sum().item()
+            count += len(labels)
+    loss_sum, abs_sum, count = all_reduce_sum(loss_sum, abs_sum, count)
+    return {"loss": loss_sum / count, "mae": abs_sum / count}
+
+
+def run(rank, world_size, port, args, results):
+    dist.init_process_group("gloo", init_method=f"tcp://127.0.0.1:{port}", rank=rank, world_size=world_size)
+    cores = pin_cores(rank, world_size)
+    torch.manual_seed(args.seed)  # same initial weights on every rank (DDP also broadcasts them)
+
+    dataset = WaterAccessDataset(transform=make_transform(args.image_size))
+    train_split, val_split = split_dataset(dataset)
+    train_sampler = DistributedSampler(train_split, world_size, rank, shuffle=True, seed=args.seed)
+    val_sampler = DistributedSampler(val_split, world_size, rank, shuffle=False)
+    train_loader = DataLoader(train_split, batch_size=args.batch_size, sampler=train_sampler,
+                              num_workers=args.workers, persistent_workers=args.workers > 0)
+    val_loader = DataLoader(val_split, batch_size=args.batch_size, sampler=val_sampler, num_workers=args.workers)
+
+    tabular_dim = dataset[0][0][1].shape[0]
+    model = CNNTFMModel(tabular_dim=tabular_dim, pretrained=args.pretrained, image_size=args.image_size,
+                        backbone=args.backbone)
+    ddp_model = DistributedDataParallel(model)
+
+    criterion = nn.HuberLoss(delta=1.0)
+    lr = args.lr * world_size if args.scale_lr else args.lr
+    optimizer = optim.Adam(ddp_model.parameters(), lr=lr, weight_decay=1e-4)
+    scheduler = ReduceLROnPlateau(optimizer, mode='min', patience=2, factor=0.5)
+
+    if rank == 0:
+        print(f"world size {world_size}, {len(cores)} cores per rank, "
+              f"{len(train_sampler)} train samples per rank, lr {lr:g}")
+
+    best_loss = float('inf')
+    history = []
+    for epoch in range(args.epochs):
+        train_sampler.set_epoch(epoch)
+        ddp_model.train()
+        dist.barrier()
+        t0 = time.perf_counter()
+        seen, total_loss, steps = 0, 0.0, 0
+
+        for (images, tabular), labels in train_loader:
+            optimizer.zero_grad()
+            loss = criterion(ddp_model(images, tabular).reshape(-1), labels)
+            loss.backward()  # gradients are all-reduced across ranks here
+            optimizer.step()
+            seen += len(labels)
+            total_loss += loss.item()
+            steps += 1
+            if args.steps and steps >= args.steps:
+                break
+
+        dist.barrier()
+        elapsed = time.perf_counter() - t0
+        seen_all, loss_all, steps_all = all_reduce_sum(seen, total_loss, steps)
+        epoch_stats = {"epoch": epoch + 1, "samples_per_s": seen_all / elapsed, "train_loss": loss_all / steps_all}
+
+        if not args.steps:
+            val = evaluate(ddp_model, val_loader, criterion)
+            scheduler.step(val["loss"])
+            epoch_stats.update(val_loss=val["loss"], val_mae=val["mae"])
+            if rank == 0 and val["loss"] < best_loss:
+                best_loss = val["loss"]
+                torch.save(model.state_dict(), args.output)
+                write_metadata(args.output, image_size=args.image_size, backbone=args.backbone,
+                               tabular_dim=tabular_dim, val=dict(val, epoch=epoch + 1), world_size=world_size)
+
+        history.append(epoch_stats)
+        if rank == 0:
+            print(" - ".join(f"{k}: {v:.4f}" if isinstance(v, float) else f"{k}: {v}" for k, v in epoch_stats.items()))
+
+    if rank == 0 and results is not None:
+        results.put(history)
+    dist.destroy_process_group()
+
+
+def launch(world_size, args):
+    results = mp.get_context("spawn").SimpleQueue()
+    mp.spawn(run, args=(world_size, free_port(), args, results), nprocs=world_size, join=True)
+    return results.get()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="multi-process cpu training with DDP over gloo")
+    parser.add_argument("--procs", type=int, default=max(1, (os.cpu_count() or 1) // 4))
+    parser.add_argument("--scaling", help="comma separated process counts; prints samples/sec per count")
+    parser.add_argument("--steps", type=int, default=0, help="cap steps per epoch (benchmarking)")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32, help="per rank")
+    parser.add_argument("--lr", type=float, default=1e-4)
+    parser.add_argument("--scale-lr", action="store_true", help="multiply lr by the number of processes")
+    parser.add_argument("--image-size", type=int, default=224)
+    parser.add_argument("--backbone", default="resnet18")
+    parser.add_argument("--no-pretrained", dest="pretrained", action="store_false")
+    parser.add_argument("--workers", type=int, default=1, help="dataloader workers per rank")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="best_model.pth")
+    args = parser.parse_args()
+
+    if not args.scaling:
+        launch(args.procs, args)
+        return
+
+    # --- scaling curve ---
+    if not args.steps:
+        args.steps = 20
+    args.epochs = min(args.epochs, 2)  # the first epoch absorbs startup, the last one is reported
+    curve = []
+    for procs in [int(p) for p in args.scaling.split(",")]:
+        history = launch(procs, args)
+        curve.append({"procs": procs, "samples_per_s": history[-1]["samples_per_s"]})
+        print(f"{procs} procs: {curve[-1]['samples_per_s']:.1f} samples/s")
+
+    base = curve[0]["samples_per_s"] / curve[0]["procs"]
+    for point in curve:
+        point["efficiency"] = point["samples_per_s"] / (base * point["procs"])
+    with open("ddp_scaling.json", "w") as f:
+        json.dump(curve, f, indent=2)
+    print(json.dumps(curve, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+"""
+incremental runner for the data -> model -> map layer chain that used to be run by hand:
+
+    filter_data -> ee_export -> convert_png ---------> train -> fold_scalers
+                            \\-> clean_features ----/       \\-> predict -> export_tiles
+
+every stage declares its inputs, outputs and code; artifacts are fingerprinted by
+content (sha256, with a size/mtime cache so unchanged files aren't re-read). a stage
+runs only when the fingerprint of its inputs differs from its last successful run or
+its outputs are missing or were edited. convert_png and predict also track tiles, so
+only tiles whose own inputs changed are redone. stages whose dependencies are done
+run in parallel, and every run's per-stage wall time is appended to the run log.
+
+    python pipeline/run_pipeline.py                  # bring everything up to date
+    python pipeline/run_pipeline.py --dry-run        # what would run, and why
+    python pipeline/run_pipeline.py --only convert_png,clean_features --force clean_features
+    python pipeline/run_pipeline.py --accept ee_export   # after re-running the earth engine export by hand
+
+ee_export is manual (earth engine tasks plus a drive download): the runner never starts
+it, only warns when its inputs changed since its outputs were accepted.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATE_DIR = os.path.join("pipeline", ".cache")
+STOPPED = ("failed", "blocked", "stale", "skipped")  # statuses whose dependents are skipped, not evaluated
+
+
+# --------------------------
+# content fingerprints
+# --------------------------
+class Hasher:
+    # sha256 per file, cached by (size, mtime_ns) so a second pass only stats
+    def __init__(self, root, cache):
+        self.root = root
+        self.cache = cache
+
+    def file(self, rel):
+        path = os.path.join(self.root, rel)
+        st = os.stat(path)
+        cached = self.cache.get(rel)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        self.cache[rel] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+        return h.hexdigest()
+
+    def paths(self, patterns):
+        # {relative path: sha256}; a pattern matching nothing maps to None
+        out = {}
+        for pattern in patterns:
+            matches = sorted(glob.glob(os.path.join(self.root, pattern)))
+            matches = [m for m in matches if os.path.isfile(m)]
+            if not matches:
+                out[pattern] = None
+            for match in matches:
+                rel = os.path.relpath(match, self.root)
+                out[rel] = self.file(rel)
+        return out
+
+
+def digest(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+# --------------------------
+# stages
+# --------------------------
+class Stage:
+    def __init__(self, name, run=None, deps=(), inputs=(), outputs=(), code=(), params=None, manual=None):
+        self.name = name
+        self.run = run
+        self.deps = list(deps)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.code = list(code)
+        self.params = params or {}
+        self.manual = manual  # instructions for stages the runner cannot execute
+
+
+class Context:
+    # what a stage function gets: paths, its previous record (for per-tile state) and the hasher
+    def __init__(self, root, stage, previous, hasher, code_key, jobs):
+        self.root = root
+        self.stage = stage
+        self.previous = previous or {}
+        self.hasher = hasher
+        self.code_key = code_key
+        self.jobs = jobs
+
+    def path(self, rel):
+        return os.path.join(self.root, rel)
+
+
+def run_script(ctx, script, *args):
+    # the existing scripts use paths relative to their own directory, so run them from there
+    cwd = ctx.path(os.path.dirname(script))
+    subprocess.run([sys.executable, os.path.basename(script), *map(str, args)], cwd=cwd, check=True)
+
+
+def filter_data(ctx):
+    run_script(ctx, "model/data/filter_data.py")
+
+
+def convert_png(ctx):
+    sys.path.insert(0, ctx.path("model/earth_engine"))
+    from convert_png import convert_tif
+
+    previous = ctx.previous.get("tiles", {})
+    tifs = {rel: h for rel, h in ctx.hasher.paths(["model/earth_engine/exports/*.tif"]).items() if h}
+    png_dir = ctx.path("model/earth_engine/converted_png")
+    os.makedirs(png_dir, exist_ok=True)
+
+    def png_path(tif):
+        return os.path.join(png_dir, os.path.basename(tif)[:-len(".tif")] + ".png")
+
+    tiles = {tif: digest(h, ctx.code_key) for tif, h in tifs.items()}
+    todo = [tif for tif, key in tiles.items() if previous.get(tif) != key or not os.path.exists(png_path(tif))]
+    with ThreadPoolExecutor(ctx.jobs) as pool:
+        list(pool.map(lambda tif: convert_tif(ctx.path(tif), png_path(tif)), todo))
+    removed = [tif for tif in previous if tif not in tiles]
+    for tif in removed:
+        if os.path.exists(png_path(tif)):
+            os.remove(png_path(tif))
+    return {"tiles": tiles, "tiles_total": len(tiles), "tiles_changed": len(todo), "tiles_removed": len(removed)}
+
+
+def clean_features(ctx):
+    # streaming_scaler fits the StandardScaler parameters chunk by chunk; train.py and
+    # fold_scalers.py apply them from the json, so no scaled copy of the table is written
+    sys.path.insert(0, ctx.path("model/data"))
+    import streaming_scaler
+
+    feature_norm, score_norm, rows = streaming_scaler.fit(ctx.path("model/data/tile_features.csv"))
+    streaming_scaler.save(ctx.path("model/data/scaler_params.json"), feature_norm, score_norm, rows)
+    return {"rows": rows}
+
+
+def train(ctx):
+    p = ctx.stage.params
+    os.makedirs(ctx.path("backend/model"), exist_ok=True)
+    run_script(ctx, "model/training/train.py", "--image-size", p["image_size"], "--backbone", p["backbone"],
+               "--epochs", p["epochs"], "--scaler-params", ctx.path("model/data/scaler_params.json"),
+               "--output", ctx.path("backend/model/best_model.pth"))
+
+
+def fold_scalers(ctx):
+    run_script(ctx, "backend/fold_scalers.py", ctx.path("backend/model/best_model.pth"),
+               ctx.path("backend/model/best_model_folded.pth"),
+               "--scaler-params", ctx.path("model/data/scaler_params.json"))
+
+
+def predict(ctx):
+    # scores every tile into a ScoreGrid (SCORE_GRID_PATH) and a csv; tiles whose image,
+    # features and model are all unchanged keep their previous score
+    sys.path.insert(0, ctx.path("backend"))
+    import numpy as np
+    import pandas as pd
+    from adaptive_scoring import TABULAR_FEATURES, FeatureLayers, score_cells
+    from fusion import load_scoring_model
+    from preprocess import Preprocessor
+    from score_grid import ScoreGrid
+
+    model_key = digest(ctx.hasher.paths(["backend/model/best_model.pth", "backend/model/best_model.json",
+                                         "model/data/scaler_params.json"]), ctx.code_key)
+    layers = FeatureLayers.from_tiles(ctx.path("model/data/tile_features.csv"),
+                                      ctx.path("model/earth_engine/converted_png"))
+    cells = sorted(layers.image_paths)
+    keys = [digest(ctx.hasher.file(os.path.relpath(layers.image_paths[cell], ctx.root)),
+                   layers.features[cell].tolist(), model_key) for cell in cells]
+
+    csv_out = ctx.path("model/predictions.csv")
+    previous = {}
+    if os.path.exists(csv_out):
+        old = pd.read_csv(csv_out)
+        previous = dict(zip(old["input_hash"], old["score"]))
+    todo = [i for i, key in enumerate(keys) if key not in previous]
+
+    scores = np.array([previous.get(key, np.nan) for key in keys], dtype=np.float32)
+    if todo:
+        model, _ = load_scoring_model(ctx.path("backend/model/best_model.pth"), len(TABULAR_FEATURES),
+                                      scaler_params=ctx.path("model/data/scaler_params.json"))
+        rows = np.array([cells[i][0] for i in todo])
+        cols = np.array([cells[i][1] for i in todo])
+        scores[todo] = score_cells(model, Preprocessor(image_size=model.image_size), layers, 1, rows, cols)
+
+    rows, cols = np.array(cells).T
+    lon, lat = layers.grid.cell_centers(rows, cols)
+    tile_ids = [os.path.basename(layers.image_paths[cell])[len("sentinel2_"):-len(".png")] for cell in cells]
+    pd.DataFrame({"tile_id": tile_ids, "lon": lon, "lat": lat, "score": scores, "input_hash": keys}).to_csv(
+        csv_out, index=False)
+    grid = ScoreGrid([layers.grid.west, layers.grid.south, layers.grid.east, layers.grid.north], layers.grid.cell_size)
+    grid.set_scores(lon, lat, scores)
+    grid.save(ctx.path("backend/score_grid.npz"))
+    return {"tiles_total": len(cells), "tiles_changed": len(todo)}
+
+
+def export_tiles(ctx):
+    # streams the scored tiles to FlatGeobuf for the map, a csv chunk at a time
+    sys.path.insert(0, ctx.path("backend"))
+    from score_grid import ScoreGrid
+    from tile_writer import batches_from_csv, open_writer
+
+    grid = ScoreGrid()
+    with open_writer(ctx.path("model/predictions.fgb"), grid, precision=6) as writer:
+        for batch in batches_from_csv(ctx.path("model/predictions.csv"), grid):
+            writer.write(*batch)
+    return {"tiles_written": writer.count}
+
+
+def build_stages(args):
+    return [
+        Stage("filter_data", filter_data,
+              inputs=["model/data/raw.csv"], outputs=["model/data/raw_full.csv"],
+              code=["model/data/filter_data.py"]),
+        Stage("ee_export", deps=["filter_data"],
+              inputs=["model/data/raw_full.csv"],
+              outputs=["model/data/tile_features.csv", "model/earth_engine/exports/*.tif"],
+              code=["model/earth_engine/tiles/export_all.py"],
+              manual="upload the filtered water points as the ee asset, run model/earth_engine/tiles/export_all.py "
+                     "(fetches through the local ee cache), then --accept ee_export"),
+        Stage("convert_png", convert_png, deps=["ee_export"],
+              inputs=["model/earth_engine/exports/*.tif"], outputs=["model/earth_engine/converted_png/*.png"],
+              code=["model/earth_engine/convert_png.py"]),
+        Stage("clean_features", clean_features, deps=["ee_export"],
+              inputs=["model/data/tile_features.csv"],
+              outputs=["model/data/scaler_params.json"],
+              code=["model/data/streaming_scaler.py"]),
+        Stage("train", train, deps=["convert_png", "clean_features"],
+              inputs=["model/data/tile_features.csv", "model/data/scaler_params.json",
+                      "model/earth_engine/converted_png/*.png"],
+              outputs=["backend/model/best_model.pth", "backend/model/best_model.json"],
+              code=["model/training/train.py", "model/training/dataset.py", "model/data/streaming_scaler.py",
+                    "backend/fusion.py"],
+              params={"image_size": args.image_size, "backbone": args.backbone, "epochs": args.epochs}),
+        Stage("fold_scalers", fold_scalers, deps=["train"],
+              inputs=["backend/model/best_model.pth", "model/data/scaler_params.json"],
+              outputs=["backend/model/best_model_folded.pth", "backend/model/best_model_folded.json"],
+              code=["backend/fold_scalers.py"]),
+        Stage("predict", predict, deps=["train"],
+              inputs=["backend/model/best_model.pth", "model/data/scaler_params.json", "model/data/tile_features.csv",
+                      "model/earth_engine/converted_png/*.png"],
+              outputs=["model/predictions.csv", "backend/score_grid.npz"],
+              code=["backend/adaptive_scoring.py", "backend/preprocess.py", "backend/fusion.py"]),
+        Stage("export_tiles", export_tiles, deps=["predict"],
+              inputs=["model/predictions.csv"], outputs=["model/predictions.fgb"],
+              code=["backend/tile_writer.py", "backend/score_grid.py"]),
+    ]
+
+
+# --------------------------
+# runner
+# --------------------------
+class Pipeline:
+    def __init__(self, stages, root=ROOT, jobs=4):
+        self.stages = {stage.name: stage for stage in stages}
+        self.root = root
+        self.jobs = jobs
+        self.state_dir = os.path.join(root, STATE_DIR)
+        self.state_path = os.path.join(self.state_dir, "state.json")
+        self.state = {"stages": {}, "hashes": {}}
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                self.state = json.load(f)
+        self.hasher = Hasher(root, self.state["hashes"])
+
+    def save(self):
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as f:  # stage threads may be adding hashes meanwhile, so dump a copy
+            json.dump({"stages": dict(self.state["stages"]), "hashes": self.hasher.cache.copy()}, f)
+        os.replace(tmp, self.state_path)
+
+    def fingerprint(self, stage):
+        inputs = self.hasher.paths(stage.inputs)
+        code_key = digest(self.hasher.paths(stage.code))
+        outputs = self.hasher.paths(stage.outputs)
+        return inputs, code_key, digest(inputs, code_key, stage.params), outputs
+
+    def evaluate(self, stage, force, dry_run, accept):
+        # returns (status, reason, record or None); runs the stage when it is stale
+        inputs, code_key, key, outputs = self.fingerprint(stage)
+        previous = self.state["stages"].get(stage.name)
+        missing_in = [p for p, h in inputs.items() if h is None]
+        missing_out = [p for p, h in outputs.items() if h is None]
+        outputs_key = digest(outputs)
+
+        if stage.manual:
+            if missing_out:
+                return "blocked", f"outputs missing: {', '.join(missing_out)}; {stage.manual}", None
+            record = {"inputs": key, "outputs": outputs_key, "seconds": 0.0, "finished_at": time.time()}
+            if previous is None or accept:
+                return "accepted", "outputs recorded as they are", record
+            if previous["inputs"] != key:
+                return "stale", f"inputs changed since the outputs were accepted; {stage.manual}", None
+            if previous["outputs"] != outputs_key:
+                return "accepted", "outputs changed (new manual export)", record
+            return "cached", "", None
+
+        if previous and previous["inputs"] == key and previous["outputs"] == outputs_key and not force:
+            return "cached", "", None
+        reason = ("forced" if force else "never ran" if not previous else
+                  "inputs changed" if previous["inputs"] != key else
+                  "outputs missing" if missing_out else "outputs changed")
+        if missing_in:
+            if missing_out:
+                return "blocked", f"inputs missing: {', '.join(missing_in)}", None
+            return "kept", f"inputs missing ({', '.join(missing_in)}), keeping existing outputs", None
+        if dry_run:
+            return "would run", reason, None
+
+        ctx = Context(self.root, stage, previous, self.hasher, code_key, self.jobs)
+        t0 = time.perf_counter()
+        extra = stage.run(ctx) or {}
+        seconds = time.perf_counter() - t0
+        outputs = self.hasher.paths(stage.outputs)
+        return "ran", reason, dict(extra, inputs=key, outputs=digest(outputs), seconds=seconds, finished_at=time.time())
+
+    def run(self, only=None, force=(), dry_run=False, accept=()):
+        order = self.stages if not only else {n: s for n, s in self.stages.items() if n in only}
+        results, running = {}, {}
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(self.jobs) as pool:
+            while len(results) < len(order):
+                for name, stage in order.items():
+                    if name in results or name in running:
+                        continue
+                    deps = [d for d in stage.deps if d in order]
+                    stopped = [d for d in deps if results.get(d, {}).get("status") in STOPPED]
+                    if stopped:
+                        reason = "upstream " + ", ".join(f"{d} {results[d]['status']}" for d in stopped)
+                        results[name] = {"status": "skipped", "reason": reason, "seconds": 0.0}
+                    elif dry_run and any(results.get(d, {}).get("status") == "would run" for d in deps):
+                        upstream = [d for d in deps if results.get(d, {}).get("status") == "would run"]
+                        results[name] = {"status": "would run", "reason": f"after {', '.join(upstream)}",
+                                         "seconds": 0.0}
+                    elif all(d in results for d in deps):
+                        running[name] = pool.submit(self.evaluate, stage, name in force, dry_run, name in accept)
+                if not running:
+                    continue
+
+                done, _ = wait(running.values(), return_when=FIRST_COMPLETED)
+                for name in [n for n, f in running.items() if f in done]:
+                    future = running.pop(name)
+                    try:
+                        status, reason, record = future.result()
+                    except Exception as e:  # recorded, dependents are skipped, the rest of the dag continues
+                        status, reason, record = "failed", f"{type(e).__name__}: {e}", None
+                    if record is not None and not dry_run:
+                        previous = self.state["stages"].get(name, {})
+                        self.state["stages"][name] = dict(record, runs=previous.get("runs", 0) + (status == "ran"))
+                        self.save()
+                    results[name] = {"status": status, "reason": reason,
+                                     "seconds": record["seconds"] if record else 0.0,
+                                     **{k: v for k, v in (record or {}).items() if k.startswith("tiles_")}}
+                    print(f"{name}: {status}" + (f" ({reason})" if reason else ""), flush=True)
+
+        run = {"started_at": time.time(), "seconds": time.perf_counter() - t0, "dry_run": dry_run,
+               "stages": {name: results[name] for name in order}}
+        if not dry_run:  # a dry run leaves pipeline/.cache untouched
+            self.save()
+            with open(os.path.join(self.state_dir, "runs.jsonl"), "a") as f:
+                f.write(json.dumps(run) + "\n")
+        return run
+
+
+def print_run(run):
+    print(f"\n{'stage':<16} {'status':<10} {'seconds':>8} {'tiles':>13}  reason")
+    for name, r in run["stages"].items():
+        tiles = f"{r['tiles_changed']}/{r['tiles_total']}" if "tiles_total" in r else ""
+        print(f"{name:<16} {r['status']:<10} {r['seconds']:>8.1f} {tiles:>13}  {r['reason']}")
+    print(f"total {run['seconds']:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="incremental data -> model -> map layer pipeline")
+    parser.add_argument("--root", default=ROOT, help="repository checkout to run in")
+    parser.add_argument("--only", help="comma separated stages (their dependencies are not run)")
+    parser.add_argument("--force", default="", help="comma separated stages to re-run regardless")
+    parser.add_argument("--accept", default="", help="record the current outputs of manual stages")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="parallel stages / tile workers")
+    parser.add_argument("--image-size", type=int, default=224)
+    parser.add_argument("--backbone", default="resnet18")
+    parser.add_argument("--epochs", type=int, default=10)
+    args = parser.parse_args()
+
+    pipeline = Pipeline(build_stages(args), root=os.path.abspath(args.root), jobs=args.jobs)
+    split = lambda value: {s.strip() for s in value.split(",") if s.strip()}
+    unknown = (split(args.only or "") | split(args.force) | split(args.accept)) - set(pipeline.stages)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    print_run(pipeline.run(split(args.only) if args.only else None, split(args.force), args.dry_run,
+                           split(args.accept)))
+
+
+if __name__ == "__main__":
+    main()
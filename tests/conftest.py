@@ -0,0 +1,43 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the backend and model scripts import their siblings by module name
+sys.path[:0] = [os.path.join(ROOT, "backend"), os.path.join(ROOT, "model", "training"),
+                os.path.join(ROOT, "model", "earth_engine"), os.path.join(ROOT, "model", "data"),
+                os.path.join(ROOT, "pipeline")]
+
+
+@pytest.fixture(scope="session")
+def tile_data(tmp_path_factory):
+    # a small tile_features.csv (earth engine export layout) and its png tiles in the top-left
+    # corner of the default roi grid: rows 0-7, cols 0-23. returns (csv path, image dir)
+    from adaptive_scoring import TABULAR_FEATURES
+    from score_grid import ScoreGrid
+
+    grid = ScoreGrid()
+    rng = np.random.default_rng(0)
+    tmp_path = tmp_path_factory.mktemp("tiles")
+    image_dir = tmp_path / "png"
+    image_dir.mkdir()
+    records = []
+    for i, (row, col) in enumerate((r, c) for r in range(8) for c in range(24)):
+        west, north = grid.west + col * grid.cell_size, grid.north - row * grid.cell_size
+        south, east = north - grid.cell_size, west + grid.cell_size
+        ring = [[west, south], [east, south], [east, north], [west, north], [west, south]]
+        record = {"tile_id": f"tile_{i}", "score": float(rng.normal(1.0, 0.3)),
+                  ".geo": json.dumps({"type": "Polygon", "coordinates": [ring]})}
+        record.update({name: float(rng.normal(100.0, 20.0)) for name in TABULAR_FEATURES})
+        record["land_cover_class"] = float(rng.choice([10, 20, 30]))
+        records.append(record)
+        pixels = rng.integers(0, 256, (112, 112, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(image_dir / f"sentinel2_tile_{i}.png")
+    csv_path = tmp_path / "tile_features.csv"
+    pd.DataFrame(records).to_csv(csv_path, index=False)
+    return str(csv_path), str(image_dir)
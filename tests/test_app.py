@@ -0,0 +1,241 @@
+"""
+/predict/ against the original serving path (torchvision transforms, sklearn scalers applied
+outside the model), /predict by tile id or point against the upload, and request validation.
+app.py loads its model, grid and feature store at import, so it is imported once per module
+with a random small_cnn checkpoint.
+"""
+import importlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+import torch
+from PIL import Image
+from torchvision import transforms
+
+from adaptive_scoring import TABULAR_FEATURES
+from fusion import CNNTFMModel, write_metadata
+
+BACKEND = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+IMAGE_SIZE = 112
+MODEL_VERSION = "model"  # the served checkpoint's file name
+
+
+def save_checkpoint(path, seed):
+    torch.manual_seed(seed)
+    torch.save(CNNTFMModel(len(TABULAR_FEATURES), image_size=IMAGE_SIZE, backbone="small_cnn").state_dict(), path)
+    write_metadata(path, image_size=IMAGE_SIZE, backbone="small_cnn", tabular_dim=len(TABULAR_FEATURES))
+    return path
+
+
+@pytest.fixture(scope="module")
+def served(tile_data, tmp_path_factory):
+    from feature_store import build
+    from score_grid import ScoreGrid
+
+    csv_path, image_dir = tile_data
+    tmp = tmp_path_factory.mktemp("app")
+    model_path = save_checkpoint(str(tmp / "model.pth"), seed=0)
+    build(str(tmp / "store"), image_size=IMAGE_SIZE, features=csv_path, image_dir=image_dir)
+    grid = ScoreGrid()
+    grid.scores[:8, :24] = 1.0
+    grid.save(str(tmp / "grid.npz"))
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(BACKEND)  # the scaler paths are relative to backend/
+        mp.setenv("MODEL_PATH", model_path)
+        mp.setenv("FEATURE_STORE_PATH", str(tmp / "store"))
+        mp.setenv("SCORE_GRID_PATH", str(tmp / "grid.npz"))
+        mp.setenv("WATER_POINTS_PATH", str(tmp / "missing.csv"))
+        sys.modules.pop("app", None)
+        app = importlib.import_module("app")
+        yield app, model_path, pd.read_csv(csv_path), image_dir
+
+
+def baseline_score(model_path, image, features):
+    # the pre-registry /predict/: torchvision transform, scaler.transform, model, inverse_transform
+    feature_scaler = joblib.load(os.path.join(BACKEND, "scalers", "feature_scaler.pkl"))
+    score_scaler = joblib.load(os.path.join(BACKEND, "scalers", "score_scaler.pkl"))
+    model = CNNTFMModel(len(TABULAR_FEATURES), image_size=IMAGE_SIZE, backbone="small_cnn")
+    model.load_state_dict(torch.load(model_path, map_location="cpu"))
+    transform = transforms.Compose([
+        transforms.Resize((IMAGE_SIZE, IMAGE_SIZE)),
+        transforms.ToTensor(),
+        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+    ])
+    vector = np.array([[features[name] for name in TABULAR_FEATURES]], dtype=np.float32)
+    tabular = torch.from_numpy(feature_scaler.transform(pd.DataFrame(vector, columns=TABULAR_FEATURES))).float()
+    with torch.no_grad():
+        pred = model.eval()(transform(image.convert("RGB")).unsqueeze(0), tabular).item()
+    return float(score_scaler.inverse_transform([[pred]])[0][0])
+
+
+def upload(client, image, features, fmt="PNG", headers=None):
+    buf = io.BytesIO()
+    image.save(buf, format=fmt)
+    buf.seek(0)
+    return client.post("/predict/", data={"image": (buf, f"tile.{fmt.lower()}"), "features": json.dumps(features)},
+                       content_type="multipart/form-data", headers=headers)
+
+
+@pytest.mark.parametrize("size, fmt", [((112, 112), "PNG"), ((150, 130), "PNG"), ((300, 260), "JPEG")])
+def test_predict_upload_matches_baseline(served, size, fmt):
+    app, model_path, tiles, image_dir = served
+    row = tiles.iloc[3]
+    image = Image.open(os.path.join(image_dir, f"sentinel2_{row['tile_id']}.png")).convert("RGB").resize(size)
+    if fmt == "JPEG":  # what the server decodes, so draft mode is part of the comparison
+        buf = io.BytesIO()
+        image.save(buf, format=fmt)
+        image = Image.open(buf)
+        image.draft("RGB", (IMAGE_SIZE, IMAGE_SIZE))
+    features = {name: float(row[name]) for name in TABULAR_FEATURES}
+
+    response = upload(app.app.test_client(), image, features, fmt)
+    assert response.status_code == 200
+    assert response.json["predicted_score"] == pytest.approx(baseline_score(model_path, image, features), abs=1e-4)
+
+
+def test_predict_stored_matches_upload(served):
+    app, _, tiles, image_dir = served
+    client = app.app.test_client()
+    rows = tiles.iloc[[0, 17, 95]]
+    expected = {}
+    for _, row in rows.iterrows():
+        image = Image.open(os.path.join(image_dir, f"sentinel2_{row['tile_id']}.png"))
+        features = {name: float(row[name]) for name in TABULAR_FEATURES}
+        expected[row["tile_id"]] = upload(client, image, features).json["predicted_score"]
+
+    by_id = client.post("/predict", json={"tile_ids": list(expected) + ["tile_missing"]}).json
+    assert by_id["missing"] == ["tile_missing"]
+    assert {p["tile_id"]: p["predicted_score"] for p in by_id["predictions"]} == pytest.approx(expected, abs=1e-5)
+
+    first = by_id["predictions"][0]
+    by_point = client.get(f"/predict?lat={first['lat']}&lon={first['lon']}").json
+    assert by_point["predictions"][0]["tile_id"] == first["tile_id"]
+    assert by_point["predictions"][0]["predicted_score"] == pytest.approx(first["predicted_score"], abs=1e-5)
+
+
+@pytest.mark.parametrize("body", [[1, 2], {"type": "FeatureCollection", "features": [1]}, "polygon"])
+def test_aggregate_rejects_non_objects(served, body):
+    app = served[0]
+    assert app.app.test_client().post("/aggregate", json=body).status_code == 400
+
+
+@pytest.mark.parametrize("query", ["lat=nan&lon=32", "lat=1&lon=inf", "lat=91&lon=32", "lat=1&lon=-181"])
+def test_bad_coordinates_rejected(served, query):
+    client = served[0].app.test_client()
+    assert client.get(f"/score?{query}").status_code == 400
+    assert client.get(f"/predict?{query}").status_code == 400
+
+
+def test_profiling_needs_admin_token(served, monkeypatch):
+    app = served[0]
+    client = app.app.test_client()
+    trace_dir = app.profiler.trace_dir
+    assert client.post("/debug/profiling", json={"sample_rate": 0.5}).status_code == 403  # disabled by default
+
+    monkeypatch.setattr(app, "ADMIN_TOKEN", "secret")
+    assert client.post("/debug/profiling", json={"sample_rate": 0.5},
+                       headers={"Authorization": "Bearer wrong"}).status_code == 401
+    response = client.post("/debug/profiling", json={"sample_rate": 0.5, "trace_dir": "/tmp/elsewhere"},
+                           headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
+    assert response.json["sample_rate"] == 0.5 and response.json["trace_dir"] == trace_dir
+    app.profiler.configure(sample_rate=0.0)
+
+
+class Gated(torch.nn.Module):
+    # holds every forward pass until released, so a request can be kept in flight
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+        self.started, self.release = threading.Event(), threading.Event()
+
+    def forward(self, *inputs):
+        self.started.set()
+        assert self.release.wait(timeout=30)
+        return self.model(*inputs)
+
+
+@pytest.fixture
+def second_version(served, tmp_path):
+    # another resident version, "other", loaded through the registry's desired state
+    app, _, tiles, image_dir = served
+    app.models.add("other", save_checkpoint(str(tmp_path / "other.pth"), seed=1))
+    deadline = time.time() + 30
+    while "other" not in app.models.versions:
+        assert time.time() < deadline, app.models.loading
+        time.sleep(0.01)
+    row = tiles.iloc[5]
+    image = Image.open(os.path.join(image_dir, f"sentinel2_{row['tile_id']}.png"))
+    yield app, image, {name: float(row[name]) for name in TABULAR_FEATURES}
+    app.models.set_shadow(None)
+    app.models.set_default(MODEL_VERSION)
+    app.models.unload("other")
+
+
+def test_default_swap_keeps_in_flight_requests(second_version):
+    app, image, features = second_version
+    client = app.app.test_client()
+    before = upload(client, image, features).json
+    assert before["model_version"] == MODEL_VERSION
+
+    current = app.models.get()
+    gated = current.model = Gated(current.model)
+    try:
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            in_flight = pool.submit(upload, app.app.test_client(), image, features)
+            assert gated.started.wait(timeout=30)
+            app.models.set_default("other")
+            assert upload(client, image, features).json["model_version"] == "other"
+            gated.release.set()
+            # the request that started before the swap finishes on the version it started with
+            assert in_flight.result(timeout=30).json == before
+    finally:
+        current.model = gated.model
+
+
+def test_shadow_scores_off_the_request_path(second_version):
+    app, image, features = second_version
+    client = app.app.test_client()
+    expected = upload(client, image, features, headers={"X-Model-Version": "other"}).json["predicted_score"]
+
+    app.models.set_shadow("other")
+    response = upload(client, image, features).json
+    assert response["model_version"] == MODEL_VERSION  # the client only sees the primary score
+    app.shadow_pool.submit(lambda: None).result(timeout=30)  # one shadow thread, so the job above is done
+    lines = client.get("/metrics").get_data(as_text=True).splitlines()
+    assert 'canai_predictions_total{version="other",role="shadow"} 1.0' in lines
+    assert 'canai_shadow_abs_diff_count{version="other"} 1' in lines
+    diff = next(line for line in lines if line.startswith('canai_shadow_abs_diff_sum{version="other"}'))
+    assert float(diff.split()[-1]) == pytest.approx(abs(expected - response["predicted_score"]), abs=1e-5)
+
+
+@pytest.mark.parametrize("value, expected", [(False, False), ("false", False), ("0", False), (0, False),
+                                             (True, True), ("true", True), ("1", True)])
+def test_functional_only_flag(served, tmp_path, monkeypatch, value, expected):
+    from water_points import WaterPointIndex
+
+    app = served[0]
+    rng = np.random.default_rng(0)
+    path = tmp_path / "points.csv"
+    pd.DataFrame({"latitude": rng.uniform(-1, 1, 50), "longitude": rng.uniform(36, 38, 50),
+                  "status_id": ["Yes", "No"] * 25, "water_source_category": "Well", "pressure_score": 1.0,
+                  "water_point_population": 100.0}).to_csv(path, index=False)
+    index = WaterPointIndex(str(path))
+    monkeypatch.setattr(app, "water_points", index)
+    client = app.app.test_client()
+
+    body = {"points": [[0.0, 37.0], [0.5, 36.5]], "k": 3}
+    response = client.post("/water-points/nearest", json=dict(body, functional_only=value))
+    assert response.status_code == 200
+    assert response.json["ids"] == index.nearest([0.0, 0.5], [37.0, 36.5], k=3, functional_only=expected)[1].tolist()
+    assert client.post("/water-points/within", json=dict(body, functional_only="maybe")).status_code == 400
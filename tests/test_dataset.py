@@ -0,0 +1,40 @@
+"""
+the streaming scaler against the committed sklearn pickles, and WaterAccessDataset read a
+chunk at a time from the raw csv against the pre-scaled csv.
+"""
+import os
+
+import joblib
+import numpy as np
+import pytest
+import torch
+
+import streaming_scaler
+from dataset import CSV_PATH, MODEL_DIR, RAW_CSV_PATH, WaterAccessDataset, make_transform
+
+
+@pytest.mark.filterwarnings("ignore::UserWarning")  # pickled by another sklearn version
+def test_streamed_stats_match_pickled_scalers():
+    feature_norm, score_norm, rows = streaming_scaler.fit(RAW_CSV_PATH, chunksize=128)
+    for norm, name in ((feature_norm, "feature_scaler.pkl"), (score_norm, "score_scaler.pkl")):
+        scaler = joblib.load(os.path.join(MODEL_DIR, "scalers", name))
+        assert scaler.n_samples_seen_ == rows
+        np.testing.assert_allclose(norm.mean, scaler.mean_, rtol=1e-12)
+        np.testing.assert_allclose(norm.scale ** 2, scaler.var_, rtol=1e-12)
+
+
+def test_raw_csv_in_chunks_matches_scaled_csv(tmp_path):
+    feature_norm, score_norm, rows = streaming_scaler.fit(RAW_CSV_PATH)
+    params = str(tmp_path / "scaler_params.json")
+    streaming_scaler.save(params, feature_norm, score_norm, rows)
+
+    transform = make_transform(32)
+    scaled = WaterAccessDataset(CSV_PATH, transform=transform)
+    raw = WaterAccessDataset(RAW_CSV_PATH, transform=transform, scaler_params=params, chunksize=256)
+    assert len(raw) == len(scaled) == rows
+    for index in (0, 255, 256, rows - 1):  # either side of a chunk boundary
+        (image, tabular), label = raw[index]
+        (scaled_image, scaled_tabular), scaled_label = scaled[index]
+        assert torch.equal(image, scaled_image)
+        torch.testing.assert_close(tabular, scaled_tabular, atol=1e-5, rtol=0)
+        torch.testing.assert_close(label, scaled_label, atol=1e-5, rtol=0)
@@ -0,0 +1,89 @@
+"""
+the coordinator's one-pass split of the tile csv into shard window files, and a worker
+killed while it holds a shard: the coordinator reaps it after the heartbeat timeout and
+another worker scores the shard, giving the same grid as one process.
+"""
+import multiprocessing as mp
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from adaptive_scoring import FeatureLayers, score_cells, tile_cells
+from distributed_scoring import (free_port, load_model, make_coordinator, make_shards, merge, partition_tiles, serve,
+                                 shard_layers, worker)
+from preprocess import Preprocessor
+
+DEADLINE_SECONDS = 180
+
+
+def test_shard_layers_window(tile_data):
+    csv_path, image_dir = tile_data
+    layers = FeatureLayers.from_tiles(csv_path, image_dir)
+    rows, cols = np.array([2, 3, 5]), np.array([10, 12, 11])
+    window, local_rows, local_cols = shard_layers(layers.grid, rows, cols, csv_path, image_dir, margin=1)
+    assert window.features.shape[:2] == (6, 5)
+    np.testing.assert_array_equal(window.features[local_rows, local_cols], layers.features[rows, cols])
+    assert window.image_paths[(local_rows[0], local_cols[0])] == layers.image_paths[(2, 10)]
+
+
+@pytest.mark.parametrize("margin", [0, 2, 9])
+def test_partition_tiles_windows(tile_data, tmp_path, margin):
+    csv_path, image_dir = tile_data
+    layers = FeatureLayers.from_tiles(csv_path, image_dir)
+    shards, files = partition_tiles(csv_path, image_dir, str(tmp_path), shard_cells=8, margin=margin, chunksize=50)
+    assert shards == make_shards(layers.has_data, 8)
+    for shard, (rows, cols) in shards.items():
+        # the shard's file holds every cell of its window and nothing past the block plus margin
+        window, local_rows, local_cols = shard_layers(layers.grid, rows, cols, files[shard], image_dir, margin)
+        full, _, _ = shard_layers(layers.grid, rows, cols, csv_path, image_dir, margin)
+        np.testing.assert_array_equal(window.features, full.features)
+        assert window.image_paths == full.image_paths
+        tiles = pd.read_csv(files[shard])
+        block_rows, block_cols, _ = tile_cells(layers.grid, tiles[".geo"])
+        r0, c0 = min(rows) // 8 * 8, min(cols) // 8 * 8
+        assert block_rows.min() >= r0 - margin and block_rows.max() < r0 + 8 + margin
+        assert block_cols.min() >= c0 - margin and block_cols.max() < c0 + 8 + margin
+
+
+def test_killed_worker_shard_is_reassigned(tile_data, tmp_path):
+    csv_path, image_dir = tile_data
+    layers = FeatureLayers.from_tiles(csv_path, image_dir)
+    coordinator = make_coordinator(csv_path, image_dir, str(tmp_path), shard_cells=8, timeout=1.0)
+    address, authkey = f"127.0.0.1:{free_port()}", "test"
+    serve(coordinator, address, authkey)
+
+    ctx = mp.get_context("spawn")
+
+    def start(worker_id):
+        proc = ctx.Process(target=worker, args=(address, authkey, None, worker_id, 1, True, image_dir))
+        proc.start()
+        return proc
+
+    deadline = time.time() + DEADLINE_SECONDS
+    node0 = start("node0")
+    while "node0" not in coordinator.assigned.values():
+        assert node0.is_alive() and time.time() < deadline
+        time.sleep(0.01)
+    node0.kill()
+    node0.join()
+    lost = [shard for shard, owner in coordinator.assigned.items() if owner == "node0"]
+    assert lost and not set(lost) & set(coordinator.results)
+
+    node1 = start("node1")
+    while not coordinator.done():
+        assert time.time() < deadline
+        coordinator.reap()
+        time.sleep(0.1)
+    node1.join(timeout=30)
+
+    status = coordinator.status()
+    assert status["reassigned"] == len(lost)
+    assert status["workers"]["node0"]["dead"]
+    assert status["workers"]["node1"]["tiles"] >= sum(len(coordinator.shards[s][0]) for s in lost)
+
+    rows, cols = np.nonzero(layers.has_data)
+    model = load_model(None, random_model=True)
+    expected = score_cells(model, Preprocessor(image_size=model.image_size), layers, 1, rows, cols)
+    np.testing.assert_allclose(merge(coordinator).scores[rows, cols], expected, atol=1e-4)
@@ -0,0 +1,99 @@
+"""
+record once, then replay offline: the second run must be served entirely from the cache.
+earth engine itself is replaced by a small in-process stand-in that counts server calls.
+"""
+import importlib
+import sys
+import types
+
+import pytest
+
+
+class Expr:
+    # enough of ee.ComputedObject for the cache: an expression tree and getInfo
+    server_calls = 0
+
+    def __init__(self, *expr):
+        self.expr = expr
+
+    def getInfo(self):
+        Expr.server_calls += 1
+        if self.expr[0] == "size":
+            return 3
+        if self.expr[0] == "list":
+            return {"features": [{"id": str(i), "properties": {"tile_id": f"tile_{i}"}}
+                                 for i in range(self.expr[2], min(self.expr[2] + self.expr[1], 3))]}
+        return {"value": repr(self.expr)}
+
+    def size(self):
+        return Expr("size", self.expr)
+
+    def toList(self, count, offset):
+        return Expr("list", count, offset, self.expr)
+
+    def select(self, bands):
+        return Expr("select", self.expr, bands)
+
+    def clipToBoundsAndScale(self, geometry, scale):
+        return Expr("clip", self.expr, geometry.expr, scale)
+
+    def reduceRegion(self, reducer, geometry, scale):
+        return Expr("reduce", self.expr, reducer.expr, geometry.expr, scale)
+
+
+def compute_pixels(request):
+    Expr.server_calls += 1
+    return b"II*\x00" + repr(request["expression"].expr).encode()
+
+
+@pytest.fixture
+def ee_cache(monkeypatch):
+    ee = types.ModuleType("ee")
+    ee.ComputedObject = Expr
+    ee.FeatureCollection = lambda obj: obj
+    ee.serializer = types.SimpleNamespace(encode=lambda obj, for_cloud_api=True: {"expr": repr(obj.expr)})
+    ee.data = types.SimpleNamespace(getAlgorithms=lambda: {"algorithms": ["Image.load"]},
+                                    computePixels=compute_pixels)
+    ee.Initialize = lambda credentials="persistent", project=None: ee.data.getAlgorithms()
+    monkeypatch.setitem(sys.modules, "ee", ee)
+    Expr.server_calls = 0
+    return importlib.reload(importlib.import_module("ee_cache"))
+
+
+def run(cache):
+    image, tiles, tile = Expr("image", "srtm"), Expr("collection", "tiles"), Expr("geometry", "tile_0")
+    return (cache.info(image.size()), cache.features(tiles, page_size=2),
+            cache.reduce_region(image, Expr("mean"), tile, 30), cache.pixels(image, tile, 10))
+
+
+def test_replay_serves_second_run_offline(ee_cache, tmp_path):
+    recorder = ee_cache.EECache(str(tmp_path), mode="record")
+    recorder.initialize(project="test")
+    recorded = run(recorder)
+    assert Expr.server_calls > 0 and recorder.misses > 0
+
+    sys.modules["ee"].data.getAlgorithms = lambda: pytest.fail("replay contacted earth engine")
+    Expr.server_calls = 0
+    replay = ee_cache.EECache(str(tmp_path), mode="replay")
+    replay.initialize(project="test")
+    assert run(replay) == recorded
+    assert Expr.server_calls == 0
+    assert replay.misses == 0 and replay.hits == recorder.misses
+
+
+def test_replay_miss_raises(ee_cache, tmp_path):
+    replay = ee_cache.EECache(str(tmp_path), mode="replay")
+    with pytest.raises(ee_cache.CacheMiss):
+        replay.info(Expr("image", "not recorded"))
+
+
+def test_lru_eviction_keeps_pinned_entries(ee_cache, tmp_path):
+    recorder = ee_cache.EECache(str(tmp_path), max_bytes=10 ** 6, mode="record")
+    recorder.info(Expr("image", "fixture"))
+    cache = ee_cache.EECache(str(tmp_path), max_bytes=200, mode="cache")
+    for i in range(20):
+        cache.info(Expr("image", i))
+    stats = cache.stats()
+    assert stats["bytes"] <= 200
+    assert stats["entries"]["info"]["pinned"] == 1
+    assert cache.get(ee_cache.expression_key("info", Expr("image", "fixture"))) is not None
@@ -0,0 +1,48 @@
+"""
+the chunked feature store build against FeatureLayers.from_tiles over the same csv, with a
+replaced tile, a tile outside the grid and a tile without an image added to the fixture.
+"""
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from adaptive_scoring import TABULAR_FEATURES, FeatureLayers
+from feature_store import build
+from preprocess import Preprocessor
+
+IMAGE_SIZE = 32
+
+
+def test_build_matches_feature_layers(tile_data, tmp_path):
+    csv_path, image_dir = tile_data
+    tiles = pd.read_csv(csv_path)
+    replaced = tiles.iloc[[5]].assign(tile_id="tile_5")  # same cell and image, later row wins
+    replaced[TABULAR_FEATURES] = 1.0
+    outside = tiles.iloc[[6]].assign(tile_id="tile_6", **{".geo": tiles[".geo"][6].replace("32.", "12.")})
+    no_image = tiles.iloc[[7]].assign(tile_id="tile_gone")
+    path = tmp_path / "tiles.csv"
+    pd.concat([tiles, replaced, outside, no_image]).to_csv(path, index=False)
+
+    store = build(str(tmp_path / "store"), image_size=IMAGE_SIZE, features=str(path), image_dir=image_dir,
+                  chunksize=50)
+    layers = FeatureLayers.from_tiles(str(path), image_dir, chunksize=50)
+    cells = sorted(layers.image_paths)
+    assert len(store) == len(cells) == len(tiles)
+    rows, cols = np.array(cells).T
+    np.testing.assert_array_equal(store.cells[rows, cols], np.arange(len(cells)))
+    assert (store.cells >= 0).sum() == len(cells)
+    # from_tiles blanks a cell whose last row has no image; the store keeps the last row that has one
+    kept = store.by_tile_ids(["tile_7"])[0]
+    assert np.isnan(layers.features[rows[kept], cols[kept]]).all()
+    np.testing.assert_array_equal(store.tabular[kept], tiles.loc[7, TABULAR_FEATURES].to_numpy(np.float32))
+    others = np.arange(len(cells)) != kept
+    np.testing.assert_array_equal(store.tabular[others], layers.features[rows, cols][others])
+    assert store.tabular[store.by_tile_ids(["tile_5"])[0]].tolist() == [1.0] * len(TABULAR_FEATURES)
+
+    preprocessor = Preprocessor(image_size=IMAGE_SIZE)
+    for i in (0, 17, len(cells) - 1):
+        path = layers.image_paths[cells[i]]
+        assert store.tile_ids[i] == path.rsplit("sentinel2_", 1)[1][:-len(".png")]
+        np.testing.assert_array_equal(store.images[i], preprocessor.resize(Image.open(path).convert("RGB")))
+    np.testing.assert_array_equal(store.by_tile_ids(store.tile_ids), np.arange(len(cells)))
+    assert store.by_tile_ids(["tile_gone"]).tolist() == [-1]
@@ -0,0 +1,13 @@
+"""
+the text exposition: label values with backslashes, quotes and newlines stay one line each.
+"""
+import metrics
+
+
+def test_label_values_are_escaped():
+    registry = metrics.Registry()
+    counter = registry.counter("test_total", "help", labels=("version",))
+    counter.inc(version='a\\b"c\nd')
+    lines = registry.render().splitlines()
+    assert lines[-1] == 'test_total{version="a\\\\b\\"c\\nd"} 1.0'
+    assert len(lines) == 3  # HELP, TYPE and the sample
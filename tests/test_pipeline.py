@@ -0,0 +1,71 @@
+"""
+the pipeline runner on a toy dag in a temporary root: what a dry run leaves behind, and
+which stages are skipped below a manual stage that needs attention or a failed one.
+"""
+import os
+
+import pytest
+
+from run_pipeline import STATE_DIR, Pipeline, Stage
+
+
+def copy(src, dst):
+    def run(ctx):
+        with open(ctx.path(src)) as f, open(ctx.path(dst), "w") as out:
+            out.write(f.read())
+    return run
+
+
+def fail(ctx):
+    raise RuntimeError("boom")
+
+
+def toy_stages(manual_output="export.txt", failing=False):
+    # export (manual) -> clean -> train -> predict
+    return [
+        Stage("export", inputs=["source.txt"], outputs=[manual_output], manual="run the export by hand"),
+        Stage("clean", fail if failing else copy("export.txt", "clean.txt"), deps=["export"],
+              inputs=["export.txt"], outputs=["clean.txt"]),
+        Stage("train", copy("clean.txt", "model.txt"), deps=["clean"], inputs=["clean.txt"], outputs=["model.txt"]),
+        Stage("predict", copy("model.txt", "scores.txt"), deps=["train"], inputs=["model.txt"],
+              outputs=["scores.txt"]),
+    ]
+
+
+@pytest.fixture
+def root(tmp_path):
+    for name in ("source.txt", "export.txt"):
+        (tmp_path / name).write_text(name)
+    return str(tmp_path)
+
+
+def statuses(run):
+    return {name: r["status"] for name, r in run["stages"].items()}
+
+
+def test_dry_run_writes_nothing(root):
+    run = Pipeline(toy_stages(), root=root, jobs=2).run(dry_run=True)
+    assert statuses(run) == {"export": "accepted", "clean": "would run", "train": "would run",
+                             "predict": "would run"}
+    assert not os.path.exists(os.path.join(root, STATE_DIR))
+    assert not os.path.exists(os.path.join(root, "clean.txt"))
+
+
+def test_downstream_of_blocked_manual_stage_is_skipped(root):
+    run = Pipeline(toy_stages(manual_output="missing.txt"), root=root, jobs=2).run()
+    assert statuses(run) == {"export": "blocked", "clean": "skipped", "train": "skipped", "predict": "skipped"}
+    assert run["stages"]["clean"]["reason"] == "upstream export blocked"
+    assert run["stages"]["train"]["reason"] == "upstream clean skipped"
+
+
+def test_downstream_of_stale_manual_stage_is_skipped(root):
+    assert set(statuses(Pipeline(toy_stages(), root=root).run()).values()) == {"accepted", "ran"}
+    with open(os.path.join(root, "source.txt"), "a") as f:
+        f.write("changed")
+    run = Pipeline(toy_stages(), root=root).run()
+    assert statuses(run) == {"export": "stale", "clean": "skipped", "train": "skipped", "predict": "skipped"}
+
+
+def test_failure_skips_every_stage_below(root):
+    run = Pipeline(toy_stages(failing=True), root=root).run()
+    assert statuses(run) == {"export": "accepted", "clean": "failed", "train": "skipped", "predict": "skipped"}
@@ -0,0 +1,59 @@
+"""
+model changes made through one worker's registry reach another worker that shares the
+state file, the way gunicorn workers share MODEL_STATE_PATH.
+"""
+import os
+import time
+
+import pytest
+import torch
+
+from adaptive_scoring import TABULAR_FEATURES
+from fusion import CNNTFMModel, write_metadata
+from registry import ModelRegistry
+
+SCALERS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend", "scalers")
+
+
+def save_checkpoint(path, seed):
+    torch.manual_seed(seed)
+    torch.save(CNNTFMModel(len(TABULAR_FEATURES), image_size=112, backbone="small_cnn").state_dict(), path)
+    write_metadata(path, image_size=112, backbone="small_cnn", tabular_dim=len(TABULAR_FEATURES))
+    return path
+
+
+def wait_for(condition, timeout=30):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+@pytest.mark.filterwarnings("ignore::UserWarning")  # scalers pickled by another sklearn
+def test_changes_reach_every_worker(tmp_path):
+    first, second = (save_checkpoint(str(tmp_path / f"v{i}.pth"), seed=i) for i in (1, 2))
+    workers = []
+    for _ in range(2):
+        registry = ModelRegistry(len(TABULAR_FEATURES), os.path.join(SCALERS, "feature_scaler.pkl"),
+                                 os.path.join(SCALERS, "score_scaler.pkl"), state_path=str(tmp_path / "state.json"),
+                                 poll_seconds=0)
+        registry.load("v1", first, make_default=True)
+        workers.append(registry)
+    a, b = workers
+    a.update(lambda state: state.update(versions={"v1": first}, default="v1", shadow=None))
+
+    a.add("v2", second, make_default=True)
+    wait_for(lambda: a.default == "v2")
+    b.poll()
+    assert b.default == "v1"  # until its own copy has loaded
+    wait_for(lambda: b.default == "v2")
+    assert set(b.versions) == {"v1", "v2"}
+
+    a.set_shadow("v1")
+    b.poll()
+    assert b.get_shadow() is b.versions["v1"]
+
+    a.set_default("v1")
+    a.unload("v2")
+    b.poll()
+    assert (b.default, b.shadow, set(b.versions)) == ("v1", "v1", {"v1"})
@@ -0,0 +1,103 @@
+"""
+ScoreGrid windows and zone masks against a brute force cell-centre test.
+"""
+import numpy as np
+import pytest
+
+from score_grid import ScoreGrid
+
+
+def centre_inside(grid, rows, cols, rings):
+    # even-odd over every ring, one cell centre at a time
+    lon, lat = grid.cell_centers(rows, cols)
+    inside = False
+    for ring in rings:
+        for (x0, y0), (x1, y1) in zip(ring[:-1], ring[1:]):
+            if (y0 > lat) != (y1 > lat) and lon < x0 + (lat - y0) * (x1 - x0) / (y1 - y0):
+                inside = not inside
+    return inside
+
+
+def brute_force_mask(grid, geometry):
+    polygons = [geometry["coordinates"]] if geometry["type"] == "Polygon" else geometry["coordinates"]
+    rings = [ring for polygon in polygons for ring in polygon]
+    mask = np.zeros((grid.height, grid.width), dtype=bool)
+    for row in range(grid.height):
+        for col in range(grid.width):
+            mask[row, col] = centre_inside(grid, row, col, rings)
+    return mask
+
+
+def full_mask(grid, geometry):
+    rows, cols, inside = grid.mask(geometry)
+    mask = np.zeros((grid.height, grid.width), dtype=bool)
+    mask[rows, cols] = inside
+    return mask
+
+
+@pytest.fixture
+def grid():
+    grid = ScoreGrid(bounds=[0.0, 0.0, 1.0, 0.5], cell_size=0.05)  # 10 rows x 20 cols
+    grid.scores[:] = np.arange(grid.height * grid.width, dtype=np.float32).reshape(grid.height, grid.width)
+    return grid
+
+
+def test_window_is_view_with_transform(grid):
+    window, transform = grid.window(0.12, 0.21, 0.33, 0.39)
+    assert window.shape == (4, 5)  # rows 2-5, cols 2-6
+    assert np.shares_memory(window, grid.scores)
+    np.testing.assert_array_equal(window, grid.scores[2:6, 2:7])
+    assert transform == pytest.approx((0.05, 0.0, 0.1, 0.0, -0.05, 0.4))
+
+
+def test_window_clipped_to_grid(grid):
+    window, transform = grid.window(-5.0, -5.0, 0.07, 5.0)
+    assert window.shape == (10, 2)
+    assert transform[2] == 0.0 and transform[5] == 0.5
+    assert grid.window(2.0, 2.0, 3.0, 3.0)[0].size == 0
+
+
+@pytest.mark.parametrize("geometry", [
+    {"type": "Polygon", "coordinates": [[[0.1, 0.1], [0.9, 0.05], [0.6, 0.45], [0.1, 0.1]]]},
+    {"type": "Polygon", "coordinates": [  # square with a hole
+        [[0.1, 0.1], [0.7, 0.1], [0.7, 0.4], [0.1, 0.4], [0.1, 0.1]],
+        [[0.3, 0.2], [0.5, 0.2], [0.5, 0.3], [0.3, 0.3], [0.3, 0.2]]]},
+    {"type": "MultiPolygon", "coordinates": [
+        [[[0.0, 0.0], [0.2, 0.0], [0.2, 0.21], [0.0, 0.0]]],
+        [[[0.5, 0.3], [0.95, 0.3], [0.95, 0.48], [0.5, 0.48], [0.5, 0.3]]]]},
+    {"type": "Polygon", "coordinates": [[[-1.0, -1.0], [2.0, -1.0], [2.0, 0.23], [-1.0, 0.23], [-1.0, -1.0]]]},
+])
+def test_mask_matches_cell_centres(grid, geometry):
+    np.testing.assert_array_equal(full_mask(grid, geometry), brute_force_mask(grid, geometry))
+
+
+def test_mask_cached_per_geometry(grid):
+    geometry = {"type": "Feature", "properties": {},
+                "geometry": {"type": "Polygon", "coordinates": [[[0.1, 0.1], [0.3, 0.1], [0.3, 0.3], [0.1, 0.1]]]}}
+    first = grid.mask(geometry)
+    assert grid.mask(geometry) is first
+    assert (grid.mask_hits, grid.mask_misses) == (1, 1)
+
+
+def test_mask_rejects_other_geometries(grid):
+    with pytest.raises(ValueError):
+        grid.mask({"type": "Point", "coordinates": [0.5, 0.25]})
+
+
+def test_zonal_stats(grid):
+    # rows 2-3, cols 2-3 by cell centre; one of them unscored
+    grid.scores[3, 3] = np.nan
+    square = {"type": "Polygon", "coordinates": [[[0.1, 0.3], [0.2, 0.3], [0.2, 0.4], [0.1, 0.4], [0.1, 0.3]]]}
+    stats = grid.zonal_stats(square)
+    values = np.array([grid.scores[2, 2], grid.scores[2, 3], grid.scores[3, 2]])
+    assert (stats["cells"], stats["count"]) == (4, 3)
+    assert stats["mean"] == pytest.approx(values.mean())
+    assert (stats["min"], stats["max"]) == (values.min(), values.max())
+
+
+def test_save_load_round_trip(grid, tmp_path):
+    path = str(tmp_path / "grid.npz")
+    grid.save(path)
+    loaded = ScoreGrid.load(path)
+    assert loaded.transform == grid.transform
+    np.testing.assert_array_equal(loaded.scores, grid.scores)
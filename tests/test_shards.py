@@ -0,0 +1,61 @@
+"""
+shards written from the csv a chunk at a time keep the fixed train/val split, and under
+DDP every rank reads the same number of rows (uneven counts would hang the all-reduce).
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import shards
+from shards import ShardedTileDataset, convert
+from train import split_dataset
+
+
+@pytest.fixture
+def table(tile_data, tmp_path):
+    # the numeric layout convert expects: tile_id, score and the tabular columns
+    csv_path, image_dir = tile_data
+    df = pd.read_csv(csv_path).drop(columns=[".geo"]).head(50)
+    path = tmp_path / "tile_features_scaled.csv"
+    df.to_csv(path, index=False)
+    return str(path), image_dir, df
+
+
+def read_ids(root):
+    dataset = ShardedTileDataset(root, image_size=112, shuffle=False)
+    return [tid.decode() for path in dataset.paths for tid in shards.read_shard(path)["tile_ids"]]
+
+
+def test_convert_in_chunks_keeps_split(table, tmp_path):
+    csv_path, image_dir, df = table
+    out = str(tmp_path / "shards")
+    convert(out, csv_path, image_dir, shard_size=8, image_size=112, split=True, chunksize=7)
+
+    _, val_split = split_dataset(range(len(df)))
+    train_ids, val_ids = read_ids(os.path.join(out, "train")), read_ids(os.path.join(out, "val"))
+    assert val_ids == df["tile_id"].iloc[sorted(val_split.indices)].tolist()
+    assert sorted(train_ids + val_ids) == sorted(df["tile_id"])
+
+
+@pytest.mark.filterwarnings("ignore:7 shards")
+@pytest.mark.parametrize("world", [3, 8])
+def test_ranks_read_equal_rows(table, tmp_path, monkeypatch, world):
+    # 50 rows in 7 shards: 3 ranks get whole shards, 8 ranks have to stripe rows
+    csv_path, image_dir, _ = table
+    out = str(tmp_path / "shards")
+    convert(out, csv_path, image_dir, shard_size=8, image_size=112)
+    monkeypatch.setattr(shards.dist, "is_initialized", lambda: True)
+    monkeypatch.setattr(shards.dist, "get_world_size", lambda: world)
+
+    rows, labels = [], []
+    for rank in range(world):
+        monkeypatch.setattr(shards.dist, "get_rank", lambda rank=rank: rank)
+        dataset = ShardedTileDataset(out, image_size=112, shuffle_buffer=4)
+        got = [float(label) for _, label in dataset]
+        rows.append(len(got))
+        labels.append(got)
+    assert len(set(rows)) == 1 and rows[0] > 0
+    flat = [label for per_rank in labels for label in per_rank]
+    assert len(set(flat)) == len(flat)  # no row read by two ranks
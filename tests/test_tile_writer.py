@@ -0,0 +1,152 @@
+"""
+scored tiles written batch by batch read back with the same ids, scores and cell geometry.
+FlatGeobuf is checked structurally and, with pyogrio, read back through gdal; GeoParquet
+needs pyarrow.
+"""
+import gzip
+import json
+import struct
+
+import numpy as np
+import pytest
+
+from score_grid import ScoreGrid
+from tile_writer import (FlatGeobufWriter, batches_from_csv, batches_from_grid, cell_polygon, grid_definition,
+                         open_writer)
+
+
+@pytest.fixture
+def scored():
+    # 30 scored cells of a small grid, written in batches of 8
+    grid = ScoreGrid(bounds=[32.0, 0.5, 32.2, 0.6], cell_size=0.01)
+    rng = np.random.default_rng(0)
+    cells = rng.choice(grid.height * grid.width, 30, replace=False)
+    rows, cols = np.divmod(cells, grid.width)
+    scores = rng.normal(1.0, 0.3, 30).astype(np.float32)
+    tile_ids = [f"tile_{i}" for i in range(30)]
+    return grid, rows, cols, scores, tile_ids
+
+
+def write(path, grid, rows, cols, scores, tile_ids, **kwargs):
+    with open_writer(path, grid, **kwargs) as writer:
+        for start in range(0, len(rows), 8):
+            writer.write(rows[start:start + 8], cols[start:start + 8], scores[start:start + 8],
+                         tile_ids[start:start + 8])
+    return writer
+
+
+@pytest.mark.parametrize("name", ["tiles.geojsonl", "tiles.geojsonl.gz"])
+def test_geojson_seq_round_trip(scored, tmp_path, name):
+    grid, rows, cols, scores, tile_ids = scored
+    path = str(tmp_path / name)
+    assert write(path, grid, rows, cols, scores, tile_ids, precision=6).count == len(rows)
+
+    with (gzip.open(path, "rt") if name.endswith(".gz") else open(path)) as f:
+        features = [json.loads(line) for line in f]
+    definition = grid_definition(grid)
+    assert [f["properties"]["tile_id"] for f in features] == tile_ids
+    # shortest float32 text, so it parses back to the same float32
+    np.testing.assert_array_equal(np.float32([f["properties"]["score"] for f in features]), scores)
+    for feature, row, col in zip(features, rows, cols):
+        assert feature["geometry"]["type"] == "Polygon"
+        np.testing.assert_allclose(feature["geometry"]["coordinates"][0], cell_polygon(definition, row, col),
+                                   atol=1e-6)
+
+
+def test_geojson_seq_elided_geometry(scored, tmp_path):
+    grid, rows, cols, scores, tile_ids = scored
+    path = str(tmp_path / "tiles.geojsonl")
+    write(path, grid, rows, cols, scores, tile_ids, elide_geometry=True)
+
+    with open(path + ".grid.json") as f:
+        assert json.load(f) == grid_definition(grid)
+    with open(path) as f:
+        features = [json.loads(line) for line in f]
+    assert all(f["geometry"] is None for f in features)
+    assert [(f["properties"]["row"], f["properties"]["col"]) for f in features] == list(zip(rows, cols))
+
+
+def test_flatgeobuf_layout(scored, tmp_path):
+    grid, rows, cols, scores, tile_ids = scored
+    path = str(tmp_path / "tiles.fgb")
+    writer = write(path, grid, rows, cols, scores, tile_ids)
+    with open(path, "rb") as f:
+        data = f.read()
+
+    assert data[:8] == FlatGeobufWriter.MAGIC
+    count, = struct.unpack_from("<Q", data, writer.header_marks["features_count"])
+    envelope = struct.unpack_from("<4d", data, writer.header_marks["envelope"])
+    assert count == len(rows)
+    size = grid.cell_size
+    assert envelope == pytest.approx([grid.west + cols.min() * size, grid.north - (rows.max() + 1) * size,
+                                      grid.west + (cols.max() + 1) * size, grid.north - rows.min() * size])
+
+    # size-prefixed header, then one size-prefixed feature per tile, and nothing after
+    offset = 8 + 4 + struct.unpack_from("<I", data, 8)[0]
+    features = []
+    while offset < len(data):
+        length, = struct.unpack_from("<I", data, offset)
+        features.append(data[offset + 4:offset + 4 + length])
+        offset += 4 + length
+    assert offset == len(data) and len(features) == len(rows)
+    for feature, tile_id, score in zip(features, tile_ids, scores):
+        assert tile_id.encode() in feature
+        assert struct.pack("<f", score) in feature
+
+
+def wkb_ring(wkb):
+    # exterior ring of a little-endian 2d wkb polygon
+    order, kind, rings, points = struct.unpack_from("<BIII", wkb)
+    assert (order, kind, rings) == (1, 3, 1)
+    return np.frombuffer(wkb, dtype="<f8", count=2 * points, offset=13).reshape(points, 2)
+
+
+@pytest.mark.parametrize("elide_geometry", [False, True])
+def test_flatgeobuf_round_trip(scored, tmp_path, elide_geometry):
+    # read back by gdal's FlatGeobuf driver, which also reads files without a spatial index
+    raw = pytest.importorskip("pyogrio.raw")
+    grid, rows, cols, scores, tile_ids = scored
+    path = str(tmp_path / "tiles.fgb")
+    write(path, grid, rows, cols, scores, tile_ids, elide_geometry=elide_geometry)
+
+    meta, _, geometry, fields = raw.read(path)
+    values = dict(zip(meta["fields"], fields))
+    assert values["tile_id"].tolist() == tile_ids
+    np.testing.assert_array_equal(values["score"], scores)
+    if elide_geometry:
+        assert values["row"].tolist() == rows.tolist() and values["col"].tolist() == cols.tolist()
+        return
+    assert meta["crs"] == "EPSG:4326" and meta["geometry_type"] == "Polygon"
+    definition = grid_definition(grid)
+    for wkb, row, col in zip(geometry, rows, cols):
+        np.testing.assert_allclose(wkb_ring(wkb), cell_polygon(definition, row, col), atol=1e-9)
+
+
+def test_geoparquet_round_trip(scored, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    grid, rows, cols, scores, tile_ids = scored
+    path = str(tmp_path / "tiles.parquet")
+    write(path, grid, rows, cols, scores, tile_ids)
+
+    table = pq.read_table(path)
+    assert table.column("tile_id").to_pylist() == tile_ids
+    np.testing.assert_array_equal(table.column("score").to_numpy(), scores)
+    geo = json.loads(table.schema.metadata[b"geo"])
+    assert geo["columns"]["geometry"]["encoding"] == "WKB"
+
+
+def test_batches_from_grid_and_csv(scored, tmp_path):
+    grid, rows, cols, scores, tile_ids = scored
+    grid.scores[rows, cols] = scores
+    got = [batch for batch in batches_from_grid(grid, batch_rows=40)]
+    assert sum(len(b[0]) for b in got) == len(rows)
+    cells = {(r, c): s for b in got for r, c, s in zip(b[0], b[1], b[2])}
+    assert cells == {(r, c): s for r, c, s in zip(rows, cols, scores)}
+
+    lon, lat = grid.cell_centers(rows, cols)
+    path = tmp_path / "predictions.csv"
+    path.write_text("tile_id,lon,lat,score\n" + "".join(
+        f"{t},{x},{y},{s}\n" for t, x, y, s in zip(tile_ids, lon, lat, scores)))
+    batches = list(batches_from_csv(str(path), grid, batch_rows=7))
+    np.testing.assert_array_equal(np.concatenate([b[0] for b in batches]), rows)
+    np.testing.assert_array_equal(np.concatenate([b[1] for b in batches]), cols)
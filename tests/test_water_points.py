@@ -0,0 +1,62 @@
+"""
+WaterPointIndex queries on the unit-sphere kd-trees against brute force haversine over
+every point.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from water_points import EARTH_RADIUS_M, WaterPointIndex
+
+
+def haversine_m(lat, lon, lats, lons):
+    lat, lon, lats, lons = map(np.radians, (lat, lon, lats, lons))
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+@pytest.fixture(scope="module")
+def points(tmp_path_factory):
+    # kenya-sized cloud plus a few far away points (other hemisphere, across the antimeridian)
+    rng = np.random.default_rng(0)
+    n = 2000
+    df = pd.DataFrame({
+        "latitude": np.concatenate([rng.uniform(-4.7, 5.0, n - 3), [-60.0, 70.0, 1.0]]),
+        "longitude": np.concatenate([rng.uniform(33.9, 41.9, n - 3), [-120.0, 179.9, -179.9]]),
+        "status_id": rng.choice(["Yes", "No", None], n),
+        "water_source_category": rng.choice(["Well", "Tap", None], n),
+        "pressure_score": rng.uniform(0, 5, n),
+        "water_point_population": rng.uniform(0, 1000, n),
+    })
+    path = tmp_path_factory.mktemp("water") / "points.csv"
+    df.to_csv(path, index=False)
+    return WaterPointIndex(str(path)), df
+
+
+QUERIES = np.array([[0.0, 37.0], [-1.29, 36.82], [4.9, 41.8], [1.0, 179.95], [-89.0, 0.0]])
+
+
+@pytest.mark.parametrize("functional_only", [False, True])
+def test_nearest_matches_brute_force_haversine(points, functional_only):
+    index, df = points
+    candidates = np.flatnonzero(df["status_id"] == "Yes") if functional_only else np.arange(len(df))
+    distances, ids = index.nearest(QUERIES[:, 0], QUERIES[:, 1], k=7, functional_only=functional_only)
+    for (lat, lon), row_dist, row_ids in zip(QUERIES, distances, ids):
+        brute = haversine_m(lat, lon, df["latitude"].to_numpy()[candidates], df["longitude"].to_numpy()[candidates])
+        order = np.argsort(brute)[:7]
+        np.testing.assert_array_equal(row_ids, candidates[order])
+        np.testing.assert_allclose(row_dist, brute[order], rtol=1e-9, atol=1e-3)
+
+
+def test_nearest_max_distance_and_within(points):
+    index, df = points
+    lats, lons = df["latitude"].to_numpy(), df["longitude"].to_numpy()
+    distances, ids = index.nearest(QUERIES[:, 0], QUERIES[:, 1], k=20, max_distance_m=30_000)
+    hits = index.within(QUERIES[:, 0], QUERIES[:, 1], 30_000)
+    for (lat, lon), row_dist, row_ids, hit in zip(QUERIES, distances, ids, hits):
+        brute = haversine_m(lat, lon, lats, lons)
+        inside = np.flatnonzero(brute <= 30_000)
+        expected = inside[np.argsort(brute[inside])]
+        np.testing.assert_array_equal(hit, expected)
+        np.testing.assert_array_equal(row_ids[row_ids >= 0], expected[:20])
+        assert np.isinf(row_dist[row_ids < 0]).all()